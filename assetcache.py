@@ -0,0 +1,122 @@
+from singleton import Singleton
+
+from kivy.core.image import Image as CoreImage
+
+from collections import OrderedDict
+
+from pixelcache import PixelCache
+
+class AssetCacheEntry:
+	def __init__(self, source):
+		self.source = source
+		# Kivy keeps its own copy of every image loaded without nocache, this cache is meant to be the only one.
+		self.texture = CoreImage(source, nocache = True).texture
+		width, height = self.texture.size
+		self.memory = width * height * 4
+		self.references = 0
+		self.valid = True
+
+@Singleton
+class AssetCache:
+	# Decodes every image file once and hands out its texture, or regions of it, counting who holds them. Entries
+	# nobody holds stay loaded, from the least recently used one, while the memory budget allows it.
+
+	def __init__(self, memoryBudget = 256 << 20):
+		self.__memoryBudget = memoryBudget
+		self.__entries = OrderedDict()
+		self.__textureToEntry = {}
+		self.__memory = 0
+		self.__hits = 0
+		self.__misses = 0
+		self.__evictions = 0
+
+	def __dropEntry(self, entry):
+		self.__memory -= entry.memory
+		del self.__textureToEntry[entry.texture]
+		# Pixels read from the texture, or from any region of it, would otherwise outlive it.
+		PixelCache.Instance().releaseTexture(entry.texture)
+		PixelCache.Instance().invalidateSource(entry.source)
+
+	def __evict(self):
+		if (self.__memory <= self.__memoryBudget):
+			return
+
+		for source, entry in self.__entries.items():
+			if (entry.references == 0):
+				del self.__entries[source]
+				self.__dropEntry(entry)
+				self.__evictions += 1
+				if (self.__memory <= self.__memoryBudget):
+					break
+
+	def __acquireEntry(self, source):
+		entry = self.__entries.pop(source, None)
+		if (entry is None):
+			entry = AssetCacheEntry(source)
+			self.__textureToEntry[entry.texture] = entry
+			# Images of the texture, and of its regions below, are read from the PixelCache by source.
+			PixelCache.Instance().setTextureSource(entry.texture, source)
+			self.__memory += entry.memory
+			self.__misses += 1
+		else:
+			self.__hits += 1
+
+		# Put back at the end, the most recently used one.
+		self.__entries[source] = entry
+		entry.references += 1
+		self.__evict()
+		return entry
+
+	# Shared texture of the whole image, to be given back through release.
+	def acquire(self, source):
+		return self.__acquireEntry(source).texture
+
+	# Texture of the (x, y, width, height) region of the image, in kivy coordinates, to be given back through release.
+	def acquireRegion(self, source, x, y, width, height):
+		entry = self.__acquireEntry(source)
+		region = entry.texture.get_region(x, y, width, height)
+		self.__textureToEntry[region] = entry
+		PixelCache.Instance().setTextureSource(region, source, (x, y, width, height), entry.texture)
+		return region
+
+	def release(self, texture):
+		entry = self.__textureToEntry[texture]
+		if (texture is not entry.texture):
+			del self.__textureToEntry[texture]
+			PixelCache.Instance().releaseTexture(texture)
+
+		entry.references -= 1
+		assert entry.references >= 0, 'Texture of ' + entry.source + ' released too many times.'
+		if (entry.references == 0):
+			if (entry.valid == False):
+				self.__dropEntry(entry)
+			else:
+				self.__evict()
+
+	# The file changed, the next acquire decodes it again. Textures still held keep the former pixels.
+	def invalidate(self, source):
+		entry = self.__entries.pop(source, None)
+		if (entry is None):
+			return
+
+		entry.valid = False
+		if (entry.references == 0):
+			self.__dropEntry(entry)
+
+	def setMemoryBudget(self, memoryBudget):
+		self.__memoryBudget = memoryBudget
+		self.__evict()
+
+	def getMemoryBudget(self):
+		return self.__memoryBudget
+
+	def getStatistics(self):
+		return {
+			'hits' : self.__hits,
+			'misses' : self.__misses,
+			'evictions' : self.__evictions,
+			'memory' : self.__memory,
+			'memoryBudget' : self.__memoryBudget,
+			'entries' : len(self.__entries),
+			'referencedEntries' : len([entry for entry in self.__entries.values() if entry.references != 0]),
+		}
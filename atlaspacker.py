@@ -0,0 +1,224 @@
+class MaxRectsBin:
+	def __init__(self, width, height, padding = 0):
+		self.__width = width
+		self.__height = height
+		self.__padding = padding
+		self.__usedArea = 0
+		self.__usedWidth = 0
+		self.__usedHeight = 0
+		self.__freeRects = [(0, 0, width + padding, height + padding)]
+
+	def __findPosition(self, width, height):
+		# Best short side fit: the free rect leaving the smallest leftover on its tighter side wins.
+		bestRect = None
+		bestShortSide = None
+		bestLongSide = None
+		for x, y, w, h in self.__freeRects:
+			if (w >= width and h >= height):
+				leftoverX = w - width
+				leftoverY = h - height
+				shortSide = min(leftoverX, leftoverY)
+				longSide = max(leftoverX, leftoverY)
+				if (bestRect is None or shortSide < bestShortSide or
+						(shortSide == bestShortSide and longSide < bestLongSide)):
+					bestRect = (x, y)
+					bestShortSide = shortSide
+					bestLongSide = longSide
+
+		return bestRect
+
+	def __splitFreeRects(self, usedX, usedY, usedWidth, usedHeight):
+		keptRects = []
+		newRects = []
+		usedRight = usedX + usedWidth
+		usedTop = usedY + usedHeight
+		for freeRect in self.__freeRects:
+			x, y, w, h = freeRect
+			if (usedX >= x + w or usedRight <= x or usedY >= y + h or usedTop <= y):
+				keptRects.append(freeRect)
+				continue
+
+			if (usedX > x):
+				newRects.append((x, y, usedX - x, h))
+			if (usedRight < x + w):
+				newRects.append((usedRight, y, x + w - usedRight, h))
+			if (usedY > y):
+				newRects.append((x, y, w, usedY - y))
+			if (usedTop < y + h):
+				newRects.append((x, usedTop, w, y + h - usedTop))
+
+		self.__freeRects = self.__pruneFreeRects(keptRects, newRects)
+
+	def __pruneFreeRects(self, keptRects, newRects):
+		# Kept rects were already maximal among themselves, so only pairs involving a new rect need checking.
+		prunedNewRects = []
+		for i in range(len(newRects)):
+			rect = newRects[i]
+			contained = False
+			for other in keptRects:
+				if (self.__contains(other, rect) == True):
+					contained = True
+					break
+			if (contained == False):
+				for j in range(len(newRects)):
+					other = newRects[j]
+					if (i != j and self.__contains(other, rect) == True and (other != rect or j < i)):
+						contained = True
+						break
+			if (contained == False):
+				prunedNewRects.append(rect)
+
+		prunedRects = []
+		for rect in keptRects:
+			contained = False
+			for other in prunedNewRects:
+				if (self.__contains(other, rect) == True):
+					contained = True
+					break
+			if (contained == False):
+				prunedRects.append(rect)
+
+		prunedRects.extend(prunedNewRects)
+		return prunedRects
+
+	def __contains(self, outer, inner):
+		return (inner[0] >= outer[0] and inner[1] >= outer[1] and inner[0] + inner[2] <= outer[0] + outer[2] and
+			inner[1] + inner[3] <= outer[1] + outer[3])
+
+	@staticmethod
+	def __merge(rect, other):
+		# Union of two rects sharing a whole side, None for any other pair.
+		x, y, w, h = rect
+		ox, oy, ow, oh = other
+		if (y == oy and h == oh and (x + w == ox or ox + ow == x)):
+			return (min(x, ox), y, w + ow, h)
+		if (x == ox and w == ow and (y + h == oy or oy + oh == y)):
+			return (x, min(y, oy), w, h + oh)
+		return None
+
+	# Gives back the space of a rect placed at (x, y) by insert, joined with the free rects it completes.
+	def free(self, x, y, width, height):
+		rect = (x, y, width + self.__padding, height + self.__padding)
+		merged = True
+		while (merged == True):
+			merged = False
+			for other in self.__freeRects:
+				union = self.__merge(rect, other)
+				if (union is not None):
+					rect = union
+					merged = True
+					break
+
+		self.__freeRects = self.__pruneFreeRects(self.__freeRects, [rect])
+		self.__usedArea -= width * height
+
+	def insert(self, width, height):
+		paddedWidth = width + self.__padding
+		paddedHeight = height + self.__padding
+		position = self.__findPosition(paddedWidth, paddedHeight)
+		if (position is None):
+			return None
+
+		x, y = position
+		self.__splitFreeRects(x, y, paddedWidth, paddedHeight)
+		self.__usedArea += width * height
+		self.__usedWidth = max(self.__usedWidth, x + width)
+		self.__usedHeight = max(self.__usedHeight, y + height)
+		return position
+
+	def getSize(self):
+		return (self.__width, self.__height)
+
+	def getUsedSize(self):
+		return (self.__usedWidth, self.__usedHeight)
+
+	def getOccupancy(self):
+		return float(self.__usedArea) / float(self.__width * self.__height)
+
+def nextPowerOfTwo(value):
+	power = 1
+	while power < value:
+		power *= 2
+	return power
+
+def largestPowerOfTwoUpTo(value):
+	power = 1
+	while power * 2 <= value:
+		power *= 2
+	return power
+
+def _growSide(value, powerOfTwo, maxSize):
+	if (powerOfTwo == True):
+		return min(nextPowerOfTwo(value + 1), maxSize)
+	else:
+		return min(value + max(1, value // 8), maxSize)
+
+def _packInBin(sizes, order, binWidth, binHeight, powerOfTwo, padding):
+	# Returns the used size and the positions, or None when the sizes do not all fit.
+	packingBin = MaxRectsBin(binWidth, binHeight, padding)
+	positions = [None] * len(sizes)
+	for i in order:
+		position = packingBin.insert(*sizes[i])
+		if (position is None):
+			return None
+		positions[i] = position
+
+	usedWidth, usedHeight = packingBin.getUsedSize()
+	if (powerOfTwo == True):
+		usedWidth = nextPowerOfTwo(usedWidth)
+		usedHeight = nextPowerOfTwo(usedHeight)
+	return (usedWidth, usedHeight), positions
+
+def packRects(sizes, maxSize = 4096, powerOfTwo = True, padding = 0):
+	# Returns the atlas size and the position of every size given, packed from the (0, 0) corner. The atlas starts
+	# from the smallest size that could hold the total area and grows, alternating sides, until everything fits.
+	if (sizes == []):
+		return (0, 0), []
+
+	if (powerOfTwo == True):
+		maxSize = largestPowerOfTwoUpTo(maxSize)
+
+	totalArea = 0
+	minWidth = 0
+	minHeight = 0
+	for width, height in sizes:
+		assert width > 0 and height > 0, 'Invalid size to pack: ' + str((width, height)) + '.'
+		totalArea += (width + padding) * (height + padding)
+		minWidth = max(minWidth, width)
+		minHeight = max(minHeight, height)
+
+	if (minWidth > maxSize or minHeight > maxSize):
+		raise Exception('A tile is bigger than the maximum atlas size (' + str(maxSize) + ').')
+
+	order = sorted(range(len(sizes)), key = lambda i: (max(sizes[i]), min(sizes[i])), reverse = True)
+
+	side = int(totalArea ** 0.5)
+	binWidth = min(max(minWidth, side), maxSize)
+	binHeight = min(max(minHeight, side), maxSize)
+	if (powerOfTwo == True):
+		binWidth = nextPowerOfTwo(binWidth)
+		binHeight = nextPowerOfTwo(binHeight)
+
+	# Rounding the square up can double its area, a bin half as high may still hold everything and is tried first.
+	halfHeight = binHeight // 2
+	if (halfHeight >= minHeight and binWidth * halfHeight >= totalArea):
+		result = _packInBin(sizes, order, binWidth, halfHeight, powerOfTwo, padding)
+		if (result is not None):
+			return result
+
+	growWidth = True
+	while True:
+		result = _packInBin(sizes, order, binWidth, binHeight, powerOfTwo, padding)
+		if (result is not None):
+			return result
+
+		canGrowWidth = binWidth < maxSize
+		canGrowHeight = binHeight < maxSize
+		if (canGrowWidth == False and canGrowHeight == False):
+			raise Exception('Tiles do not fit in a ' + str(maxSize) + 'x' + str(maxSize) + ' atlas.')
+
+		if ((growWidth == True and canGrowWidth == True) or canGrowHeight == False):
+			binWidth = _growSide(binWidth, powerOfTwo, maxSize)
+		else:
+			binHeight = _growSide(binHeight, powerOfTwo, maxSize)
+		growWidth = not growWidth
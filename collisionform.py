@@ -11,7 +11,7 @@ from kivy.uix.label import Label
 
 from math import ceil
 
-from editorutils import AutoReloadTexture, CancelableButton, vector2Multiply, distance
+from editorutils import CancelableButton, vector2Multiply, distance, SpriteImage
 from editorheritage import SpecialScrollControl, SpaceLimitedObject
 from collisioninfo import CollisionPartInformation
 from keyboard import KeyboardAccess, KeyboardGuardian
@@ -22,10 +22,12 @@ class CollisionPartDisplay(RelativeLayout):
 		if (obj is None):
 			return
 
-		self.__texture = AutoReloadTexture(obj.getBaseSize(), obj.getImage())
 		super(CollisionPartDisplay, self).__init__(size_hint = (None, None), size = obj.getBaseSize())
 		self.__image = Scatter(do_rotation = False, do_translation = False, do_scale = False)
-		im = Image(texture = self.__texture.getTexture(), size = obj.getBaseSize(), allow_strech = True)
+		# The region of the sprite atlas refills itself when the gl context is lost, no copy is needed. It holds the
+		# pixels before any flip, so those of obj are drawn through the texture coordinates like in the scene.
+		im = SpriteImage(obj.getAtlasRegion().getTexture(), obj.getBaseSize())
+		im.setFlip(obj.getFlipX(), obj.getFlipY())
 		self.__image.add_widget(im)
 		self.__image.size = obj.getBaseSize()
 		self.__operation = None
@@ -0,0 +1,28 @@
+def strToDoubleFloatTuple(s):
+	assert(type(s) is str)
+	splitted = s.split(',')
+	assert(len(splitted) == 2)
+	x = float(splitted[0].replace('(', ''))
+	y = float(splitted[1].replace(')', ''))
+	return (x, y)
+
+def strToDoubleIntTuple(s):
+	assert(type(s) is str)
+	splitted = s.split(',')
+	assert(len(splitted) == 2)
+	x = int(splitted[0].replace('(', ''))
+	y = int(splitted[1].replace(')', ''))
+	return (x, y)
+
+def boolToStr(b):
+	if (b == True):
+		return 'true'
+	else:
+		return 'false'
+
+def strToBool(s):
+	assert(s in ['true', 'false'])
+	if (s == 'true'):
+		return True
+	else:
+		return False
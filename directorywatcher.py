@@ -0,0 +1,170 @@
+from kivy.clock import Clock
+
+from ctypes import CDLL, c_int, c_char_p, c_uint32, get_errno
+from ctypes.util import find_library
+from os import listdir, stat, read, close
+from os.path import join, isfile
+from struct import unpack_from, calcsize
+
+# inotify flags, from sys/inotify.h.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0x00000800
+
+class InotifyBackend:
+	# Reports the names touched inside one directory, read without blocking from an inotify descriptor.
+	__eventHeader = 'iIII'
+
+	def __init__(self, path):
+		libraryName = find_library('c')
+		if (libraryName is None):
+			raise OSError('C library not found.')
+
+		libc = CDLL(libraryName, use_errno = True)
+		if (hasattr(libc, 'inotify_init1') == False):
+			raise OSError('inotify is not available.')
+		libc.inotify_init1.argtypes = [c_int]
+		libc.inotify_add_watch.argtypes = [c_int, c_char_p, c_uint32]
+
+		self.__fd = libc.inotify_init1(IN_NONBLOCK)
+		if (self.__fd < 0):
+			raise OSError(get_errno(), 'inotify_init1 failed.')
+
+		# Files are only reported once closed after writing, never while an application is still saving them.
+		mask = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+		if (libc.inotify_add_watch(self.__fd, path, mask) < 0):
+			errno = get_errno()
+			close(self.__fd)
+			raise OSError(errno, 'inotify_add_watch failed on ' + path + '.')
+
+	# Returns the names changed since the last call, or None when events were lost and everything must be checked.
+	def getChangedNames(self):
+		names = set()
+		headerSize = calcsize(self.__eventHeader)
+		while True:
+			try:
+				data = read(self.__fd, 65536)
+			except OSError:
+				# EAGAIN, nothing left to read.
+				break
+
+			offset = 0
+			while (offset + headerSize <= len(data)):
+				wd, mask, cookie, length = unpack_from(self.__eventHeader, data, offset)
+				offset += headerSize
+				if (mask & IN_Q_OVERFLOW != 0):
+					names = None
+				elif (names is not None and length != 0):
+					names.add(data[offset:offset + length].rstrip(b'\0'))
+				offset += length
+
+		return names
+
+	def close(self):
+		close(self.__fd)
+
+class PollingBackend:
+	def getChangedNames(self):
+		return None
+
+	def close(self):
+		pass
+
+class DirectoryWatcher:
+	# Calls changedMethod(added, removed, modified) on the kivy thread with the names of the files of a directory
+	# that changed. The directory is followed with inotify when available, and otherwise by comparing the
+	# modification time and size of its files at every interval.
+
+	def __getFileState(self, name):
+		try:
+			fileInfo = stat(join(self.__path, name))
+		except OSError:
+			return None
+		return (fileInfo.st_mtime, fileInfo.st_size)
+
+	def __isWatched(self, name):
+		return self.__extensions is None or name[-4:] in self.__extensions
+
+	def __takeSnapshot(self):
+		snapshot = {}
+		for name in listdir(self.__path):
+			if (self.__isWatched(name) == True and isfile(join(self.__path, name)) == True):
+				snapshot[name] = self.__getFileState(name)
+		return snapshot
+
+	def __check(self, *args):
+		names = self.__backend.getChangedNames()
+		if (names is None):
+			names = set(self.__snapshot.keys()) | set(self.__takeSnapshot().keys())
+		elif (len(names) == 0):
+			return
+
+		added = []
+		removed = []
+		modified = []
+		for name in names:
+			if (self.__isWatched(name) == False):
+				continue
+
+			state = self.__getFileState(name)
+			previousState = self.__snapshot.get(name)
+			if (state == previousState):
+				continue
+
+			if (state is None):
+				del self.__snapshot[name]
+				removed.append(name)
+			else:
+				self.__snapshot[name] = state
+				if (previousState is None):
+					added.append(name)
+				else:
+					modified.append(name)
+
+		if (added != [] or removed != [] or modified != []):
+			self.__changedMethod(sorted(added), sorted(removed), sorted(modified))
+
+	def __init__(self, path, changedMethod, extensions = None, interval = 1.0):
+		self.__path = path
+		self.__changedMethod = changedMethod
+		self.__extensions = extensions
+		self.__interval = interval
+		try:
+			self.__backend = InotifyBackend(path)
+		except (OSError, AttributeError):
+			self.__backend = PollingBackend()
+		self.__snapshot = self.__takeSnapshot()
+		self.__scheduled = False
+
+	def start(self):
+		if (self.__scheduled == False):
+			Clock.schedule_interval(self.__check, self.__interval)
+			self.__scheduled = True
+
+	def stop(self):
+		if (self.__scheduled == True):
+			Clock.unschedule(self.__check)
+			self.__scheduled = False
+
+	def close(self):
+		self.stop()
+		self.__backend.close()
+
+	# Takes the current state of name as known, for files whose change was already handled by the caller.
+	def acknowledge(self, name):
+		state = self.__getFileState(name)
+		if (state is None):
+			if (name in self.__snapshot):
+				del self.__snapshot[name]
+		else:
+			self.__snapshot[name] = state
+
+	def getNames(self):
+		return self.__snapshot.keys()
+
+	def isUsingInotify(self):
+		return isinstance(self.__backend, InotifyBackend)
@@ -1,12 +1,14 @@
 from kivy.uix.scatter import Scatter
-from kivy.uix.image import Image
 from kivy.graphics.vertex_instructions import Line
 from kivy.graphics import Color
 
 from os import sep as pathSeparator
 
 from collision import CollisionInformation
-from editorutils import AutoReloadTexture
+from editorutils import LazySpriteImage, SpriteImage
+from pixelcache import PixelCache
+from textureatlas import SpriteAtlas
+from selectionset import SelectionSet
 from editorheritage import SpaceLimitedObject
 
 class SceneAction:
@@ -121,7 +123,7 @@ class RenderObjectGuardian:
 	def __getSelectionLimits(self):
 		first = True
 		cur = None
-		for obj in self.__multiSelectionObjects:
+		for obj in self.__selection:
 			if (first == True):
 				pos = obj.getPos()
 				size = obj.getSize()
@@ -145,16 +147,34 @@ class RenderObjectGuardian:
 		self.__maxLayer = 0
 		self.__moveStarted = False
 		self.__movePositions = []
-		self.__multiSelectionObjects = []
+		self.__selection = SelectionSet()
 		self.__history = SceneActionHistory()
+		self.__changedObjects = set()
+		self.__movedObjects = set()
 
 	def __reviewSelection(self):
-		newSelection = []
-		for obj in self.__multiSelectionObjects:
-			if (obj.getHidden() == False):
-				newSelection.append(obj)
+		for obj in self.__selection:
+			if (obj.getHidden() == True):
+				self.__selection.discard(obj)
+
+	# Objects whose place in the draw order may have changed, a layer or visibility change, since the scene last
+	# looked at them.
+	def markChanged(self, obj):
+		self.__changedObjects.add(obj)
 
-		self.__multiSelectionObjects = newSelection
+	def popChangedObjects(self):
+		changedObjects = self.__changedObjects
+		self.__changedObjects = set()
+		return changedObjects
+
+	# Objects whose bounds may have changed, a move or a scale, since the scene last looked at them.
+	def markMoved(self, obj):
+		self.__movedObjects.add(obj)
+
+	def popMovedObjects(self):
+		movedObjects = self.__movedObjects
+		self.__movedObjects = set()
+		return movedObjects
 
 	def undo(self):
 		self.__history.undo()
@@ -166,9 +186,9 @@ class RenderObjectGuardian:
 
 	def endMovement(self):
 		if (self.__moveStarted == True):
-			if (self.__movePositions != [] and self.__multiSelectionObjects != []):
+			if (self.__movePositions != [] and len(self.__selection) != 0):
 				start = self.__movePositions[0]
-				end = self.__multiSelectionObjects[0].getPos()
+				end = self.__selection.getFirst().getPos()
 				amountMovedList = []
 				x = end[0] - start[0]
 				y = end[1] - start[1]
@@ -177,48 +197,68 @@ class RenderObjectGuardian:
 					self.__moveStarted = False
 					return
 
-				for obj in self.__multiSelectionObjects:
+				for obj in self.__selection:
 					amountMovedList.append((x, y))
 
-				action = SceneAction("move", self.__multiSelectionObjects, amountMovedList)
+				action = SceneAction("move", self.__selection.getList(), amountMovedList)
 				self.__history.registerAction(action)
 
 			self.__moveStarted = False
 
 	def isSelected(self, value):
-		if (self.__multiSelectionObjects != []):
-			return value in self.__multiSelectionObjects
-
-		return False
+		return value in self.__selection
 
 	def addObjectToSelection(self, value):
-		if (value not in self.__multiSelectionObjects):
-			self.__multiSelectionObjects.append(value)
+		if (self.__selection.add(value) == True):
 			value.setMarked()
 
-		return self.__multiSelectionObjects
+		return self.__selection.getList()
+
+	# Applies a region selection: 'replace' selects only objects, 'add' and 'subtract' select or unselect them and
+	# 'intersect' keeps only the selected ones among them. Only objects whose state changes are marked again.
+	def selectObjects(self, objects, mode = 'replace'):
+		assert (mode in ['replace', 'add', 'subtract', 'intersect'])
+
+		if (mode == 'replace' or mode == 'intersect'):
+			keptObjects = set(objects)
+			for obj in self.__selection:
+				if (obj not in keptObjects):
+					self.__selection.discard(obj)
+					obj.unsetMarked()
+
+		if (mode == 'replace' or mode == 'add'):
+			for obj in objects:
+				if (self.__selection.add(obj) == True):
+					obj.setMarked()
+
+		elif (mode == 'subtract'):
+			for obj in objects:
+				if (self.__selection.discard(obj) == True):
+					obj.unsetMarked()
+
+		return self.__selection.getList()
 
 	def propagateTranslation(self, callingObject, translation, post, anchor):
 		if (self.__moveStarted == False):
 			self.__movePositions = []
-			for obj in self.__multiSelectionObjects:
+			for obj in self.__selection:
 				self.__movePositions.append(obj.getPos())
 
 			self.__moveStarted = True
 
 		res = True
-		for obj in self.__multiSelectionObjects:
+		for obj in self.__selection:
 			if (obj != callingObject):
 				res &= obj.applyTranslationStart(translation, post, anchor)
 
 		if (res == False):
 			translation = translation.inverse()
-			for obj in self.__multiSelectionObjects:
+			for obj in self.__selection:
 				obj.revertLastTranslation(translation, post, anchor)
 
 	def deleteSelection(self):
-		deletedObjects = self.__multiSelectionObjects[:]
-		self.__multiSelectionObjects = []
+		deletedObjects = self.__selection.getList()
+		self.__selection = SelectionSet()
 		for obj in deletedObjects:
 			obj.hide()
 
@@ -228,52 +268,46 @@ class RenderObjectGuardian:
 		return deletedObjects
 
 	def increaseScale(self):
-		if len(self.__multiSelectionObjects) == 1:
-			self.__multiSelectionObjects[0].increaseScale()
+		if len(self.__selection) == 1:
+			self.__selection.getFirst().increaseScale()
 
-			action = SceneAction("increaseScale", [ self.__multiSelectionObjects[0] ] )
+			action = SceneAction("increaseScale", [ self.__selection.getFirst() ] )
 			self.__history.registerAction(action)
 
-			return self.__multiSelectionObjects[0]
+			return self.__selection.getFirst()
 
 		return None
 
 	def decreaseScale(self):
-		if len(self.__multiSelectionObjects) == 1:
-			self.__multiSelectionObjects[0].decreaseScale()
+		if len(self.__selection) == 1:
+			self.__selection.getFirst().decreaseScale()
 
-			action = SceneAction("decreaseScale", [ self.__multiSelectionObjects[0] ] )
+			action = SceneAction("decreaseScale", [ self.__selection.getFirst() ] )
 			self.__history.registerAction(action)
 
-			return self.__multiSelectionObjects[0]
+			return self.__selection.getFirst()
 
 		return None
 
 	def flipSelectionOnX(self):
-		tempSelection = self.__multiSelectionObjects[:]
-		for obj in tempSelection:
-			self.__multiSelectionObjects = [ obj ]
+		# Flips only change texture coordinates, objects never move so nothing has to be kept from propagating.
+		for obj in self.__selection:
 			obj.flipOnX()
 
-		self.__multiSelectionObjects = tempSelection
-
-		action = SceneAction("flipOnX", self.__multiSelectionObjects)
+		action = SceneAction("flipOnX", self.__selection.getList())
 		self.__history.registerAction(action)
 
-		return self.__multiSelectionObjects
+		return self.__selection.getList()
 
 	def flipSelectionOnY(self):
-		tempSelection = self.__multiSelectionObjects[:]
-		for obj in tempSelection:
-			self.__multiSelectionObjects = [ obj ]
+		# Flips only change texture coordinates, objects never move so nothing has to be kept from propagating.
+		for obj in self.__selection:
 			obj.flipOnY()
 
-		self.__multiSelectionObjects = tempSelection
-
-		action = SceneAction("flipOnY", self.__multiSelectionObjects)
+		action = SceneAction("flipOnY", self.__selection.getList())
 		self.__history.registerAction(action)
 
-		return self.__multiSelectionObjects
+		return self.__selection.getList()
 
 	def alignSelectionToGrid(self):
 		# By default every translation one object in the multiple selection is
@@ -281,15 +315,15 @@ class RenderObjectGuardian:
 		# object properly.
 		# We also need to force and end movement to be sure action won't get
 		# lost.
-		if (self.__multiSelectionObjects != []):
+		if (len(self.__selection) != 0):
 			self.endMovement()
 
-			tempSelection = self.__multiSelectionObjects[:]
+			tempSelection = self.__selection
 			movementDoneList = []
 			allZero = True
 			for obj in tempSelection:
 				sx, sy = obj.getPos()
-				self.__multiSelectionObjects = [ obj ]
+				self.__selection = SelectionSet([ obj ])
 				obj.alignToGrid()
 				fx, fy = obj.getPos()
 				movementDoneList.append((fx - sx, fy - sy))
@@ -297,35 +331,34 @@ class RenderObjectGuardian:
 					allZero = False
 
 			if (allZero == False):
-				action = SceneAction("move", tempSelection, movementDoneList)
+				action = SceneAction("move", tempSelection.getList(), movementDoneList)
 				self.__history.registerAction(action)
 
 			self.__moveStarted = False
-			self.__multiSelectionObjects = tempSelection[:]
+			self.__selection = tempSelection
 
 	def setSingleSelectionObject(self, value):
 		self.unsetSelection()
-		self.__multiSelectionObjects.append(value)
+		self.__selection.add(value)
 		value.setMarked()
-		return self.__multiSelectionObjects
+		return self.__selection.getList()
 
 	def unselectObject(self, value):
-		if (value in self.__multiSelectionObjects):
+		if (self.__selection.discard(value) == True):
 			value.unsetMarked()
-			self.__multiSelectionObjects.remove(value)
 
-		return self.__multiSelectionObjects
+		return self.__selection.getList()
 
 	def unsetSelection(self):
-		if (self.__multiSelectionObjects != []):
-			for obj in self.__multiSelectionObjects:
+		if (len(self.__selection) != 0):
+			for obj in self.__selection:
 				obj.unsetMarked()
-			self.__multiSelectionObjects = []
+			self.__selection = SelectionSet()
 
 	def copySelection(self, direction, newId, tileSize, maxX, maxY):
 		assert (direction in ['left', 'right', 'up', 'down'])
 
-		if (self.__multiSelectionObjects == []):
+		if (len(self.__selection) == 0):
 			return []
 
 		startX, startY, endX, endY = self.__getSelectionLimits()
@@ -347,7 +380,7 @@ class RenderObjectGuardian:
 			yAdjust = (startY - endY)
 
 		newSelection = []
-		for obj in self.__multiSelectionObjects:
+		for obj in self.__selection:
 			pos = obj.getPos()
 			newPos = (pos[0] + xAdjust, pos[1] + yAdjust)
 			size = obj.getSize()
@@ -359,20 +392,20 @@ class RenderObjectGuardian:
 				newSelection.append(newObj)
 
 		if (newSelection != []):
-			for obj in self.__multiSelectionObjects:
+			for obj in self.__selection:
 				obj.unsetMarked()
 
 			for obj in newSelection:
 				obj.setMarked()
 
-			self.__multiSelectionObjects = newSelection
+			self.__selection = SelectionSet(newSelection)
 			action = SceneAction("copySelection", newSelection)
 			self.__history.registerAction(action)
 
 		return newSelection
 
 	def getSelection(self):
-		return self.__multiSelectionObjects[:]
+		return self.__selection.getList()[:]
 
 	def createNewObject(self, idToUse, obj, pos, tileSize, maxX, maxY):
 		renderedObject = RenderedObject(idToUse, obj, pos, tileSize, maxX, maxY, self)
@@ -410,15 +443,25 @@ class BaseObject:
 			"Invalid attributes received, information for sprite info must be all None or all filled."
 
 		self.__identifier = identifier
-		self.__baseImage = baseImage
+		# A LazySpriteImage keeps the texture from being decoded until the object is placed.
+		if (isinstance(baseImage, LazySpriteImage) == True):
+			self.__lazyImage = baseImage
+			self.__baseImage = None
+			source = baseImage.getSource()
+			self.__size = baseImage.getSize()
+		else:
+			self.__lazyImage = None
+			self.__baseImage = baseImage
+			source = baseImage.source
+			self.__size = baseImage.texture.size
+
 		if (virtualPath is None):
-			self.__fullPath = baseImage.source
+			self.__fullPath = source
 			self.__spriteInfo = None
 		else:
 			self.__fullPath = virtualPath
 			self.__spriteInfo = SpritedObjectInfo(virtualPath, spriteCoords, spriteSize)
 
-		self.__size = baseImage.texture.size
 		self.__objectType = ObjectTypes.baseObject
 
 	def getIdentifier(self):
@@ -431,14 +474,28 @@ class BaseObject:
 		return self.__fullPath
 
 	def getBaseImage(self):
+		if (self.__baseImage is None):
+			self.__baseImage = self.__lazyImage.getImage()
 		return self.__baseImage
 
+	# Lets go of the decoded image, for objects that are no longer offered. It is loaded again if needed.
+	def release(self):
+		if (self.__lazyImage is not None and self.__baseImage is not None):
+			self.__lazyImage.release()
+			self.__baseImage = None
+
 	def getType(self):
 		return self.__objectType
 
 	def getSpriteInfo(self):
 		return self.__spriteInfo
 
+	# Identifies the pixels of the object, shared by all of its instances in the sprite atlas.
+	def getSpriteKey(self):
+		if (self.__spriteInfo is None):
+			return (self.__fullPath, None, tuple(self.__size))
+		return (self.__spriteInfo.getVirtualPath(), self.__spriteInfo.getSpriteCoords(), tuple(self.__size))
+
 class RenderedObject (Scatter, SpaceLimitedObject):
 	def __checkAndTransform(self, trans, post_multiply=False, anchor=(0, 0)):
 
@@ -515,56 +572,13 @@ class RenderedObject (Scatter, SpaceLimitedObject):
 	def setCollisionInfo(self, value):
 		self.__collisionInfo = value
 
-	def __flipVertical(self):
-		mustRemark = False
-		if (self.__borderLine is not None):
-			self.unsetMarked()
-			mustRemark = True
-
-		sizeToUse = self.image.size
-		newTexture = self.image.texture
-		newTexture.flip_vertical()
-		self.remove_widget(self.image)
-		self.image = Image(texture = newTexture, size = (sizeToUse), nocache = True)
-		self.add_widget(self.image)
-
-		if (mustRemark == True):
-			self.setMarked()
-
-	def __flipHorizontal(self):
-		mustRemark = False
-		if (self.__borderLine is not None):
-			self.unsetMarked()
-			mustRemark = True
-
-		newTexture = self.image.texture
-		uvx, uvy = newTexture.uvpos
-		uvw, uvh = newTexture.uvsize
-		uvx += uvw
-		uvw = -uvw
-		newTexture.uvpos = (uvx, uvy)
-		newTexture.uvsize = (uvw, uvh)
-		sizeToUse = self.image.size
-		self.remove_widget(self.image)
-		self.image = Image(texture = newTexture, size = (sizeToUse), nocache = True)
-		self.add_widget(self.image)
-
-		if (mustRemark == True):
-			self.setMarked()
-
 	def flipOnX(self):
 		self.__flipX = not self.__flipX
-
-		x, y = self.bbox[0]
-		self.__flipHorizontal()
-		self._set_pos((x,y))
+		self.image.setFlip(self.__flipX, self.__flipY)
 
 	def flipOnY(self):
 		self.__flipY = not self.__flipY
-
-		x, y = self.bbox[0]
-		self.__flipVertical()
-		self._set_pos((x,y))
+		self.image.setFlip(self.__flipX, self.__flipY)
 
 	def move(self, x, y):
 		self._set_pos((x, y))
@@ -617,10 +631,21 @@ class RenderedObject (Scatter, SpaceLimitedObject):
 			else:
 				self.__name = path[0:-4] + '_' + str(self.__id)
 
+		# Instances of a sprite share its region of the sprite atlas and its texture, so drawing a scene binds only a
+		# few textures and the pixels are held once. Flips are drawn by each object through its texture coordinates.
+		self.__spriteKey = obj.getSpriteKey()
+		self.__atlasRegion = SpriteAtlas.Instance().acquireSprite(self.__spriteKey)
+		if (self.__atlasRegion is None):
+			if (isinstance(obj, BaseObject)):
+				imageArray = PixelCache.Instance().getArray(obj.getBaseImage())
+			else:
+				# The region holds the pixels before any flip, those of obj are applied again below.
+				imageArray = obj.getAtlasRegion().getArray()
+			self.__atlasRegion = SpriteAtlas.Instance().addSprite(self.__spriteKey, imageArray)
+
 		if (isinstance(obj, BaseObject)):
 			self.__baseSize = obj.getSize()
-			self.__texture = AutoReloadTexture(self.__baseSize, obj.getBaseImage())
-			self.image = Image(size = self.__baseSize, texture = self.__texture.getTexture())
+			self.image = SpriteImage(self.__atlasRegion.getTexture(), self.__baseSize)
 			self.__sx = self.__baseSize[0]
 			self.__sy = self.__baseSize[1]
 			self.__scale = 1.0
@@ -630,8 +655,7 @@ class RenderedObject (Scatter, SpaceLimitedObject):
 		else:
 			self.__baseSize = obj.getBaseSize()
 			self.__sx, self.__sy = obj.getSize()
-			self.__texture = AutoReloadTexture(self.__baseSize, obj.getImage())
-			self.image = Image(size = self.__baseSize, texture = self.__texture.getTexture())
+			self.image = SpriteImage(self.__atlasRegion.getTexture(), self.__baseSize)
 			self.__layer = obj.getLayer()
 			if (obj.getCollisionInfo() is None):
 				self.__collisionInfo = None
@@ -669,18 +693,28 @@ class RenderedObject (Scatter, SpaceLimitedObject):
 		self.on_touch_up = self.__handleTouchUp
 		self.__defaultApplyTransform = self.apply_transform
 		self.apply_transform = self.__checkAndTransform
+		self.bind(transform = self.__handleTransformChange)
+
+	def __handleTransformChange(self, *args):
+		self.__renderGuardian.markMoved(self)
 
 	def hide(self):
 		self.unsetMarked()
 		self.remove_widget(self.image)
 		self.__isHidden = True
+		self.__renderGuardian.markChanged(self)
 
 	def show(self):
 		self.add_widget(self.image)
 		self.__isHidden = False
+		self.__renderGuardian.markChanged(self)
 
 	def resetAllWidgets(self):
 		self.remove_widget(self.image)
+		# The scene is dropping the object, its region leaves the sprite atlas once no other object uses it.
+		if (self.__isFinished == False):
+			SpriteAtlas.Instance().releaseSprite(self.__atlasRegion)
+			self.__isFinished = True
 
 	def moveAbsoluteReverse(self, amount):
 		self.moveAbsolute((-amount[0], -amount[1]))
@@ -716,7 +750,9 @@ class RenderedObject (Scatter, SpaceLimitedObject):
 		return self.__layer
 
 	def setLayer(self, newName):
-		self.__layer = newName
+		if (self.__layer != newName):
+			self.__layer = newName
+			self.__renderGuardian.markChanged(self)
 
 	def getFlipX(self):
 		return self.__flipX
@@ -736,7 +772,16 @@ class RenderedObject (Scatter, SpaceLimitedObject):
 	def getSpriteInfo(self):
 		return self.__spriteInfo
 
+	def getAtlasRegion(self):
+		return self.__atlasRegion
+
+	def getSpriteKey(self):
+		return self.__spriteKey
+
 	def finish(self):
+		if (self.__isFinished == False):
+			SpriteAtlas.Instance().releaseSprite(self.__atlasRegion)
+			self.__renderGuardian.markChanged(self)
 		self.__isFinished = True
 
 	def getHidden(self):
@@ -6,9 +6,16 @@ from kivy.uix.filechooser import FileChooserIconView
 from kivy.uix.textinput import TextInput
 from kivy.graphics.texture import Texture
 from kivy.uix.image import Image
+from kivy.uix.widget import Widget
+from kivy.graphics import Color, Rectangle
 from kivy.effects.scroll import ScrollEffect
 
 from keyboard import KeyboardAccess, KeyboardGuardian
+from conversionutils import strToDoubleFloatTuple, strToDoubleIntTuple, boolToStr, strToBool
+from pixelcache import PixelCache
+from assetcache import AssetCache
+
+from numpy import zeros, full, unpackbits, flatnonzero, uint8
 
 from os.path import sep as pathSeparator
 from os import getcwd
@@ -225,7 +232,7 @@ class AutoReloadTexture:
 	def __init__(self, sizeToUse, imageToUse):
 		self._size = sizeToUse
 		self._texture = Texture.create(size = self._size)
-		self._pixels = imageToUse.texture.pixels[:]
+		self._pixels = PixelCache.Instance().getPixels(imageToUse)
 		self._texture.blit_buffer(self._pixels, colorfmt='rgba', bufferfmt='ubyte')
 		self._texture.flip_vertical()
 		self._texture.add_reload_observer(self._reloadTexture)
@@ -233,6 +240,36 @@ class AutoReloadTexture:
 	def getTexture(self):
 		return self._texture
 
+class BitArray:
+	# One bit per item, the first item being the highest bit of the first byte.
+	def __init__(self, size, value = False):
+		self.__size = size
+		self.setAll(value)
+
+	def get(self, index):
+		return (self.__bits[index >> 3] & (0x80 >> (index & 7))) != 0
+
+	def set(self, index, value):
+		if (value == True):
+			self.__bits[index >> 3] |= (0x80 >> (index & 7))
+		else:
+			self.__bits[index >> 3] &= ~(0x80 >> (index & 7)) & 0xFF
+
+	def setAll(self, value):
+		if (value == True):
+			self.__bits = full((self.__size + 7) // 8, 0xFF, dtype = uint8)
+		else:
+			self.__bits = zeros((self.__size + 7) // 8, dtype = uint8)
+
+	def count(self):
+		return int(unpackbits(self.__bits)[:self.__size].sum())
+
+	def getSetIndexes(self):
+		return flatnonzero(unpackbits(self.__bits)[:self.__size]).tolist()
+
+	def getSize(self):
+		return self.__size
+
 def convertKivyCoordToOrxCoord(v, maxY):
 	assert len(v) == 2 or len(v) == 3
 	if (len(v) == 2):
@@ -240,22 +277,6 @@ def convertKivyCoordToOrxCoord(v, maxY):
 	else:
 		return (v[0], maxY - v[1], v[2])
 
-def strToDoubleFloatTuple(s):
-	assert(type(s) is str)
-	splitted = s.split(',')
-	assert(len(splitted) == 2)
-	x = float(splitted[0].replace('(', ''))
-	y = float(splitted[1].replace(')', ''))
-	return (x, y)
-
-def strToDoubleIntTuple(s):
-	assert(type(s) is str)
-	splitted = s.split(',')
-	assert(len(splitted) == 2)
-	x = int(splitted[0].replace('(', ''))
-	y = int(splitted[1].replace(')', ''))
-	return (x, y)
-
 def vector2ToVector3String(v, default = 0):
 	return '(' + str(v[0]) + ', ' + str(v[1]) + ', ' + str (default) + ')'
 
@@ -267,19 +288,6 @@ def vector2Multiply(v, x):
 	else:
 		return [v[0] * x, v[1] * x]
 
-def boolToStr(b):
-	if (b == True):
-		return 'true'
-	else:
-		return 'false'
-
-def strToBool(s):
-	assert(s in ['true', 'false'])
-	if (s == 'true'):
-		return True
-	else:
-		return False
-
 def isClockWise(points):
 	assert type(points) is list or type(points) is tuple, 'Type is not supported.'
 	assert len(points) > 2, 'At least three points are needed.'
@@ -299,7 +307,7 @@ def isClockWise(points):
 
 def copyTexture(sizeToUse, imageToUse):
 	newTexture = Texture.create(size = sizeToUse)
-	pixels = imageToUse.texture.pixels[:]
+	pixels = PixelCache.Instance().getPixels(imageToUse)
 	newTexture.blit_buffer(pixels, colorfmt='rgba', bufferfmt='ubyte')
 	newTexture.flip_vertical()
 
@@ -314,3 +322,77 @@ def createSpriteImage(baseImage, x, y, width, height):
 	newTexture = baseImage.texture.get_region(x, y, width, height)
 	return Image(texture = newTexture, size = (width, height), size_hint = (None, None))
 
+
+class LazySpriteImage:
+	# Stands for the image of a whole file, or of a region of it, whose size is already known. The file is only
+	# decoded the first time the image is needed, through the AssetCache, and held until release.
+	def __init__(self, source, size, region = None):
+		self.__source = source
+		self.__size = tuple(size)
+		self.__region = region
+		self.__image = None
+
+	def getSource(self):
+		return self.__source
+
+	def getSize(self):
+		return self.__size
+
+	def getRegion(self):
+		return self.__region
+
+	def getImage(self):
+		if (self.__image is None):
+			if (self.__region is None):
+				texture = AssetCache.Instance().acquire(self.__source)
+			else:
+				texture = AssetCache.Instance().acquireRegion(self.__source, *self.__region)
+			self.__image = Image(texture = texture, size = self.__size, size_hint = (None, None))
+
+		return self.__image
+
+	def release(self):
+		if (self.__image is not None):
+			AssetCache.Instance().release(self.__image.texture)
+			self.__image = None
+
+class SpriteImage(Widget):
+	# Draws a texture that may be shared by many widgets. Flips only change the texture coordinates of the
+	# rectangle, so neither the texture nor the widget is ever replaced.
+	def __updateRectangle(self, *args):
+		self.__rectangle.pos = self.pos
+		self.__rectangle.size = self.size
+
+	def __updateTexCoords(self):
+		u0, v0 = self.texture.uvpos
+		uw, vh = self.texture.uvsize
+		u1 = u0 + uw
+		v1 = v0 + vh
+		if (self.__flipX == True):
+			u0, u1 = u1, u0
+		if (self.__flipY == True):
+			v0, v1 = v1, v0
+		self.__rectangle.tex_coords = (u0, v0, u1, v0, u1, v1, u0, v1)
+
+	def __init__(self, texture, size):
+		super(SpriteImage, self).__init__(size = size, size_hint = (None, None))
+		self.texture = texture
+		self.source = None
+		self.__flipX = False
+		self.__flipY = False
+		with self.canvas:
+			Color(1., 1., 1., 1.)
+			self.__rectangle = Rectangle(texture = texture, pos = self.pos, size = self.size)
+		self.bind(pos = self.__updateRectangle, size = self.__updateRectangle)
+
+	def setFlip(self, flipX, flipY):
+		if (self.__flipX != flipX or self.__flipY != flipY):
+			self.__flipX = flipX
+			self.__flipY = flipY
+			self.__updateTexCoords()
+
+	def getFlipX(self):
+		return self.__flipX
+
+	def getFlipY(self):
+		return self.__flipY
@@ -0,0 +1,74 @@
+from kivy.clock import Clock
+
+from threading import Thread, Event
+
+from splitengine import exportAtlas, ExportCancelled
+
+class AtlasExportWorker:
+	# Composes, encodes and writes an atlas on a background thread. The main thread polls it through the Clock, so
+	# the callbacks are always called from the kivy thread.
+
+	def __run(self):
+		try:
+			self.__numberOfTiles = exportAtlas(self.__imageArray, self.__rects, self.__filename, self.__colorToAlpha,
+				self.__divs, self.__dedupe, self.__tolerance, self.__maxSize, self.__powerOfTwo, self.__setProgress,
+				self.__cancelEvent)
+		except ExportCancelled:
+			self.__cancelled = True
+		except Exception, e:
+			self.__error = str(e)
+
+		self.__finishedEvent.set()
+
+	def __setProgress(self, value):
+		self.__progress = value
+
+	def __poll(self, *args):
+		if (self.__progressMethod is not None):
+			self.__progressMethod(self.__progress)
+
+		if (self.__finishedEvent.is_set() == True):
+			self.__finishedMethod(self)
+			return False
+
+	def __init__(self, imageArray, rects, filename, finishedMethod, progressMethod = None, colorToAlpha = None,
+			divs = None, dedupe = False, tolerance = 0, maxSize = 4096, powerOfTwo = True):
+		self.__imageArray = imageArray
+		self.__rects = rects
+		self.__filename = filename
+		self.__finishedMethod = finishedMethod
+		self.__progressMethod = progressMethod
+		self.__colorToAlpha = colorToAlpha
+		self.__divs = divs
+		self.__dedupe = dedupe
+		self.__tolerance = tolerance
+		self.__maxSize = maxSize
+		self.__powerOfTwo = powerOfTwo
+
+		self.__progress = 0.0
+		self.__numberOfTiles = 0
+		self.__cancelled = False
+		self.__error = None
+		self.__cancelEvent = Event()
+		self.__finishedEvent = Event()
+		self.__thread = Thread(target = self.__run)
+		self.__thread.daemon = True
+
+	def start(self):
+		self.__thread.start()
+		Clock.schedule_interval(self.__poll, 1 / 30.)
+
+	def cancel(self):
+		self.__cancelEvent.set()
+
+	def isCancelled(self):
+		return self.__cancelled
+
+	def getError(self):
+		return self.__error
+
+	def getNumberOfTiles(self):
+		return self.__numberOfTiles
+
+	def getFilename(self):
+		return self.__filename
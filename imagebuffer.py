@@ -0,0 +1,127 @@
+from kivy.core.image import ImageLoader
+
+from numpy import frombuffer, empty, uint8, uint32, ascontiguousarray, arange, add, diff, append, outer
+
+from struct import pack, unpack
+from zlib import compressobj, crc32
+
+# Every array handled by this module is a contiguous (height, width, 4) uint8 RGBA array whose first row is the
+# bottom row of the image, so a kivy region (x, y, width, height) maps directly to array[y:y+height, x:x+width].
+
+def imageDataToArray(imageData):
+	width, height = imageData.width, imageData.height
+	fmt = imageData.fmt
+	if (fmt in ['rgba', 'bgra']):
+		channels = 4
+	elif (fmt in ['rgb', 'bgr']):
+		channels = 3
+	else:
+		raise Exception('Unsupported image format: ' + str(fmt) + '.')
+
+	# Rows may be longer than the image: rowlength gives them in pixels, otherwise they can be padded to 4 bytes.
+	raw = frombuffer(imageData.data, dtype = uint8)
+	rowSize = width * channels
+	rowLength = getattr(imageData, 'rowlength', 0)
+	if (rowLength != 0 and rowLength is not None):
+		stride = rowLength * channels
+	elif (len(raw) == height * ((rowSize + 3) & ~3)):
+		stride = (rowSize + 3) & ~3
+	else:
+		stride = rowSize
+	assert stride >= rowSize and len(raw) >= (height - 1) * stride + rowSize, 'Image data smaller than its size.'
+	if (len(raw) < height * stride):
+		# The last row is not always padded.
+		raw = append(raw, empty(height * stride - len(raw), dtype = uint8))
+	raw = raw[:height * stride].reshape(height, stride)[:, :rowSize].reshape(height, width, channels)
+
+	rgba = empty((height, width, 4), dtype = uint8)
+	if (fmt[0] == 'b'):
+		rgba[..., 0] = raw[..., 2]
+		rgba[..., 2] = raw[..., 0]
+	else:
+		rgba[..., 0] = raw[..., 0]
+		rgba[..., 2] = raw[..., 2]
+	rgba[..., 1] = raw[..., 1]
+	if (channels == 4):
+		rgba[..., 3] = raw[..., 3]
+	else:
+		rgba[..., 3] = 0xFF
+
+	# Loaders that hand out the rows top to bottom flag it so the texture gets flipped.
+	if (getattr(imageData, 'flip_vertical', False) == True):
+		rgba = ascontiguousarray(rgba[::-1])
+
+	return rgba
+
+def loadImageArray(path):
+	loadedImage = ImageLoader.load(path, keep_data = True, nocache = True)
+	return imageDataToArray(loadedImage._data[0])
+
+# Textures hand their pixels out from the top row, the returned array is a read only view over the buffer flipped
+# to the convention above, so it is not contiguous.
+def pixelsToArray(pixels, width, height):
+	return frombuffer(pixels, dtype = uint8).reshape(height, width, 4)[::-1]
+
+def textureToArray(texture):
+	width, height = texture.size
+	return pixelsToArray(texture.pixels, width, height)
+
+# Box filtered copy of imageArray fitting in (maxWidth, maxHeight) with the same aspect ratio. Images already small
+# enough are only made contiguous.
+def shrinkImageArray(imageArray, maxWidth, maxHeight):
+	height, width = imageArray.shape[:2]
+	if (width == 0 or height == 0):
+		return ascontiguousarray(imageArray)
+
+	scale = min(1.0, float(maxWidth) / width, float(maxHeight) / height)
+	if (scale == 1.0):
+		return ascontiguousarray(imageArray)
+
+	newWidth = max(1, int(round(width * scale)))
+	newHeight = max(1, int(round(height * scale)))
+	rowStarts = (arange(newHeight) * height) // newHeight
+	colStarts = (arange(newWidth) * width) // newWidth
+	# Rows are summed first, so only the shrunk height is ever held as uint32.
+	summed = add.reduceat(add.reduceat(imageArray, rowStarts, axis = 0, dtype = uint32), colStarts, axis = 1)
+	counts = outer(diff(append(rowStarts, height)), diff(append(colStarts, width)))
+	return (summed // counts[..., None]).astype(uint8)
+
+# (width, height) read from the png header, without decoding the image, or None when path is not a png file.
+def readPngSize(path):
+	f = open(path, 'rb')
+	header = f.read(24)
+	f.close()
+
+	if (len(header) != 24 or header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR'):
+		return None
+	return unpack('>II', header[16:24])
+
+def _pngChunk(chunkType, data):
+	return pack('>I', len(data)) + chunkType + data + pack('>I', crc32(chunkType + data) & 0xFFFFFFFF)
+
+# progressMethod, when given, is called with the number of rows compressed so far and the total.
+def encodePng(imageArray, progressMethod = None):
+	height, width = imageArray.shape[:2]
+	# Each png scanline starts with its filter type, 0 meaning the row is stored as is.
+	scanlines = empty((height, width * 4 + 1), dtype = uint8)
+	scanlines[:, 0] = 0
+	scanlines[:, 1:] = imageArray[::-1].reshape(height, width * 4)
+
+	compressor = compressobj(6)
+	compressedParts = []
+	rowsPerChunk = max(1, (1 << 20) // (width * 4 + 1))
+	for startRow in range(0, height, rowsPerChunk):
+		compressedParts.append(compressor.compress(scanlines[startRow:startRow + rowsPerChunk].tobytes()))
+		if (progressMethod is not None):
+			progressMethod(min(height, startRow + rowsPerChunk), height)
+	compressedParts.append(compressor.flush())
+
+	return b'\x89PNG\r\n\x1a\n' + \
+		_pngChunk(b'IHDR', pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) + \
+		_pngChunk(b'IDAT', b''.join(compressedParts)) + \
+		_pngChunk(b'IEND', b'')
+
+def saveImageArray(path, imageArray, progressMethod = None):
+	f = open(path, 'wb')
+	f.write(encodePng(imageArray, progressMethod))
+	f.close()
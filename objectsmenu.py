@@ -1,32 +1,84 @@
 from singleton import Singleton
 
-from os.path import join
+from os.path import join, dirname, basename, isfile
 from os import listdir, getcwd
+from collections import OrderedDict
 
 from kivy.uix.image import Image
-from kivy.uix.gridlayout import GridLayout
 from kivy.uix.scrollview import ScrollView
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.textinput import TextInput
+from kivy.clock import Clock
 
 from editorobjects import BaseObject
 from objectdescriptor import ObjectDescriptor
-from editorutils import EmptyScrollEffect, createSpriteImage
+from editorutils import EmptyScrollEffect, LazySpriteImage
 from communicationobjects import SceneToObjectsMenu
 from splittedimagemap import SplittedImageImporter
+from pixelcache import PixelCache
+from assetcache import AssetCache
+from thumbnailcache import ThumbnailCache
+from imagebuffer import readPngSize
+from directorywatcher import DirectoryWatcher
+from recycleview import RecycleGridView
+from textureatlas import ThumbnailAtlas, SpriteAtlas
+from searchindex import TrigramIndex
 
 class ObjectMenuItem:
+	# Palette entry, shown by whichever pooled image it is bound to while it is in view. Its thumbnail is only asked
+	# for the first time it is shown.
+
+	def __showThumbnail(self):
+		if (self.__thumbnail is None):
+			# Hidden until its thumbnail is ready.
+			self.__displayImage.texture = None
+			self.__displayImage.color = (1, 1, 1, 0)
+		else:
+			self.__displayImage.texture = self.__thumbnail.getTexture()
+			self.__displayImage.color = (1, 1, 1, 1)
 
-	def __handle(self, image, touch):
-		if (touch.is_mouse_scrolling == False and self.getDisplayImage().collide_point(*touch.pos) == True and
-				touch.is_double_tap == True):
-			if (ObjectDescriptor.Instance().getCurrentObject() == self.getBaseObject()):
-				SceneToObjectsMenu.Instance().draw(self.getBaseObject())
-			else:
-				ObjectDescriptor.Instance().setObject(self.getBaseObject())
+	def __setThumbnail(self, region):
+		if (self.__released == True):
+			ThumbnailAtlas.Instance().release(region)
+			return
+
+		self.__thumbnail = region
+		if (self.__displayImage is not None):
+			self.__showThumbnail()
 
-	def __init__(self, baseObject, size):
+	def __requestThumbnail(self):
+		spriteInfo = self.__baseObject.getSpriteInfo()
+		if (spriteInfo is None):
+			ThumbnailCache.Instance().request(self.__baseObject.getPath(), None, self.__setThumbnail)
+		else:
+			x, y = spriteInfo.getSpriteCoords()
+			width, height = self.__baseObject.getSize()
+			ThumbnailCache.Instance().request(spriteInfo.getVirtualPath(), (x, y, width, height), self.__setThumbnail)
+
+	def __init__(self, baseObject):
 		self.__baseObject = baseObject
-		self.__displayImage = Image(texture = baseObject.getBaseImage().texture, size = size, size_hint = (None, None),
-			on_touch_down = self.__handle)
+		self.__displayImage = None
+		self.__thumbnail = None
+		self.__thumbnailRequested = False
+		self.__released = False
+
+	def bindDisplayImage(self, image):
+		self.__displayImage = image
+		if (image is None):
+			return
+
+		self.__showThumbnail()
+		if (self.__thumbnailRequested == False):
+			self.__thumbnailRequested = True
+			self.__requestThumbnail()
+
+	# Gives the thumbnail space back to the atlas, the item must not be shown anymore.
+	def release(self):
+		self.__released = True
+		self.__baseObject.release()
+		if (self.__thumbnail is not None):
+			ThumbnailAtlas.Instance().release(self.__thumbnail)
+			self.__thumbnail = None
 
 	def getBaseObject(self):
 		return self.__baseObject
@@ -51,127 +103,260 @@ class ShortcutHandler:
 
 @Singleton
 class ObjectsMenu:
-	def __reloadMenuList(self):
-		self.__numberOfItems = len(self.__menuObjectsList)
-		self.__objectListLayout.clear_widgets()
-		self.__objectListLayout.rows = self.__numberOfItems
-		self.__objectListLayout.size[1] = (self.__numberOfItems * 67)
-		for menuObjectItem in self.__menuObjectsList:
-			self.__objectListLayout.add_widget(menuObjectItem.getDisplayImage())
-
-	def __loadPng(self, item, pngsToIgnoreList):
-		fullPath = join(getcwd(), 'tiles', item)
-		if (fullPath in pngsToIgnoreList):
+	def __handleTouch(self, image, touch):
+		index = self.__paletteView.getIndexOfView(image)
+		if (index is None or touch.is_mouse_scrolling == True or image.collide_point(*touch.pos) == False or
+				touch.is_double_tap == False):
 			return
 
-		img = Image(source = fullPath)
-		obj = BaseObject(img, self.__baseObjectId)
-		self.__menuObjectsList.append(ObjectMenuItem(obj, (64, 64)))
-		self.__numberOfItems += 1
+		baseObject = self.__menuObjectsList[index].getBaseObject()
+		if (ObjectDescriptor.Instance().getCurrentObject() == baseObject):
+			SceneToObjectsMenu.Instance().draw(baseObject)
+		else:
+			ObjectDescriptor.Instance().setObject(baseObject)
+
+	def __createDisplayImage(self):
+		image = Image(size = self.__cellSize, size_hint = (None, None), color = (1, 1, 1, 0))
+		image.bind(on_touch_down = self.__handleTouch)
+		return image
+
+	def __bindDisplayImage(self, image, index):
+		previousItem = self.__imageToItem.get(image)
+		if (previousItem is not None and previousItem.getDisplayImage() is image):
+			previousItem.bindDisplayImage(None)
+
+		item = self.__menuObjectsList[index]
+		item.bindDisplayImage(image)
+		self.__imageToItem[image] = item
+
+	def __updatePalette(self):
+		if (self.__allItems is None):
+			# Only rebuilt when the groups change, a search then only sorts what it found into the menu order.
+			self.__allItems = []
+			for items in self.__menuGroups.values():
+				self.__allItems.extend(items)
+			self.__itemOrder = dict([(item, i) for i, item in enumerate(self.__allItems)])
+
+		if (self.__searchResult is None):
+			self.__menuObjectsList = self.__allItems
+		else:
+			self.__menuObjectsList = sorted(self.__searchResult, key = self.__itemOrder.get)
+		self.__paletteView.setItems(len(self.__menuObjectsList), 1, self.__cellSize, 3)
+
+	def __applySearch(self, *args):
+		self.__searchResult = self.__searchIndex.search(self.__searchInput.text)
+		self.__updatePalette()
+
+	def __processSearchText(self, searchInput, text):
+		# Searching once per frame keeps fast typing from piling up searches.
+		Clock.unschedule(self.__applySearch)
+		Clock.schedule_once(self.__applySearch, 0)
+
+	# The file name, the name of the .opf listing the item and, for sprites, its coordinates and size as "x,y" and
+	# "widthxheight", are what the search looks at.
+	def __getSearchText(self, item, path):
+		baseObject = item.getBaseObject()
+		words = [basename(path)]
+		if (path in self.__pathToOpf):
+			words.append(self.__pathToOpf[path])
+
+		spriteInfo = baseObject.getSpriteInfo()
+		if (spriteInfo is not None):
+			x, y = spriteInfo.getSpriteCoords()
+			width, height = baseObject.getSize()
+			words.append('%d,%d' % (x, y))
+			words.append('%dx%d' % (width, height))
+
+		return ' '.join(words)
+
+	def __getImageSize(self, path):
+		# The header is enough for png files, the image is only decoded for other formats.
+		size = readPngSize(path)
+		if (size is None):
+			texture = AssetCache.Instance().acquire(path)
+			size = tuple(texture.size)
+			AssetCache.Instance().release(texture)
+		return size
+
+	def __createPngItems(self, fullPath):
+		obj = BaseObject(LazySpriteImage(fullPath, self.__getImageSize(fullPath)), self.__baseObjectId)
 		self.__baseObjectId += 1
+		return [ObjectMenuItem(obj)]
 
 	def __loadResourceInfoList(self, resourceInfo):
 		l = []
-		mainImage = Image (source = resourceInfo.getPath())
+		path = resourceInfo.getPath()
+		spriteSize = self.__getImageSize(path)
 		if (resourceInfo.getKeepOriginal() == True):
-			l.append(BaseObject(mainImage, self.__baseObjectId))
+			l.append(BaseObject(LazySpriteImage(path, spriteSize), self.__baseObjectId))
 			self.__baseObjectId += 1
 
-		spriteSize = tuple(mainImage.texture.size)
 		for selection in resourceInfo.getSelectionList():
 			x = selection.getX()
 			y = selection.getY()
 			width = selection.getSizeX()
 			height = selection.getSizeY()
-			image = createSpriteImage(mainImage, x, y, width, height)
-			obj = BaseObject(image, self.__baseObjectId, resourceInfo.getPath(), (x, y), spriteSize)
+			image = LazySpriteImage(path, (width, height), (x, y, width, height))
+			obj = BaseObject(image, self.__baseObjectId, path, (x, y), spriteSize)
 			l.append(obj)
 			self.__baseObjectId += 1
 
 		return l
 
-	def __loadOpf(self, item, pngsToIgnoreList):
-		resourceInfo = SplittedImageImporter.load(join(getcwd(), 'tiles',item))
+	def __createOpfItems(self, resourceInfo):
+		return [ObjectMenuItem(baseObject) for baseObject in self.__loadResourceInfoList(resourceInfo)]
+
+	# Items are grouped by the image they show, in the menu order, so a changed file only replaces its own group.
+	def __setGroup(self, path, items):
+		self.__allItems = None
+		for item in self.__menuGroups.get(path, []):
+			self.__searchIndex.remove(item)
+			item.release()
+		for item in items:
+			self.__searchIndex.add(item, self.__getSearchText(item, path))
+
+		if (items == []):
+			if (path in self.__menuGroups):
+				del self.__menuGroups[path]
+		else:
+			self.__menuGroups[path] = items
+
+	# Rebuilds the items of the image at path, from its .opf when one of tiles/ points to it and lists anything, from
+	# the image itself when it is a png of tiles/.
+	def __refreshImage(self, path):
+		items = []
+		try:
+			if (path in self.__pathToOpf):
+				resourceInfo = SplittedImageImporter.load(join(self.__tilesPath, self.__pathToOpf[path]))
+				items = self.__createOpfItems(resourceInfo)
+
+			if (items == [] and path[-4:] == '.png' and dirname(path) == self.__tilesPath and isfile(path) == True):
+				items = self.__createPngItems(path)
+		except Exception, e:
+			print 'Unable to load ' + path + ': ' + str(e)
+
+		self.__setGroup(path, items)
+
+	# Follows the image an .opf of tiles/ points to, returning the images whose items must be rebuilt.
+	def __registerOpf(self, item):
+		previousPath = self.__opfToPath.pop(item, None)
+		if (previousPath is not None and self.__pathToOpf.get(previousPath) == item):
+			del self.__pathToOpf[previousPath]
+
+		newPath = None
+		if (isfile(join(self.__tilesPath, item)) == True):
+			try:
+				newPath = SplittedImageImporter.load(join(self.__tilesPath, item)).getPath()
+			except Exception, e:
+				print 'Unable to load ' + item + ': ' + str(e)
+
+		if (newPath is not None):
+			self.__opfToPath[item] = newPath
+			self.__pathToOpf[newPath] = item
+
+		return [path for path in set([previousPath, newPath]) if path is not None]
+
+	def __invalidateSource(self, path):
+		PixelCache.Instance().invalidateSource(path)
+		AssetCache.Instance().invalidate(path)
+		SpriteAtlas.Instance().invalidateSource(path)
+
+	def __processTilesChanges(self, added, removed, modified):
+		changed = added + removed + modified
+		pathsToRefresh = []
+		for item in changed:
+			if (item[-4:] == '.opf'):
+				pathsToRefresh.extend(self.__registerOpf(item))
+
+		for item in changed:
+			if (item[-4:] == '.png'):
+				path = join(self.__tilesPath, item)
+				self.__invalidateSource(path)
+				pathsToRefresh.append(path)
 
-		baseObjectList = self.__loadResourceInfoList(resourceInfo)
-		if baseObjectList != []:
-			for baseObject in baseObjectList:
-				self.__menuObjectsList.append(ObjectMenuItem(baseObject, (64, 64)))
-				self.__numberOfItems += 1
-			pngsToIgnoreList.append(baseObject.getPath())
+		for path in set(pathsToRefresh):
+			self.__refreshImage(path)
+
+		self.__searchResult = self.__searchIndex.search(self.__searchInput.text)
+		self.__updatePalette()
+		ThumbnailCache.Instance().flush()
 
 	def __loadItems(self):
-		l = listdir(join(getcwd(), 'tiles'))
-		self.__menuObjectsList = []
-		self.__numberOfItems = 0
+		l = listdir(self.__tilesPath)
+		for items in self.__menuGroups.values():
+			for item in items:
+				item.release()
+		self.__menuGroups = OrderedDict()
+		self.__allItems = None
+		self.__opfToPath = {}
+		self.__pathToOpf = {}
 		self.__baseObjectId = 0
-		pngsToIgnoreList = []
+		self.__searchIndex.clear()
+
 		for item in l:
 			if (item[-4:] == '.opf'):
-				self.__loadOpf(item, pngsToIgnoreList)
+				for path in self.__registerOpf(item):
+					if (path not in self.__menuGroups):
+						self.__refreshImage(path)
 
 		for item in l:
-			if (item[-4:] == '.png' and item not in pngsToIgnoreList):
-				self.__loadPng(item, pngsToIgnoreList)
+			path = join(self.__tilesPath, item)
+			if (item[-4:] == '.png' and path not in self.__menuGroups):
+				self.__refreshImage(path)
 
-		if (self.__objectListLayout is None):
-			self.__objectListLayout = GridLayout(cols=1, rows = self.__numberOfItems, size_hint = (None, None),
-				spacing = (0, 3))
-		else:
-			self.__objectListLayout.rows = self.__numberOfItems
-
-		for menuObject in self.__menuObjectsList:
-			img = menuObject.getDisplayImage()
-			self.__objectListLayout.add_widget(img)
-
-		self.__objectListLayout.size = (100, self.__numberOfItems * 67)
+		self.__searchResult = self.__searchIndex.search(self.__searchInput.text)
+		self.__updatePalette()
+		ThumbnailCache.Instance().flush()
 
 	def __init__(self):
 		self.__shortcutHandler = ShortcutHandler()
-		self.__objectListLayout = None
-		self.__loadItems()
+		self.__tilesPath = join(getcwd(), 'tiles')
+		self.__cellSize = (64, 64)
+		self.__menuObjectsList = []
+		self.__menuGroups = OrderedDict()
+		# Every item in the menu order and the position of each, as shown when nothing is searched.
+		self.__allItems = None
+		self.__itemOrder = {}
+		self.__imageToItem = {}
+		self.__searchIndex = TrigramIndex()
+		self.__searchResult = None
+		self.__searchInput = TextInput(multiline = False, size_hint = (1.0, None), height = 30, hint_text = 'Search')
+		self.__searchInput.bind(text = self.__processSearchText)
 		self.__scrollView = ScrollView(size_hint = (1.0, 1.0), do_scroll = (0, 1), effect_cls = EmptyScrollEffect)
-		self.__scrollView.add_widget(self.__objectListLayout)
+		# Only the images in view exist, they are bound again to other items while scrolling.
+		self.__paletteView = RecycleGridView(self.__scrollView, self.__createDisplayImage, self.__bindDisplayImage)
+		self.__paletteView.show()
+		self.__layout = BoxLayout(orientation = 'vertical', size_hint = (1.0, 1.0))
+		self.__layout.add_widget(self.__searchInput)
+		self.__layout.add_widget(self.__scrollView)
+		self.__loadItems()
+		self.__watcher = DirectoryWatcher(self.__tilesPath, self.__processTilesChanges, ['.png', '.opf'])
+		self.__watcher.start()
 
 	def reloadResource(self, resourceInfo):
-		pathToCheck = resourceInfo.getPath()
-		startIndex = None
-		finalIndex = None
-		i = 0
-		for menuObject in self.__menuObjectsList:
-			if (menuObject.getBaseObject().getPath() == pathToCheck):
-				if (startIndex is None):
-					startIndex = i
-			else:
-				if (startIndex is not None):
-					finalIndex = i
-					break
-			
-			i += 1
-
-		newObjectMenuItemList = []
-		for baseObject in self.__loadResourceInfoList(resourceInfo):
-			newObjectMenuItemList.append(ObjectMenuItem(baseObject, (64, 64)))
-			
-		if (startIndex is not None):
-			if (finalIndex is not None):
-				self.__menuObjectsList = self.__menuObjectsList[0:startIndex] + newObjectMenuItemList + \
-					self.__menuObjectsList[finalIndex:]
-			else:
-				self.__menuObjectsList = newObjectMenuItemList
+		path = resourceInfo.getPath()
+		self.__invalidateSource(path)
+		opfPath = path[:-4] + '.opf'
+		if (dirname(opfPath) == self.__tilesPath):
+			# The watcher would otherwise report the file that has just been saved.
+			item = basename(opfPath)
+			self.__watcher.acknowledge(item)
+			for pathToRefresh in self.__registerOpf(item):
+				self.__refreshImage(pathToRefresh)
 		else:
-			self.__menuObjectsList.extend(newObjectMenuItemList)
+			self.__setGroup(path, self.__createOpfItems(resourceInfo))
+
+		self.__searchResult = self.__searchIndex.search(self.__searchInput.text)
+		self.__updatePalette()
+		ThumbnailCache.Instance().flush()
 
-		self.__reloadMenuList()
-		
 	def getLayout(self):
-		return self.__scrollView
+		return self.__layout
 
-	def resetAllWidgets(self):
-		for menuObject in self.__menuObjectsList:
-			self.__scrollView.remove_widget(menuObject.getDisplayImage())
-			menuObject = None
+	def isSearching(self):
+		return self.__searchInput.focus
 
+	def resetAllWidgets(self):
 		self.__loadItems()
 
 	def setShortcut(self, code):
@@ -0,0 +1,148 @@
+from singleton import Singleton
+
+from imagebuffer import pixelsToArray
+
+class PixelCacheEntry:
+	def _onTextureReload(self, texture):
+		PixelCache.Instance().invalidateKey(self.__key)
+
+	def __init__(self, key, size, array, pixels = None):
+		self.__key = key
+		self.__size = tuple(size)
+		self.__array = array
+		self.__pixels = pixels
+
+	@staticmethod
+	def fromTexture(key, texture):
+		# Reading the pixels downloads the whole texture from the gpu, so it is done once per entry.
+		pixels = texture.pixels
+		width, height = texture.size
+		entry = PixelCacheEntry(key, (width, height), pixelsToArray(pixels, width, height), pixels)
+		# Kivy only keeps weak references to reload observers, the entry lives as long as the cache holds it.
+		texture.add_reload_observer(entry._onTextureReload)
+		return entry
+
+	def getKey(self):
+		return self.__key
+
+	def getSize(self):
+		return self.__size
+
+	def getPixels(self):
+		if (self.__pixels is None):
+			# Regions are views on the entry of their source, their bytes are only made when asked for.
+			self.__pixels = self.__array[::-1].tobytes()
+		return self.__pixels
+
+	def getArray(self):
+		return self.__array
+
+@Singleton
+class PixelCache:
+	# Entries are keyed by (source, region), region being None for a whole image. Images loaded from a file have
+	# their source, textures made by other means are told through setTextureSource, and any other texture stands for
+	# itself.
+
+	def __getKey(self, image):
+		texture = image.texture
+		if (image.source is not None and image.source != ''):
+			return (image.source, None)
+
+		if (texture in self.__textureSources):
+			return self.__textureSources[texture][0]
+
+		return (texture, None)
+
+	def __getEntry(self, image):
+		key = self.__getKey(image)
+		entry = self.__entries.get(key)
+		if (entry is not None):
+			return entry
+
+		source, region = key
+		if (region is None):
+			entry = PixelCacheEntry.fromTexture(key, image.texture)
+		else:
+			# Read from the texture of the whole source, shared by all of its regions.
+			sourceTexture = self.__textureSources[image.texture][1]
+			sourceKey = (source, None)
+			if (sourceKey not in self.__entries):
+				self.__entries[sourceKey] = PixelCacheEntry.fromTexture(sourceKey, sourceTexture)
+			x, y, width, height = region
+			array = self.__entries[sourceKey].getArray()[y:y + height, x:x + width]
+			entry = PixelCacheEntry(key, (width, height), array)
+
+		self.__entries[key] = entry
+		return entry
+
+	def __init__(self):
+		self.__entries = {}
+		self.__textureSources = {}
+		self.__references = {}
+
+	# Tells that texture holds the (x, y, width, height) region, in kivy coordinates, or the whole of the image at
+	# source, sourceTexture being the texture of the whole image. Each call must be matched by releaseTexture.
+	def setTextureSource(self, texture, source, region = None, sourceTexture = None):
+		if (region is not None):
+			region = tuple(region)
+		if (sourceTexture is None):
+			sourceTexture = texture
+
+		key = (source, region)
+		self.__textureSources[texture] = (key, sourceTexture)
+		self.__references[key] = self.__references.get(key, 0) + 1
+		self.__references[source] = self.__references.get(source, 0) + 1
+
+	# The texture is no longer used, entries nobody holds any more are dropped.
+	def releaseTexture(self, texture):
+		if (texture not in self.__textureSources):
+			return
+
+		key, sourceTexture = self.__textureSources.pop(texture)
+		source = key[0]
+		self.__references[key] -= 1
+		if (self.__references[key] == 0):
+			del self.__references[key]
+			self.invalidateKey(key)
+
+		self.__references[source] -= 1
+		if (self.__references[source] == 0):
+			del self.__references[source]
+			self.invalidateSource(source)
+
+	# Raw rgba bytes as given by texture.pixels (top row first), ready to be used by blit_buffer.
+	def getPixels(self, image):
+		return self.__getEntry(image).getPixels()
+
+	# Read only (height, width, 4) uint8 view whose first row is the bottom one, like the arrays of imagebuffer.
+	def getArray(self, image):
+		return self.__getEntry(image).getArray()
+
+	def getRegion(self, image, x, y, width, height):
+		return self.__getEntry(image).getArray()[y:y + height, x:x + width]
+
+	def getPixel(self, image, x, y):
+		entry = self.__getEntry(image)
+		width, height = entry.getSize()
+		x = min(max(int(x), 0), width - 1)
+		y = min(max(int(y), 0), height - 1)
+		return tuple(entry.getArray()[y, x].tolist())
+
+	def invalidate(self, image):
+		self.invalidateKey(self.__getKey(image))
+
+	def invalidateKey(self, key):
+		if (key in self.__entries):
+			del self.__entries[key]
+		if (key[1] is None):
+			# Regions are views on the pixels of their source.
+			self.invalidateSource(key[0])
+
+	# Drops the entries of the whole image at source and of all of its regions.
+	def invalidateSource(self, source):
+		for key in self.__entries.keys():
+			if (key[0] == source):
+				del self.__entries[key]
+
+	def clear(self):
+		self.__entries = {}
@@ -0,0 +1,134 @@
+from kivy.uix.relativelayout import RelativeLayout
+
+class RecycleGridView:
+	# Lays out a fixed size cell per item, from the top left corner, and only keeps widgets for the cells seen
+	# through the scroll view. Widgets leaving the view go back to a pool and are bound again to other items.
+
+	def __init__(self, scrollView, createViewMethod, bindViewMethod):
+		self.__scrollView = scrollView
+		self.__createViewMethod = createViewMethod
+		self.__bindViewMethod = bindViewMethod
+		self.__layout = RelativeLayout(size_hint = (None, None), size = (1, 1))
+		self.__numberOfItems = 0
+		self.__cols = 1
+		self.__rows = 0
+		self.__cellSize = (1, 1)
+		self.__spacing = 0
+		self.__indexToView = {}
+		self.__viewToIndex = {}
+		self.__freeViews = []
+		self.__visibleRange = None
+
+		self.__scrollView.bind(scroll_x = self.__updateVisibleViews, scroll_y = self.__updateVisibleViews,
+			size = self.__updateVisibleViews)
+
+	def __releaseView(self, index):
+		view = self.__indexToView[index]
+		del self.__indexToView[index]
+		del self.__viewToIndex[view]
+		self.__layout.remove_widget(view)
+		self.__freeViews.append(view)
+
+	def __getCellPosition(self, index):
+		row = index // self.__cols
+		col = index % self.__cols
+		x = col * (self.__cellSize[0] + self.__spacing)
+		y = self.__layout.height - row * (self.__cellSize[1] + self.__spacing) - self.__cellSize[1]
+		return (x, y)
+
+	def __getVisibleRange(self):
+		contentWidth, contentHeight = self.__layout.size
+		viewWidth, viewHeight = self.__scrollView.size
+		if (contentHeight > viewHeight):
+			bottom = self.__scrollView.scroll_y * (contentHeight - viewHeight)
+		else:
+			bottom = 0
+		if (contentWidth > viewWidth):
+			left = self.__scrollView.scroll_x * (contentWidth - viewWidth)
+		else:
+			left = 0
+
+		rowPitch = self.__cellSize[1] + self.__spacing
+		colPitch = self.__cellSize[0] + self.__spacing
+		firstRow = max(0, int((contentHeight - bottom - viewHeight) // rowPitch))
+		lastRow = min(self.__rows - 1, int((contentHeight - bottom) // rowPitch))
+		firstCol = max(0, int(left // colPitch))
+		lastCol = min(self.__cols - 1, int((left + viewWidth) // colPitch))
+		return (firstRow, lastRow, firstCol, lastCol)
+
+	def __updateVisibleViews(self, *args):
+		if (self.__layout.parent is not self.__scrollView or self.__numberOfItems == 0):
+			return
+
+		visibleRange = self.__getVisibleRange()
+		if (visibleRange == self.__visibleRange):
+			return
+
+		self.__visibleRange = visibleRange
+		firstRow, lastRow, firstCol, lastCol = visibleRange
+		visibleIndexes = set()
+		for row in range(firstRow, lastRow + 1):
+			for col in range(firstCol, lastCol + 1):
+				index = row * self.__cols + col
+				if (index < self.__numberOfItems):
+					visibleIndexes.add(index)
+
+		for index in self.__indexToView.keys():
+			if (index not in visibleIndexes):
+				self.__releaseView(index)
+
+		for index in visibleIndexes:
+			if (index not in self.__indexToView):
+				self.__showView(index)
+
+	def __showView(self, index):
+		if (self.__freeViews != []):
+			view = self.__freeViews.pop()
+		else:
+			view = self.__createViewMethod()
+
+		self.__indexToView[index] = view
+		self.__viewToIndex[view] = index
+		self.__bindViewMethod(view, index)
+		view.pos = self.__getCellPosition(index)
+		self.__layout.add_widget(view)
+
+	def setItems(self, numberOfItems, cols, cellSize, spacing = 0):
+		assert cols > 0, 'Number of columns must be positive.'
+		for index in self.__indexToView.keys():
+			self.__releaseView(index)
+
+		self.__numberOfItems = numberOfItems
+		self.__cols = cols
+		self.__rows = (numberOfItems + cols - 1) // cols
+		self.__cellSize = (max(1, cellSize[0]), max(1, cellSize[1]))
+		self.__spacing = spacing
+		self.__visibleRange = None
+		self.__layout.size = (
+			max(1, self.__cols * (self.__cellSize[0] + spacing) - spacing),
+			max(1, self.__rows * (self.__cellSize[1] + spacing) - spacing)
+		)
+		self.__updateVisibleViews()
+
+	def refresh(self):
+		for index, view in self.__indexToView.items():
+			self.__bindViewMethod(view, index)
+
+	def show(self):
+		if (self.__layout.parent is not self.__scrollView):
+			self.__scrollView.clear_widgets()
+			self.__scrollView.add_widget(self.__layout)
+
+		self.__visibleRange = None
+		self.__updateVisibleViews()
+
+	def getIndexOfView(self, view):
+		if (view in self.__viewToIndex):
+			return self.__viewToIndex[view]
+		return None
+
+	def getNumberOfItems(self):
+		return self.__numberOfItems
+
+	def getLayout(self):
+		return self.__layout
@@ -5,16 +5,19 @@ from kivy.uix.image import Image
 from kivy.uix.label import Label
 from kivy.uix.treeview import TreeView, TreeViewLabel
 from kivy.uix.checkbox import CheckBox
-from kivy.graphics.vertex_instructions import Line
-from kivy.graphics import Color
+from kivy.graphics.vertex_instructions import Line, Mesh
+from kivy.graphics import Color, InstructionGroup
 from kivy.graphics.texture import Texture
 
 from editorheritage import SpecialScrollControl
 from editorutils import CancelableButton, AutoReloadTexture, AlertPopUp, Dialog, convertKivyCoordToOrxCoord
-from editorutils import NumberInput
+from editorutils import NumberInput, BitArray
 from keyboard import KeyboardAccess, KeyboardGuardian
 from splittedimagemap import SpriteSelection, SplittedImageExporter, SplittedImageImporter
 from communicationobjects import ResourceLoaderToObjectDescriptor
+from pixelcache import PixelCache
+from assetcache import AssetCache
+from sheetanalysis import findSpriteBounds, detectBackgroundColor, detectGridPitch
 
 class WhiteImage:
 	def __init__(self):
@@ -36,64 +39,111 @@ class WhiteImage:
 	def getImage(self):
 		return self.__image
 
-class GridCell:
-	def __init__(self, canvas, x, y, xSize, ySize):
-		self.__x = x
-		self.__y = y
+def createLineMeshes(points):
+	# points holds x, y pairs, two per segment. Mesh indices are unsigned shorts, so big sets are split.
+	meshes = []
+	pointsPerMesh = 65534
+	for start in range(0, len(points) // 2, pointsPerMesh):
+		vertices = []
+		for k in range(start * 2, min(len(points), (start + pointsPerMesh) * 2), 2):
+			vertices.extend((points[k], points[k + 1], 0., 0.))
+		meshes.append(Mesh(vertices = vertices, indices = range(len(vertices) // 4), mode = 'lines'))
+
+	return meshes
+
+class GridOverlay:
+	# The whole grid is drawn by a few line meshes and the selected cells by a second group, to which every select
+	# only appends the cells it newly selects according to the cell state bitmap. Clearing drops the whole group.
+	def __init__(self, canvas, left, top, xSize, ySize, columns, rows):
+		self.__canvasRef = canvas
+		self.__left = left
+		self.__top = top
 		self.__xSize = xSize
 		self.__ySize = ySize
-		self.__canvasRef = canvas
-		self.__operation = None
-		self.__color = None
-		self.__marked = False
-		self.draw((0., 1., 0., 1.))
-
-	def draw(self, colorToUse):
-		if (self.__operation is not None):
-			self.__canvasRef.remove(self.__operation)
-			self.__canvasRef.remove(self.__color)
-			self.__canvasRef.ask_update()
-
-		self.__color = Color(*colorToUse)
-		self.__operation = Line(points = [
-			self.__x, self.__y,
-			self.__x, self.__y - self.__ySize,
-			self.__x + self.__xSize, self.__y - self.__ySize,
-			self.__x + self.__xSize, self.__y],
-			close = True, width = 1
-		)
-		self.__canvasRef.add(self.__color)
-		self.__canvasRef.add(self.__operation)
-		self.__canvasRef.ask_update()
+		self.__columns = columns
+		self.__rows = rows
+		self.__selectedCells = BitArray(columns * rows)
+		self.__hasSelection = False
+
+		right = left + columns * xSize
+		bottom = top - rows * ySize
+		points = []
+		for j in range(rows + 1):
+			points.extend((left, top - j * ySize, right, top - j * ySize))
+		for i in range(columns + 1):
+			points.extend((left + i * xSize, top, left + i * xSize, bottom))
+
+		self.__group = InstructionGroup()
+		self.__group.add(Color(0., 1., 0., 1.))
+		for mesh in createLineMeshes(points):
+			self.__group.add(mesh)
+
+		self.__selectionGroup = InstructionGroup()
+		self.__group.add(self.__selectionGroup)
+		self.__canvasRef.add(self.__group)
+
+	def __addToSelectionGroup(self, indexes):
+		if (self.__hasSelection == False):
+			self.__selectionGroup.add(Color(1., 0., 0., 1.))
+			self.__hasSelection = True
+
+		points = []
+		for index in indexes:
+			x = self.__left + (index % self.__columns) * self.__xSize
+			y = self.__top - (index // self.__columns) * self.__ySize
+			x2 = x + self.__xSize
+			y2 = y - self.__ySize
+			points.extend((x, y, x2, y, x2, y, x2, y2, x2, y2, x, y2, x, y2, x, y))
+
+		for mesh in createLineMeshes(points):
+			self.__selectionGroup.add(mesh)
+
+	def select(self, startRow, startColumn, finalRow, finalColumn):
+		newIndexes = []
+		for j in range(startRow, finalRow + 1):
+			for i in range(startColumn, finalColumn + 1):
+				index = j * self.__columns + i
+				if (self.__selectedCells.get(index) == False):
+					self.__selectedCells.set(index, True)
+					newIndexes.append(index)
+
+		if (newIndexes != []):
+			self.__addToSelectionGroup(newIndexes)
+
+	def clearSelection(self):
+		if (self.__hasSelection == False):
+			return
+
+		self.__selectedCells.setAll(False)
+		self.__selectionGroup.clear()
+		self.__hasSelection = False
 
-	def select(self):
-		self.__marked = True
-		self.draw((1., 0., 0., 1.))
+	def getColumns(self):
+		return self.__columns
 
-	def unselect(self):
-		if (self.__marked):
-			self.draw((0., 1., 0., 1.))
+	def getRows(self):
+		return self.__rows
 
 class ResourceLoaderDisplay(SpecialScrollControl):
 
 	def __clearGraphicGrid(self):
 		self.__currentSelection = None
-		for line in self.__gridGraphics:
-			for cell in line:
-				cell.unselect()
+		if (self.__gridOverlay is not None):
+			self.__gridOverlay.clearSelection()
 
 	def __posToGridCoords(self, x, y):
-		i, j = int((x + self.__xSkip) / self.__xSize), int((y - self.__ySkip) / self.__ySize)
+		# Rows are counted from the top of the grid, which starts ySkip below the top of the image.
+		top = self.__layout.size[1] - self.__ySkip
+		i, j = int((x - self.__xSkip) // self.__xSize), int((top - y) // self.__ySize)
 		if (i < 0):
 			i = 0
-		elif (i >= self.__columns):
-			i = self.__columns - 1
+		elif (i >= self.__gridOverlay.getColumns()):
+			i = self.__gridOverlay.getColumns() - 1
 
-		j = self.__rows - j - 1
 		if (j < 0):
 			j = 0
-		elif (j >= self.__rows):
-			j = self.__rows - 1
+		elif (j >= self.__gridOverlay.getRows()):
+			j = self.__gridOverlay.getRows() - 1
 
 		return (j, i)
 
@@ -120,14 +170,7 @@ class ResourceLoaderDisplay(SpecialScrollControl):
 		if (self.__currentImage is not None and self.__colorPicking == True):
 			imgCoords = self.__currentImage.to_widget(touch.pos[0], touch.pos[1])
 			if(self.__currentImage.collide_point(*imgCoords)):
-				adjY = self.__currentImage.texture_size[1] - int(imgCoords[1]) - 1
-				pixelAddress = ((adjY * self.__currentImage.texture_size[0]) + int(imgCoords[0]) - 1) * 4
-				clickedColor = (
-					ord(self.__currentImage.texture.pixels[pixelAddress]),
-					ord(self.__currentImage.texture.pixels[pixelAddress + 1]),
-					ord(self.__currentImage.texture.pixels[pixelAddress + 2]),
-					ord(self.__currentImage.texture.pixels[pixelAddress + 3])
-				)
+				clickedColor = PixelCache.Instance().getPixel(self.__sourceImage, imgCoords[0], imgCoords[1])
 				self.__updateColorMethod(clickedColor)
 
 		self.finishSelection(touch)
@@ -136,37 +179,29 @@ class ResourceLoaderDisplay(SpecialScrollControl):
 		self.__layout.clear_widgets()
 		self.__layout.canvas.clear()
 		self.__layout.add_widget(self.__currentImage)
-		self.__gridGraphics = []
+		self.__gridOverlay = None
 		self.__selectionPreview = None
 		self.__currentSelection = None
 
 	def __doDrawGrid(self, xInc, yInc, xSkip = 0, ySkip = 0):
 		self.__clearSelectionGrid()
 		self.__xSize = xInc
-		self.__ySize = xInc
+		self.__ySize = yInc
 		self.__xSkip = xSkip
 		self.__ySkip = ySkip
 
-		j = self.__layout.size[1] - ySkip
-		while j - yInc >= 0:
-			i = xSkip
-			line = []
-			while i + xInc <= self.__layout.size[0]:
-				line.append(GridCell(self.__layout.canvas, i, j, xInc, yInc))
-				i += xInc
-			j -= yInc
-			self.__gridGraphics.append(line)
-
-		if (self.__gridGraphics != []):
-			self.__columns = len(self.__gridGraphics[0])
-			self.__rows = len(self.__gridGraphics)
+		top = self.__layout.size[1] - ySkip
+		columns = max(0, int((self.__layout.size[0] - xSkip) // xInc))
+		rows = max(0, int(top // yInc))
+		if (columns != 0 and rows != 0):
+			self.__gridOverlay = GridOverlay(self.__layout.canvas, xSkip, top, xInc, yInc, columns, rows)
 
 	def __setStartState(self):
 		self.__selectionStarted = False
 		self.__selectionStartPos = None
 		self.__currentSelection = None
 		self.__colorPicking = False
-		self.__gridGraphics = []
+		self.__gridOverlay = None
 
 	def __init__(self, **kwargs):
 		super(ResourceLoaderDisplay, self).__init__(size_hint = (1.0, 1.0))
@@ -180,6 +215,7 @@ class ResourceLoaderDisplay(SpecialScrollControl):
 		self.__selectionPreview = None
 		self.__layout = RelativeLayout(size_hint = (None, None), size = (100, 100))
 		self.__currentImage = None
+		self.__sourceImage = None
 		self.__updateColorMethod = kwargs['colorMethod']
 		self._scrollView.add_widget(self.__layout)
 
@@ -187,15 +223,15 @@ class ResourceLoaderDisplay(SpecialScrollControl):
 		pass
 
 	def startSelection(self, touch):
-		if (self.__currentImage is not None and self.__gridGraphics != [] and self.__selectionStarted == False):
+		if (self.__currentImage is not None and self.__gridOverlay is not None and self.__selectionStarted == False):
 			self.__clearGraphicGrid()
 			self.__selectionStarted = True
 			self.__selectionStartPos = self.__currentImage.to_widget(*touch.pos)
 			sj, si = self.__posToGridCoords(*self.__selectionStartPos)
-			self.__gridGraphics[sj][si].select()
+			self.__gridOverlay.select(sj, si, sj, si)
 
 	def finishSelection(self, touch):
-		if (self.__currentImage is not None and self.__gridGraphics != [] and self.__selectionStarted == True):
+		if (self.__currentImage is not None and self.__gridOverlay is not None and self.__selectionStarted == True):
 			pos = self.__currentImage.to_widget(*touch.pos)
 			fj, fi = self.__posToGridCoords(*pos)
 			sj, si = self.__posToGridCoords(*self.__selectionStartPos)
@@ -204,13 +240,7 @@ class ResourceLoaderDisplay(SpecialScrollControl):
 			loopFinalIndexI = max(si, fi)
 			loopFinalIndexJ = max(sj, fj)
 
-			tempI = loopStartIndexI
-			while (tempI <= loopFinalIndexI):
-				tempJ = loopStartIndexJ
-				while(tempJ <= loopFinalIndexJ):
-					self.__gridGraphics[tempJ][tempI].select()
-					tempJ += 1
-				tempI += 1
+			self.__gridOverlay.select(loopStartIndexJ, loopStartIndexI, loopFinalIndexJ, loopFinalIndexI)
 
 			self.__selectionStarted = False
 			self.__currentSelection = SpriteSelection(
@@ -229,7 +259,12 @@ class ResourceLoaderDisplay(SpecialScrollControl):
 			self.__layout.canvas.clear()
 			self.__layout.remove_widget(self.__currentImage)
 
-		im = Image(source = path)
+		if (self.__sourceImage is not None):
+			AssetCache.Instance().release(self.__sourceImage.texture)
+
+		texture = AssetCache.Instance().acquire(path)
+		im = Image(texture = texture, size = texture.size)
+		self.__sourceImage = im
 		self.__texture = AutoReloadTexture(im.texture.size, im)
 		self.__currentImage = Image(size = im.texture.size, texture = self.__texture.getTexture())
 		self.__layout.size = im.texture.size
@@ -272,6 +307,11 @@ class ResourceLoaderDisplay(SpecialScrollControl):
 	def getSize(self):
 		return self.__layout.size
 
+	def getImageArray(self):
+		if (self.__sourceImage is None):
+			return None
+		return PixelCache.Instance().getArray(self.__sourceImage)
+
 class ResourceLoaderList(SpecialScrollControl):
 
 	def __ignoreMoves(self, touch):
@@ -300,15 +340,16 @@ class ResourceLoaderList(SpecialScrollControl):
 				str(selection.getSizeX()) + ', ' + str(selection.getSizeY()) + ')', id = 'selection#' + \
 				str(identifier), on_touch_down = self.__callShowMethod)
 		self.__tree.add_node(node)
-		self.__layout.height = self.__tree.minimum_height
 
 	def __renderLoadedList(self, selectionItems):
 		for item in selectionItems:
 			self.__doAddItemRender(item[1], item[0])
+		self.__layout.height = self.__tree.minimum_height
 
 	def __doAddItem(self, selection):
 		identifier = self.__resourceInfo.addSelection(selection)
 		self.__doAddItemRender(selection, identifier)
+		self.__layout.height = self.__tree.minimum_height
 
 	def __clearUi(self):
 		for node in self.__tree.children:
@@ -342,17 +383,14 @@ class ResourceLoaderList(SpecialScrollControl):
 			itemName, itemId = self.__tree.selected_node.id.split('#')
 			if (itemName != 'root'):
 				self.__tree.remove_node(self.__tree.selected_node)
-				self.__resourceInfo.removeSelectionById(itemId)
+				self.__resourceInfo.removeSelectionById(int(itemId))
 				self.__tree.select_node(self.__tree.root)
 				self.__layout.height = self.__tree.minimum_height
 
 	def addItemList(self, selectionList):
-		count = 0
-		for selection in selectionList:
-			if (self.__resourceInfo.hasSame(selection) == False):
-				self.__doAddItem(selection)
-			else:
-				count += 1
+		addedItems = self.__resourceInfo.addSelectionList(selectionList)
+		self.__renderLoadedList(addedItems)
+		count = len(selectionList) - len(addedItems)
 
 		if (count != 0):
 			if (count == 1):
@@ -614,6 +652,22 @@ class ResourceLoaderPopup(KeyboardAccess):
 
 			self.__selectionTree.addItemList(l)
 
+	def __processAutoSlice(self, *args):
+		imageArray = self.__display.getImageArray()
+		if (imageArray is None):
+			return
+
+		l = []
+		for x, y, width, height in findSpriteBounds(imageArray, detectBackgroundColor(imageArray)).tolist():
+			l.append(SpriteSelection(x, y, width, height))
+
+		if (l == []):
+			warn = AlertPopUp('Error', 'No sprite could be found on this image.', 'Ok')
+			warn.open()
+			return
+
+		self.__selectionTree.addItemList(l)
+
 	def __showSelection(self, *args):
 		selection = self.__selectionTree.getSelection()
 		if (selection is not None):
@@ -643,11 +697,13 @@ class ResourceLoaderPopup(KeyboardAccess):
 		dialog.open()
 
 	def __createRightMenuUi(self):
-		self.__selectionTree = ResourceLoaderList(size_hint = (1.0, 0.75), showMethod = self.__showSelection)
+		self.__selectionTree = ResourceLoaderList(size_hint = (1.0, 0.7), showMethod = self.__showSelection)
 		self.__addFullSelection = CancelableButton(text = 'Add as one', size_hint = (1.0, 0.05),
 			on_release = self.__processAddSelection)
 		self.__addPartSelection = CancelableButton(text = 'Add parts', size_hint = (1.0, 0.05),
 			on_release = self.__processAddPartsSelection)
+		self.__autoSliceSelection = CancelableButton(text = 'Auto slice', size_hint = (1.0, 0.05),
+			on_release = self.__processAutoSlice)
 		self.__showSelection = CancelableButton(text = 'Show', size_hint = (1.0, 0.05),
 			on_release = self.__showSelection)
 		self.__removeCurrent = CancelableButton(text = 'Remove', size_hint = (1.0, 0.05),
@@ -658,6 +714,7 @@ class ResourceLoaderPopup(KeyboardAccess):
 		self.__rightMenu.add_widget(self.__selectionTree.getLayout())
 		self.__rightMenu.add_widget(self.__addFullSelection)
 		self.__rightMenu.add_widget(self.__addPartSelection)
+		self.__rightMenu.add_widget(self.__autoSliceSelection)
 		self.__rightMenu.add_widget(self.__showSelection)
 		self.__rightMenu.add_widget(self.__removeCurrent)
 		self.__rightMenu.add_widget(self.__clearSelection)
@@ -666,6 +723,22 @@ class ResourceLoaderPopup(KeyboardAccess):
 		self.__state = 'size'
 		self.__loadSizeLeftMenu()
 
+	def __prefillSizeInputs(self):
+		imageArray = self.__display.getImageArray()
+		if (imageArray is None):
+			return
+
+		xPitch, yPitch = detectGridPitch(imageArray, detectBackgroundColor(imageArray))
+		if (xPitch is not None):
+			self.__xSizeInput.text = str(xPitch[0])
+			self.__xSkipInput.text = str(xPitch[1])
+
+		if (yPitch is not None):
+			pitch, offset, spacing = yPitch
+			self.__ySizeInput.text = str(pitch)
+			# The detected offset is counted from the bottom, skips on y from the top of the image.
+			self.__ySkipInput.text = str((imageArray.shape[0] - offset) % pitch)
+
 	def __init__(self):
 		super(ResourceLoaderPopup, self).__init__()
 		self.__isShiftPressed = False
@@ -696,6 +769,7 @@ class ResourceLoaderPopup(KeyboardAccess):
 
 		self.__setStartState()
 		self.__display.loadImage(path)
+		self.__prefillSizeInputs()
 		sizeToUse = self.__display.getSize()
 		self.__selectionTree.loadImage(path, sizeToUse[1])
 		self.__keepOriginalCheckbox.active = self.__selectionTree.getKeepOriginal()
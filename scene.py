@@ -1,16 +1,19 @@
 from kivy.uix.relativelayout import RelativeLayout
-from kivy.graphics.vertex_instructions import Line
+from kivy.graphics.vertex_instructions import Line, Rectangle
 #from kivy.graphics.fbo import Fbo
-from kivy.graphics import Color
+from kivy.graphics import Color, InstructionGroup
+from kivy.graphics.texture import Texture
 from kivy.core.window import Window
 
-from operator import itemgetter
+from bisect import bisect_left, bisect_right
+from numpy import zeros, uint8
 
 from editorheritage import SpecialScrollControl
 from editorobjects import RenderObjectGuardian
 from editorutils import AlertPopUp
 from objectdescriptor import ObjectDescriptor, MultipleSelectionDescriptor
 from layerinfo import LayerGuardian
+from spatialindex import SpatialGrid
 
 class SceneAttributes:
 	def __init__(self, tileSize, numberOfTilesX, numberOfTilesY):
@@ -29,51 +32,58 @@ class SceneAttributes:
 	def setValues(self, name, value):
 		self.__valuesDict[name] = value
 
+class GridOverlay:
+	# The whole grid is one rectangle repeating a tile sized texture with its borders drawn, so its cost does not
+	# depend on the map size and the gpu only fills the part that is visible.
+	def _reloadTexture(self, texture):
+		texture.blit_buffer(self.__pixels, colorfmt = 'rgba', bufferfmt = 'ubyte')
+
+	def __init__(self, tileSize, width, height):
+		# Two pixels on each side of every tile, as the former lines of width 2 centered on the tile borders.
+		pixels = zeros((tileSize, tileSize, 4), dtype = uint8)
+		pixels[:, [0, tileSize - 1]] = (0, 255, 0, 255)
+		pixels[[0, tileSize - 1], :] = (0, 255, 0, 255)
+		self.__pixels = pixels.tobytes()
+
+		self.__texture = Texture.create(size = (tileSize, tileSize), colorfmt = 'rgba')
+		self.__texture.wrap = 'repeat'
+		self.__texture.add_reload_observer(self._reloadTexture)
+		self._reloadTexture(self.__texture)
+
+		repeatX = width / float(tileSize)
+		repeatY = height / float(tileSize)
+		self.__group = InstructionGroup()
+		self.__group.add(Color(1., 1., 1.))
+		rectangle = Rectangle(texture = self.__texture, pos = (0, 0), size = (width, height))
+		rectangle.tex_coords = (0., 0., repeatX, 0., repeatX, repeatY, 0., repeatY)
+		self.__group.add(rectangle)
+
+	def getInstructions(self):
+		return self.__group
+
 class Scene:
 
 	def __init__(self, attributes = None):
 		self.__alignToGrid = False
 		self.__objectDict = {}
+		self.__drawOrder = []
+		self.__drawKeys = {}
+		self.__priorities = LayerGuardian.Instance().getNameToPriorityDict()
+		self.__selectionBox = None
+		self.__selectionBoxLine = None
+		self.__selectionBoxStart = None
+		self.__grid = None
+		self.__showGrid = False
 		self.__layout = RelativeLayout(size_hint = (None, None), on_resize = self.redraw)
 		self.__renderGuardian = RenderObjectGuardian()
 		self.loadValues(attributes)
 		#self.__fbo = Fbo(size = self.__layout.size)
 
 	def showGrid(self):
-		with self.__layout.canvas:
-			Color(0., 1., 0.)
-			i = 0
-			while i < self.__maxX:
-				Line(points = [
-					i, 0,
-					i, self.__maxY], width = 2
-				)
-				i += self.__tileSize
-			i = 0
-			while i < self.__maxY:
-				Line(points = [
-					0, i,
-					self.__maxX, i], width = 2
-				)
-				i += self.__tileSize
+		self.__layout.canvas.before.add(self.__grid.getInstructions())
 
 	def hideGrid(self):
-		with self.__layout.canvas:
-			Color(0., 0., 0.)
-			i = 0
-			while i < self.__maxX:
-				Line(points = [
-					i, 0,
-					i, self.__maxY], width = 2
-				)
-				i += self.__tileSize
-			i = 0
-			while i < self.__maxY:
-				Line(points = [
-					0, i,
-					self.__maxX, i], width = 2
-				)
-				i += self.__tileSize
+		self.__layout.canvas.before.remove(self.__grid.getInstructions())
 
 	#def getTexture(self):
 	#	self.__fbo.clear_color = (0, 0, 0, 0)
@@ -91,9 +101,8 @@ class Scene:
 
 		self.__showGrid = not self.__showGrid
 
-		self.redraw()
-
 	def loadValues(self, attributes = None):
+		self.__clearDrawOrder()
 		self.__layout.canvas.clear()
 		if (attributes is None):
 			self.__sceneAttr = SceneAttributes(40, 100, 100)
@@ -109,7 +118,13 @@ class Scene:
 		self.__minX = 0.0
 		self.__maxY = sy
 		self.__minY = 0.0
+		if (self.__showGrid == True):
+			self.hideGrid()
+		# Drawn before the objects, below all of them.
+		self.__grid = GridOverlay(self.__tileSize, sx, sy)
 		self.__showGrid = True
+		# A few tiles per cell, most objects are listed in one to four cells.
+		self.__spatialIndex = SpatialGrid(self.__tileSize * 4)
 		if self.__objectDict != {}:
 			for key in self.__objectDict:
 				self.__objectDict[key].resetAllWidgets()
@@ -117,24 +132,138 @@ class Scene:
 
 		self.showGrid()
 
-	def redraw(self):
-		objectsList = []
-		nameToPriorityDict = LayerGuardian.Instance().getNameToPriorityDict()
-		for key in self.__objectDict.keys():
-			objectsList.append(
-				(
-					self.__objectDict[key], 
-					nameToPriorityDict[self.__objectDict[key].getLayer()],
-					self.__objectDict[key].getIdentifier()
-				)
-			)
+	def __insertObject(self, identifier, obj):
+		self.__objectDict[identifier] = obj
+		self.__updateDrawOrder(obj)
+		x, y = obj.getPos()
+		sx, sy = obj.getSize()
+		self.__spatialIndex.update(obj, x, y, sx, sy)
+
+	# Objects report moves to the render guardian, their bounds are only read again when a query needs them.
+	def __updateSpatialIndex(self):
+		for obj in self.__renderGuardian.popMovedObjects():
+			if (self.__spatialIndex.contains(obj) == True):
+				x, y = obj.getPos()
+				sx, sy = obj.getSize()
+				self.__spatialIndex.update(obj, x, y, sx, sy)
+
+	def __isQueryable(self, obj):
+		return obj.getHidden() == False and obj.getFinished() == False
+
+	# Visible objects under the point, in layout coordinates.
+	def getObjectsAt(self, x, y):
+		self.__updateSpatialIndex()
+		return [obj for obj in self.__spatialIndex.queryPoint(x, y) if self.__isQueryable(obj) == True]
+
+	# Visible objects intersecting the rectangle whose bottom left corner is (x, y), in layout coordinates.
+	def getObjectsInRect(self, x, y, width, height):
+		self.__updateSpatialIndex()
+		return [obj for obj in self.__spatialIndex.queryRect(x, y, width, height) if self.__isQueryable(obj) == True]
+
+	def getNearestObject(self, x, y, maxDistance = None):
+		self.__updateSpatialIndex()
+		return self.__spatialIndex.nearest(x, y, maxDistance, self.__isQueryable)
+
+	def startSelectionBox(self, x, y):
+		self.cancelSelectionBox()
+		self.__selectionBoxStart = (x, y)
+		self.__selectionBox = InstructionGroup()
+		self.__selectionBox.add(Color(1., 1., 0.))
+		self.__selectionBoxLine = Line(points = [x, y, x, y, x, y, x, y, x, y])
+		self.__selectionBox.add(self.__selectionBoxLine)
+		# The first instruction of canvas.after pops the translation of the layout, the box goes before it to be drawn
+		# in layout coordinates.
+		self.__layout.canvas.after.insert(0, self.__selectionBox)
+
+	def updateSelectionBox(self, x, y):
+		sx, sy = self.__selectionBoxStart
+		self.__selectionBoxLine.points = [sx, sy, x, sy, x, y, sx, y, sx, sy]
+
+	def cancelSelectionBox(self):
+		if (self.__selectionBox is not None):
+			self.__layout.canvas.after.remove(self.__selectionBox)
+			self.__selectionBox = None
+			self.__selectionBoxLine = None
+
+	# Selects the objects touched by the box from its start to (x, y), see RenderObjectGuardian.selectObjects for
+	# the modes. A box too small to be a drag is a plain click and changes nothing.
+	def endSelectionBox(self, x, y, mode):
+		self.cancelSelectionBox()
+		sx, sy = self.__selectionBoxStart
+		if (abs(x - sx) < 2 and abs(y - sy) < 2):
+			return
+
+		objects = self.getObjectsInRect(min(x, sx), min(y, sy), abs(x - sx), abs(y - sy))
+		objects.sort(key = lambda obj: obj.getIdentifier())
+		self.__renderGuardian.selectObjects(objects, mode)
+		self.__updateDesctriptorBySelection()
 
+	def hasSelectionBox(self):
+		return self.__selectionBox is not None
+
+	def __clearDrawOrder(self):
 		self.__layout.clear_widgets()
-		objectsOrderedList = sorted(objectsList, key=itemgetter(1, 2))
-		for obj in objectsOrderedList:
-			self.__layout.add_widget(obj[0])
+		self.__drawOrder = []
+		self.__drawKeys = {}
+
+	# The layout only holds the visible objects, ordered by (layer priority, identifier) as kept in __drawOrder.
+	# Kivy draws its children from the last one, so the widget of __drawOrder[i] is at index len - 1 - i.
+	def __updateDrawOrder(self, obj):
+		identifier = obj.getIdentifier()
+		oldKey = self.__drawKeys.get(identifier)
+		if (obj.getHidden() == True or obj.getFinished() == True):
+			newKey = None
+		elif (obj.getLayer() not in self.__priorities):
+			# A layer created since the last redraw, every priority is read again.
+			self.__priorities = LayerGuardian.Instance().getNameToPriorityDict()
+			self.__rebuildDrawOrder()
+			return
+		else:
+			newKey = (self.__priorities[obj.getLayer()], identifier)
+
+		if (newKey == oldKey):
+			return
+
+		if (oldKey is not None):
+			del self.__drawOrder[bisect_left(self.__drawOrder, oldKey)]
+			del self.__drawKeys[identifier]
+			self.__layout.remove_widget(obj)
+
+		if (newKey is not None):
+			index = bisect_right(self.__drawOrder, newKey)
+			self.__layout.add_widget(obj, len(self.__drawOrder) - index)
+			self.__drawOrder.insert(index, newKey)
+			self.__drawKeys[identifier] = newKey
+			if (self.__alignToGrid == True):
+				obj.alignToGrid()
+
+	def __rebuildDrawOrder(self):
+		self.__clearDrawOrder()
+		for obj in self.__objectDict.values():
+			if (obj.getHidden() == False and obj.getFinished() == False):
+				key = (self.__priorities[obj.getLayer()], obj.getIdentifier())
+				self.__drawOrder.append(key)
+				self.__drawKeys[key[1]] = key
+
+		self.__drawOrder.sort()
+		for key in self.__drawOrder:
+			obj = self.__objectDict[key[1]]
+			self.__layout.add_widget(obj)
 			if (self.__alignToGrid == True):
-				obj[0].alignToGrid()
+				obj.alignToGrid()
+
+	# Only the objects reported as changed by the render guardian are moved, unless layer priorities changed.
+	def redraw(self):
+		priorities = LayerGuardian.Instance().getNameToPriorityDict()
+		changedObjects = self.__renderGuardian.popChangedObjects()
+		if (priorities != self.__priorities):
+			self.__priorities = priorities
+			self.__rebuildDrawOrder()
+			return
+
+		for obj in changedObjects:
+			if (self.__objectDict.get(obj.getIdentifier()) is obj):
+				self.__updateDrawOrder(obj)
 
 	def __updateDesctriptorBySelection(self):
 		newObjects = self.__renderGuardian.getSelection()
@@ -149,15 +278,18 @@ class Scene:
 	def undo(self):
 		self.__renderGuardian.undo()
 		self.__updateDesctriptorBySelection()
+		self.redraw()
 
 	def redo(self):
 		self.__renderGuardian.redo()
 		self.__updateDesctriptorBySelection()
+		self.redraw()
 
 	def clear(self, unusedDt = None):
 		for key in self.__objectDict.keys():
 			if (self.__objectDict[key].getFinished() == True):
-				self.__layout.remove_widget(self.__objectDict[key])
+				self.__updateDrawOrder(self.__objectDict[key])
+				self.__spatialIndex.remove(self.__objectDict[key])
 				self.__objectDict[key] = None
 				del self.__objectDict[key]
 
@@ -192,6 +324,7 @@ class Scene:
 		deletedObjects = self.__renderGuardian.deleteSelection()
 		if (len(deletedObjects) != 0):
 			ObjectDescriptor.Instance().clearCurrentObject()
+			self.redraw()
 
 	def alignToGrid(self):
 		self.__renderGuardian.alignSelectionToGrid()
@@ -200,8 +333,7 @@ class Scene:
 		newObjects = self.__renderGuardian.copySelection(direction, self.__id, self.__tileSize, self.__maxX,
 			self.__maxY)
 		for renderedObject in newObjects:
-			self.__layout.add_widget(renderedObject)
-			self.__objectDict[self.__id] = renderedObject
+			self.__insertObject(self.__id, renderedObject)
 			self.__id += 1
 
 		numberOfNewObjects = len(newObjects)
@@ -215,6 +347,8 @@ class Scene:
 		ObjectDescriptor.Instance().clearCurrentObject()
 
 	def resetAllWidgets(self):
+		self.__clearDrawOrder()
+		self.__spatialIndex.clear()
 		for objectId in self.__objectDict.keys():
 			self.__objectDict[objectId].resetAllWidgets()
 			self.__objectDict[objectId] = None
@@ -255,8 +389,7 @@ class Scene:
 		newRenderedObject = self.__renderGuardian.createNewObject(self.__id, obj, (finalX, finalY),
 				self.__tileSize, self.__maxX, self.__maxY)
 
-		self.__layout.add_widget(newRenderedObject)
-		self.__objectDict[self.__id] = newRenderedObject
+		self.__insertObject(self.__id, newRenderedObject)
 		self.__id += 1
 
 		ObjectDescriptor.Instance().setObject(newRenderedObject)
@@ -278,8 +411,7 @@ class Scene:
 			newRenderedObject.setCollisionInfo(collisionInfo)	
 		
 		newRenderedObject.setLayer(layer)
-		self.__layout.add_widget(newRenderedObject)
-		self.__objectDict[identifier] = newRenderedObject
+		self.__insertObject(identifier, newRenderedObject)
 
 	def getObjectsDict(self):
 		return self.__objectDict
@@ -369,12 +501,9 @@ class SceneHandler (SpecialScrollControl):
 			self.__sceneList[self.__currentIndex].redo()
 
 	def __getSelectedObjectByClick(self, touch):
-		clickedObjectsList = []
-		childDict = self.__sceneList[self.__currentIndex].getObjectsDict()
-		for key in childDict.keys():
-			if (childDict[key].collide_point(*self.__sceneList[self.__currentIndex].getLayout().to_widget(*touch.pos,
-					relative = False)) == True and childDict[key].getHidden() == False):
-				clickedObjectsList.append(childDict[key])
+		currentScene = self.__sceneList[self.__currentIndex]
+		x, y = currentScene.getLayout().to_widget(*touch.pos, relative = False)
+		clickedObjectsList = currentScene.getObjectsAt(x, y)
 
 		first = True
 		selectedObject = None
@@ -413,8 +542,33 @@ class SceneHandler (SpecialScrollControl):
 		else:
 			MultipleSelectionDescriptor.Instance().setValues(numberOfSelectedObjects)
 
+	# Ctrl adds to the selection, shift removes from it and both keep only the objects already selected.
+	def __getSelectionBoxMode(self):
+		if (self._isCtrlPressed == True and self._isShiftPressed == True):
+			return 'intersect'
+		elif (self._isCtrlPressed == True):
+			return 'add'
+		elif (self._isShiftPressed == True):
+			return 'subtract'
+		else:
+			return 'replace'
+
+	def __handleSelectionBoxMove(self, touch):
+		currentScene = self.__sceneList[self.__currentIndex]
+		if (touch.uid != self.__selectionBoxTouchId or currentScene.hasSelectionBox() == False):
+			return None
+
+		currentScene.updateSelectionBox(*currentScene.getLayout().to_widget(*touch.pos, relative = False))
+		return True
+
 	def __handleScrollAndPassTouchUpToChildren(self, touch):
-		self.__sceneList[self.__currentIndex].redraw()
+		currentScene = self.__sceneList[self.__currentIndex]
+		if (touch.uid == self.__selectionBoxTouchId and currentScene.hasSelectionBox() == True):
+			x, y = currentScene.getLayout().to_widget(*touch.pos, relative = False)
+			currentScene.endSelectionBox(x, y, self.__getSelectionBoxMode())
+			self.__selectionBoxTouchId = None
+
+		currentScene.redraw()
 		self.__defaultTouchUp(touch)
 
 	def __handleScrollAndPassTouchDownToChildren(self, touch):
@@ -431,6 +585,11 @@ class SceneHandler (SpecialScrollControl):
 					self.__selectObject(selectedObject)
 				else:
 					self.__unselectObject(selectedObject)
+			else:
+				# Dragging over an empty place draws a selection box.
+				currentScene = self.__sceneList[self.__currentIndex]
+				currentScene.startSelectionBox(*currentScene.getLayout().to_widget(*touch.pos, relative = False))
+				self.__selectionBoxTouchId = touch.uid
 
 		self.__defaultTouchDown(touch)
 
@@ -441,7 +600,8 @@ class SceneHandler (SpecialScrollControl):
 
 		super(SceneHandler, self).__init__(size_hint = (maxWidthProportion, maxHeightProportion))
 
-		self._scrollView.on_touch_move = self._ignoreMoves
+		self._scrollView.on_touch_move = self.__handleSelectionBoxMove
+		self.__selectionBoxTouchId = None
 		self.__defaultTouchDown = self._scrollView.on_touch_down
 		self.__defaultTouchUp = self._scrollView.on_touch_up
 
@@ -0,0 +1,77 @@
+class TrigramIndex:
+	# Case insensitive substring search over short texts, one per key. Every three letter sequence of a text points
+	# to its key, so a query only looks at the keys holding all of its trigrams before checking them for real.
+
+	def __init__(self):
+		self.__texts = {}
+		self.__postings = {}
+
+	@staticmethod
+	def __getTrigrams(text):
+		return set([text[i:i + 3] for i in range(len(text) - 2)])
+
+	def __findTerm(self, term, candidates):
+		if (len(term) < 3):
+			# Too short to have a trigram, the texts are checked one by one.
+			if (candidates is None):
+				candidates = self.__texts.keys()
+			return set([key for key in candidates if term in self.__texts[key]])
+
+		postings = []
+		for trigram in self.__getTrigrams(term):
+			if (trigram not in self.__postings):
+				return set()
+			postings.append(self.__postings[trigram])
+
+		postings.sort(key = len)
+		found = set(postings[0])
+		if (candidates is not None):
+			found &= candidates
+		for keys in postings[1:]:
+			found &= keys
+			if (len(found) == 0):
+				return found
+
+		# The trigrams being there does not mean they follow each other.
+		return set([key for key in found if term in self.__texts[key]])
+
+	def add(self, key, text):
+		if (key in self.__texts):
+			self.remove(key)
+
+		text = text.lower()
+		self.__texts[key] = text
+		postings = self.__postings
+		for trigram in self.__getTrigrams(text):
+			keys = postings.get(trigram)
+			if (keys is None):
+				postings[trigram] = set([key])
+			else:
+				keys.add(key)
+
+	def remove(self, key):
+		if (key not in self.__texts):
+			return
+
+		for trigram in self.__getTrigrams(self.__texts.pop(key)):
+			keys = self.__postings[trigram]
+			keys.discard(key)
+			if (len(keys) == 0):
+				del self.__postings[trigram]
+
+	def clear(self):
+		self.__texts = {}
+		self.__postings = {}
+
+	# Keys whose text holds every word of query, or None when query has no word, meaning nothing is filtered.
+	def search(self, query):
+		found = None
+		for term in query.lower().split():
+			found = self.__findTerm(term, found)
+			if (len(found) == 0):
+				break
+
+		return found
+
+	def getNumberOfKeys(self):
+		return len(self.__texts)
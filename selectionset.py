@@ -0,0 +1,51 @@
+from collections import OrderedDict
+
+class SelectionSet:
+	# Objects in the order they were selected, with constant time membership. The list handed out is rebuilt only
+	# after a change, so asking for it repeatedly costs nothing.
+
+	def __init__(self, objects = []):
+		self.__objects = OrderedDict()
+		self.__list = None
+		for obj in objects:
+			self.__objects[obj] = True
+
+	def __len__(self):
+		return len(self.__objects)
+
+	def __iter__(self):
+		return iter(self.getList())
+
+	def __contains__(self, obj):
+		return obj in self.__objects
+
+	# Returns True when obj was not selected yet.
+	def add(self, obj):
+		if (obj in self.__objects):
+			return False
+
+		self.__objects[obj] = True
+		self.__list = None
+		return True
+
+	# Returns True when obj was selected.
+	def discard(self, obj):
+		if (obj not in self.__objects):
+			return False
+
+		del self.__objects[obj]
+		self.__list = None
+		return True
+
+	def clear(self):
+		self.__objects = OrderedDict()
+		self.__list = None
+
+	def getFirst(self):
+		return self.getList()[0]
+
+	# Selected objects in selection order, not to be modified.
+	def getList(self):
+		if (self.__list is None):
+			self.__list = list(self.__objects)
+		return self.__list
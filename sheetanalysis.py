@@ -0,0 +1,205 @@
+from numpy import zeros, ones, arange, repeat, cumsum, flatnonzero, searchsorted, argsort, lexsort, maximum, \
+	minimum, column_stack, concatenate, bincount, array, empty, roll, int8, int32
+from numpy.fft import rfft, irfft
+
+try:
+	from scipy.ndimage import label as labelComponents, find_objects
+except ImportError:
+	labelComponents = None
+
+# Images are arrays following the imagebuffer convention, the first row being the bottom one, so every box returned
+# here is (x, y, width, height) in kivy coordinates.
+
+def createForegroundMask(imageArray, backgroundColor = None, alphaThreshold = 0):
+	mask = imageArray[..., 3] > alphaThreshold
+	if (backgroundColor is not None):
+		mask &= (imageArray[..., :3] != array(backgroundColor[:3], dtype = imageArray.dtype)).any(axis = -1)
+	return mask
+
+def detectBackgroundColor(imageArray):
+	# Sheets with transparency are split on their alpha channel, opaque ones are keyed on their top left pixel.
+	if (imageArray.size == 0 or imageArray[..., 3].min() != 0xFF):
+		return None
+	return imageArray[-1, 0].tolist()
+
+def _findRuns(mask):
+	# Horizontal runs of foreground pixels, ordered by row and then by column. The extra column keeps runs from
+	# crossing rows on the flattened mask.
+	height, width = mask.shape
+	pitch = width + 1
+	padded = zeros((height, pitch), dtype = int8)
+	padded[:, :width] = mask
+	flat = padded.ravel()
+	changes = flatnonzero(flat[1:] != flat[:-1]) + 1
+	if (flat.size != 0 and flat[0] != 0):
+		changes = concatenate(([0], changes))
+
+	starts = changes[0::2]
+	ends = changes[1::2]
+	rows = starts // pitch
+	return rows, starts, ends, pitch
+
+def _labelRuns(rows, starts, ends, pitch):
+	# Runs on consecutive rows touching each other, diagonals included, are joined. Runs on a row are sorted and do
+	# not overlap, so the runs below a given one form a range found by binary search on the flat positions.
+	numberOfRuns = len(starts)
+	lowest = searchsorted(ends, starts + pitch, 'left')
+	highest = searchsorted(starts, ends + pitch, 'right')
+	counts = maximum(highest - lowest, 0)
+	runA = repeat(arange(numberOfRuns), counts)
+	runB = arange(counts.sum()) - repeat(cumsum(counts) - counts - lowest, counts)
+
+	# Union find run over every edge at once: each pass hooks the larger root of an edge under the smaller one, then
+	# paths are compressed until every run points to its root.
+	parent = arange(numberOfRuns)
+	while True:
+		rootA = parent[runA]
+		rootB = parent[runB]
+		pending = rootA != rootB
+		if (pending.any() == False):
+			break
+
+		runA = runA[pending]
+		runB = runB[pending]
+		higherRoots = maximum(rootA[pending], rootB[pending])
+		lowerRoots = minimum(rootA[pending], rootB[pending])
+		# With repeated targets the last assignment wins, sorting makes it the smallest root.
+		order = argsort(lowerRoots)[::-1]
+		parent[higherRoots[order]] = lowerRoots[order]
+		while True:
+			grandParent = parent[parent]
+			if ((grandParent == parent).all() == True):
+				break
+			parent = grandParent
+
+	return parent
+
+def _findComponentsByRuns(mask):
+	rows, starts, ends, pitch = _findRuns(mask)
+	if (len(rows) == 0):
+		return empty((0, 4), dtype = int32), empty(0, dtype = int32)
+
+	labels = _labelRuns(rows, starts, ends, pitch)
+	columnStarts = starts - rows * pitch
+	columnEnds = ends - rows * pitch
+
+	order = argsort(labels, kind = 'mergesort')
+	sortedLabels = labels[order]
+	groups = flatnonzero(concatenate(([True], sortedLabels[1:] != sortedLabels[:-1])))
+	left = minimum.reduceat(columnStarts[order], groups)
+	right = maximum.reduceat(columnEnds[order], groups)
+	bottom = minimum.reduceat(rows[order], groups)
+	top = maximum.reduceat(rows[order], groups) + 1
+	pixels = (columnEnds - columnStarts)[order]
+	pixelCounts = concatenate(([0], cumsum(pixels)))[concatenate((groups, [len(pixels)]))]
+	pixelCounts = pixelCounts[1:] - pixelCounts[:-1]
+
+	return column_stack((left, bottom, right - left, top - bottom)).astype(int32), pixelCounts
+
+def _findComponentsByScipy(mask):
+	labels, numberOfComponents = labelComponents(mask, structure = ones((3, 3), dtype = int32))
+	boxes = empty((numberOfComponents, 4), dtype = int32)
+	i = 0
+	for rowSlice, columnSlice in find_objects(labels):
+		boxes[i] = (columnSlice.start, rowSlice.start, columnSlice.stop - columnSlice.start,
+			rowSlice.stop - rowSlice.start)
+		i += 1
+
+	return boxes, bincount(labels.ravel(), minlength = numberOfComponents + 1)[1:]
+
+def findSpriteBounds(imageArray, backgroundColor = None, alphaThreshold = 0, minimumPixels = 1):
+	# Tight bounding boxes of the 8-connected groups of foreground pixels, listed from the top of the sheet down and
+	# from left to right.
+	mask = createForegroundMask(imageArray, backgroundColor, alphaThreshold)
+	if (labelComponents is not None):
+		boxes, pixelCounts = _findComponentsByScipy(mask)
+	else:
+		boxes, pixelCounts = _findComponentsByRuns(mask)
+
+	boxes = boxes[pixelCounts >= minimumPixels]
+	order = lexsort((boxes[:, 0], -(boxes[:, 1] + boxes[:, 3])))
+	return boxes[order]
+
+def _findPeriod(profile):
+	# Autocorrelation of the foreground profile, the pitch being the first lag correlating nearly as well as the best
+	# one.
+	length = len(profile)
+	signal = profile.astype(float)
+	signal -= signal.mean()
+	if (length < 4 or signal.any() == False):
+		return None
+
+	spectrum = rfft(signal, 2 * length)
+	correlation = irfft(spectrum * spectrum.conjugate(), 2 * length)[:length // 2 + 2]
+	# Longer lags overlap less of the profile, dividing by the overlap keeps every repetition on the same scale.
+	correlation /= (length - arange(len(correlation)))
+	# Wide features such as the margins keep correlating over short lags, peaks are only searched once the
+	# correlation has dropped below zero.
+	belowZero = flatnonzero(correlation[1:length // 2 + 1] <= 0)
+	if (len(belowZero) == 0):
+		return None
+
+	firstLag = max(2, belowZero[0] + 1)
+	best = correlation[firstLag:length // 2 + 1].max()
+	if (best <= 0):
+		return None
+
+	for lag in range(firstLag, length // 2 + 1):
+		if (correlation[lag] >= 0.9 * best and correlation[lag] >= correlation[lag - 1] and
+				correlation[lag] >= correlation[lag + 1]):
+			return lag
+
+	return None
+
+def _areEmptyLines(imageArray, first, pitch, backgroundColor, alphaThreshold):
+	return createForegroundMask(imageArray[:, first::pitch], backgroundColor, alphaThreshold).any() == False
+
+def _detectAxisPitch(imageArray, backgroundColor, alphaThreshold, samples):
+	# Works along the second axis of imageArray, the profile being sampled on a subset of the lines of the first one.
+	length = imageArray.shape[1]
+	step = max(1, imageArray.shape[0] // samples)
+	foregroundCount = createForegroundMask(imageArray[::step], backgroundColor, alphaThreshold).sum(axis = 0)
+	occupancy = foregroundCount != 0
+	pitch = _findPeriod(occupancy)
+	if (pitch is None):
+		# Without gutters the number of foreground pixels per line is the only signal left.
+		pitch = _findPeriod(foregroundCount)
+		if (pitch is None):
+			return None
+
+	phases = arange(length) % pitch
+	alwaysEmpty = bincount(phases, weights = ~occupancy, minlength = pitch) == bincount(phases, minlength = pitch)
+	if (alwaysEmpty.any() == False):
+		# Tiles touching each other leave no gutter, only the pitch is known.
+		return (pitch, 0, 0)
+
+	# The longest run of phases empty on every tile is the spacing, tiles start right after it. The profile is
+	# rotated to begin on an occupied phase so that no run wraps around.
+	firstOccupied = flatnonzero(~alwaysEmpty)[0]
+	rotated = concatenate(([0], roll(alwaysEmpty, -firstOccupied).astype(int8), [0]))
+	changes = flatnonzero(rotated[1:] != rotated[:-1])
+	runStarts = changes[0::2]
+	runEnds = changes[1::2]
+	longest = (runEnds - runStarts).argmax()
+	runStart = runStarts[longest]
+	runEnd = runEnds[longest]
+
+	# Lines were only sampled, the border chosen is checked on the whole image and moved back inside the gutter
+	# while a sprite crosses it.
+	offset = (runEnd + firstOccupied) % pitch
+	for end in range(runEnd, runStart, -1):
+		lastEmpty = (end - 1 + firstOccupied) % pitch
+		if (_areEmptyLines(imageArray, lastEmpty, pitch, backgroundColor, alphaThreshold) == True):
+			offset = (end + firstOccupied) % pitch
+			break
+
+	return (int(pitch), int(offset), int(runEnd - runStart))
+
+def detectGridPitch(imageArray, backgroundColor = None, alphaThreshold = 0, samples = 256):
+	# Returns a (pitch, offset, spacing) tuple for x and another for y, or None when no repetition is found on that
+	# axis. Offsets are where the first tile starts, from the left and from the bottom of the image, and the pitch is
+	# the tile size plus the spacing.
+	return (
+		_detectAxisPitch(imageArray, backgroundColor, alphaThreshold, samples),
+		_detectAxisPitch(imageArray.swapaxes(0, 1), backgroundColor, alphaThreshold, samples)
+	)
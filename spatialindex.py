@@ -0,0 +1,173 @@
+from math import sqrt
+
+class SpatialGrid:
+	# Uniform grid over the plane, every item being listed in each cell its bounds touch. Queries only look at the
+	# cells around them, so their cost follows the number of items found instead of the number of items held.
+
+	def __init__(self, cellSize):
+		assert cellSize > 0
+		self.__cellSize = float(cellSize)
+		self.clear()
+
+	def __getCellRange(self, x0, y0, x1, y1):
+		cellSize = self.__cellSize
+		return (int(x0 // cellSize), int(y0 // cellSize), int(x1 // cellSize), int(y1 // cellSize))
+
+	def __addToCells(self, item, cellRange):
+		cx0, cy0, cx1, cy1 = cellRange
+		for cx in range(cx0, cx1 + 1):
+			for cy in range(cy0, cy1 + 1):
+				cell = self.__cells.get((cx, cy))
+				if (cell is None):
+					self.__cells[(cx, cy)] = set([item])
+				else:
+					cell.add(item)
+
+		if (self.__extent is None):
+			self.__extent = list(cellRange)
+		else:
+			self.__extent = [min(self.__extent[0], cx0), min(self.__extent[1], cy0), max(self.__extent[2], cx1),
+				max(self.__extent[3], cy1)]
+
+	def __removeFromCells(self, item, cellRange):
+		cx0, cy0, cx1, cy1 = cellRange
+		for cx in range(cx0, cx1 + 1):
+			for cy in range(cy0, cy1 + 1):
+				cell = self.__cells[(cx, cy)]
+				cell.discard(item)
+				if (len(cell) == 0):
+					del self.__cells[(cx, cy)]
+
+	@staticmethod
+	def __getDistance(bounds, x, y):
+		x0, y0, x1, y1 = bounds
+		dx = max(x0 - x, 0, x - x1)
+		dy = max(y0 - y, 0, y - y1)
+		return sqrt(dx * dx + dy * dy)
+
+	# Adds item or moves it to its new bounds, (x, y) being its bottom left corner.
+	def update(self, item, x, y, width, height):
+		bounds = (x, y, x + width, y + height)
+		cellRange = self.__getCellRange(*bounds)
+		previousRange = self.__cellRanges.get(item)
+		if (previousRange != cellRange):
+			if (previousRange is not None):
+				self.__removeFromCells(item, previousRange)
+			self.__addToCells(item, cellRange)
+			self.__cellRanges[item] = cellRange
+
+		self.__bounds[item] = bounds
+
+	def remove(self, item):
+		if (item in self.__cellRanges):
+			self.__removeFromCells(item, self.__cellRanges.pop(item))
+			del self.__bounds[item]
+
+	def clear(self):
+		self.__cells = {}
+		self.__bounds = {}
+		self.__cellRanges = {}
+		# Smallest cell range holding every cell ever used, bounding the search of nearest.
+		self.__extent = None
+
+	def contains(self, item):
+		return item in self.__bounds
+
+	def getBounds(self, item):
+		return self.__bounds.get(item)
+
+	def getNumberOfItems(self):
+		return len(self.__bounds)
+
+	# Items whose bounds hold the point, borders included.
+	def queryPoint(self, x, y):
+		cellSize = self.__cellSize
+		cell = self.__cells.get((int(x // cellSize), int(y // cellSize)))
+		if (cell is None):
+			return []
+
+		found = []
+		for item in cell:
+			x0, y0, x1, y1 = self.__bounds[item]
+			if (x0 <= x <= x1 and y0 <= y <= y1):
+				found.append(item)
+
+		return found
+
+	# Items whose bounds intersect the rectangle whose bottom left corner is (x, y).
+	def queryRect(self, x, y, width, height):
+		qx0, qy0, qx1, qy1 = (min(x, x + width), min(y, y + height), max(x, x + width), max(y, y + height))
+		cx0, cy0, cx1, cy1 = self.__getCellRange(qx0, qy0, qx1, qy1)
+		found = set()
+		if (self.__extent is None):
+			return found
+
+		# Cells outside of the extent are empty, they are not even looked up.
+		cx0 = max(cx0, self.__extent[0])
+		cy0 = max(cy0, self.__extent[1])
+		cx1 = min(cx1, self.__extent[2])
+		cy1 = min(cy1, self.__extent[3])
+		for cx in range(cx0, cx1 + 1):
+			for cy in range(cy0, cy1 + 1):
+				cell = self.__cells.get((cx, cy))
+				if (cell is None):
+					continue
+				for item in cell:
+					if (item not in found):
+						x0, y0, x1, y1 = self.__bounds[item]
+						if (x0 <= qx1 and qx0 <= x1 and y0 <= qy1 and qy0 <= y1):
+							found.add(item)
+
+		return found
+
+	# Item whose bounds are the closest to the point, 0 meaning inside, for which acceptMethod(item) is True when
+	# given. Returns None when nothing is found within maxDistance.
+	def nearest(self, x, y, maxDistance = None, acceptMethod = None):
+		if (self.__extent is None):
+			return None
+
+		cellSize = self.__cellSize
+		px = int(x // cellSize)
+		py = int(y // cellSize)
+		ex0, ey0, ex1, ey1 = self.__extent
+		lastRing = max(px - ex0, py - ey0, ex1 - px, ey1 - py, 0)
+
+		best = None
+		bestDistance = None
+		seen = set()
+		ring = 0
+		while (ring <= lastRing):
+			# Anything in a further ring is at least this far from the point.
+			if (bestDistance is not None and bestDistance <= (ring - 1) * cellSize):
+				break
+			if (maxDistance is not None and (ring - 1) * cellSize > maxDistance):
+				break
+
+			for cx in range(px - ring, px + ring + 1):
+				if (cx < ex0 or cx > ex1):
+					continue
+				if (cx == px - ring or cx == px + ring):
+					rows = range(py - ring, py + ring + 1)
+				else:
+					rows = [py - ring, py + ring]
+				for cy in rows:
+					cell = self.__cells.get((cx, cy))
+					if (cell is None):
+						continue
+					for item in cell:
+						if (item in seen):
+							continue
+						seen.add(item)
+						if (acceptMethod is not None and acceptMethod(item) == False):
+							continue
+						distance = self.__getDistance(self.__bounds[item], x, y)
+						if (bestDistance is None or distance < bestDistance):
+							best = item
+							bestDistance = distance
+
+			ring += 1
+
+		if (maxDistance is not None and bestDistance is not None and bestDistance > maxDistance):
+			return None
+
+		return best
@@ -0,0 +1,285 @@
+from numpy import arange, repeat, tile, empty, full, column_stack, abs as npAbs, uint8, uint32, int16, int32
+
+from hashlib import sha1
+from os import remove, rename
+from os.path import exists
+
+from imagebuffer import saveImageArray
+from atlaspacker import packRects
+from splittedimagemap import SplittedImageMap
+
+class ExportCancelled(Exception):
+	pass
+
+class ExportProgress:
+	# Maps the progress of each export stage to its share of the whole export, and stops the export by raising
+	# ExportCancelled as soon as the cancel event is set.
+	def __init__(self, progressMethod = None, cancelEvent = None):
+		self.__progressMethod = progressMethod
+		self.__cancelEvent = cancelEvent
+		self.__stageStart = 0.0
+		self.__stageEnd = 0.0
+
+	def setStage(self, start, end):
+		self.__stageStart = start
+		self.__stageEnd = end
+		self.update(0, 1)
+
+	def update(self, done, total):
+		if (self.__cancelEvent is not None and self.__cancelEvent.is_set() == True):
+			raise ExportCancelled('Export cancelled.')
+
+		if (self.__progressMethod is not None and total > 0):
+			self.__progressMethod(self.__stageStart + (self.__stageEnd - self.__stageStart) * float(done) / total)
+
+class SplitGrid:
+	def __init__(self, width, height, startX, startY, columns, rows, rects, uniformMask, transparentMask):
+		self.__width = width
+		self.__height = height
+		self.__startX = startX
+		self.__startY = startY
+		self.__columns = columns
+		self.__rows = rows
+		self.__rects = rects
+		self.__uniformMask = uniformMask
+		self.__transparentMask = transparentMask
+
+	def getTileSize(self):
+		return (self.__width, self.__height)
+
+	def getStart(self):
+		return (self.__startX, self.__startY)
+
+	def getColumns(self):
+		return self.__columns
+
+	def getRows(self):
+		return self.__rows
+
+	def getNumberOfTiles(self):
+		return self.__columns * self.__rows
+
+	# Tiles are ordered from the top row to the bottom one, left to right, each rect being (x, y, width, height)
+	# in kivy coordinates.
+	def getRects(self):
+		return self.__rects
+
+	def getUniformMask(self):
+		return self.__uniformMask
+
+	def getTransparentMask(self):
+		return self.__transparentMask
+
+	def getValidMask(self):
+		return ~self.__uniformMask
+
+	def getValidRects(self):
+		return self.__rects[~self.__uniformMask]
+
+def splitImageArray(imageArray, width, height, startX = 0, startY = 0):
+	assert width > 0 and height > 0, 'Tile size must be positive.'
+	assert startX >= 0 and startY >= 0, 'Start position must not be negative.'
+
+	imageHeight, imageWidth = imageArray.shape[:2]
+	columns = max(0, (imageWidth - startX) // width)
+	rows = max(0, (imageHeight - startY) // height)
+
+	endX = startX + columns * width
+	endY = startY + rows * height
+	if (columns == 0 or rows == 0):
+		uniformMask = empty(0, dtype = bool)
+		transparentMask = empty(0, dtype = bool)
+	else:
+		# One uint32 per pixel lets a whole tile be compared against its first pixel in a single pass.
+		packed = imageArray.view(uint32).reshape(imageHeight, imageWidth)
+		tiles = packed[startY:endY, startX:endX].reshape(rows, height, columns, width)
+		uniformMask = (tiles == tiles[:, :1, :, :1]).all(axis = (1, 3))
+
+		alpha = imageArray[startY:endY, startX:endX, 3].reshape(rows, height, columns, width)
+		transparentMask = (alpha.max(axis = (1, 3)) == 0)
+
+		# Array rows grow upwards, tiles are listed from the top.
+		uniformMask = uniformMask[::-1].ravel()
+		transparentMask = transparentMask[::-1].ravel()
+
+	xs = startX + arange(columns, dtype = int32) * width
+	ys = startY + arange(rows - 1, -1, -1, dtype = int32) * height
+	numberOfTiles = rows * columns
+	rects = column_stack((
+		tile(xs, rows),
+		repeat(ys, columns),
+		repeat(int32(width), numberOfTiles),
+		repeat(int32(height), numberOfTiles),
+	)).reshape(numberOfTiles, 4)
+
+	return SplitGrid(width, height, startX, startY, columns, rows, rects, uniformMask, transparentMask)
+
+def splitImageArrayRelative(imageArray, partitionOnX, partitionOnY):
+	assert partitionOnX > 0 and partitionOnY > 0, 'Number of partitions must be positive.'
+	imageHeight, imageWidth = imageArray.shape[:2]
+	width = imageWidth // partitionOnX
+	height = imageHeight // partitionOnY
+	return splitImageArray(imageArray, width, height, 0, 0)
+
+def colorToRgb(color):
+	# Colors may come either as ints or as the raw characters read from a pixel buffer.
+	rgb = []
+	for c in color[:3]:
+		if (isinstance(c, str)):
+			rgb.append(ord(c))
+		else:
+			rgb.append(int(c))
+	return rgb
+
+def gridLayout(rects, divs):
+	assert len(rects) <= divs[0] * divs[1], 'Not enough divisions to hold every tile.'
+
+	cellWidth = 0
+	cellHeight = 0
+	for rect in rects:
+		cellWidth = max(cellWidth, rect[2])
+		cellHeight = max(cellHeight, rect[3])
+
+	atlasSize = (cellWidth * divs[0], cellHeight * divs[1])
+	placements = []
+	k = 0
+	for x, y, w, h in rects:
+		# Cells are filled from the top left corner, tiles sticking to the top of their cell.
+		destX = (k % divs[0]) * cellWidth
+		destY = atlasSize[1] - ((k // divs[0]) * cellHeight) - h
+		placements.append((destX, destY, w, h))
+		k += 1
+
+	return atlasSize, placements
+
+def packedLayout(rects, maxSize = 4096, powerOfTwo = True, padding = 0):
+	sizes = []
+	for rect in rects:
+		sizes.append((rect[2], rect[3]))
+
+	atlasSize, positions = packRects(sizes, maxSize, powerOfTwo, padding)
+	placements = []
+	for (x, y), (w, h) in zip(positions, sizes):
+		placements.append((x, y, w, h))
+
+	return atlasSize, placements
+
+def composeAtlas(imageArray, rects, placements, atlasSize, colorToAlpha = None, progressMethod = None):
+	atlas = full((atlasSize[1], atlasSize[0], 4), 0xFF, dtype = uint8)
+	numberOfTiles = len(rects)
+	k = 0
+	for (x, y, w, h), (destX, destY, destW, destH) in zip(rects, placements):
+		atlas[destY:destY + h, destX:destX + w] = imageArray[y:y + h, x:x + w]
+		k += 1
+		if (progressMethod is not None and (k % 64 == 0 or k == numberOfTiles)):
+			progressMethod(k, numberOfTiles)
+
+	if (colorToAlpha is not None):
+		mask = (atlas[..., :3] == colorToRgb(colorToAlpha)).all(axis = -1)
+		atlas[..., 3][mask] = 0
+
+	return atlas
+
+def findDuplicateTiles(imageArray, rects, tolerance = 0):
+	# Returns the indices of the tiles to keep and, for every tile in rects, the position of its representative in
+	# the kept list. A tile only matches tiles of the same size.
+	sizeGroups = {}
+	i = 0
+	for x, y, w, h in rects:
+		key = (w, h)
+		if (key not in sizeGroups):
+			sizeGroups[key] = []
+		sizeGroups[key].append(i)
+		i += 1
+
+	representativeOf = [None] * len(rects)
+	for (w, h), indices in sizeGroups.items():
+		if (tolerance == 0):
+			digestToRepresentative = {}
+			for index in indices:
+				x, y = rects[index][:2]
+				digest = sha1(imageArray[y:y + h, x:x + w].tobytes()).digest()
+				if (digest not in digestToRepresentative):
+					digestToRepresentative[digest] = index
+				representativeOf[index] = digestToRepresentative[digest]
+		else:
+			stack = empty((len(indices), h * w * 4), dtype = int16)
+			j = 0
+			for index in indices:
+				x, y = rects[index][:2]
+				stack[j] = imageArray[y:y + h, x:x + w].ravel()
+				j += 1
+
+			# Greedy grouping, every pass compares one representative against all the tiles still unassigned.
+			remaining = arange(len(indices))
+			while len(remaining) != 0:
+				first = remaining[0]
+				maxDiff = npAbs(stack[remaining] - stack[first]).max(axis = 1)
+				matches = remaining[maxDiff <= tolerance]
+				for j in matches.tolist():
+					representativeOf[indices[j]] = indices[first]
+				remaining = remaining[maxDiff > tolerance]
+
+	keptIndices = []
+	keptPosition = {}
+	remapTable = []
+	for index in range(len(rects)):
+		representative = representativeOf[index]
+		if (representative not in keptPosition):
+			keptPosition[representative] = len(keptIndices)
+			keptIndices.append(representative)
+		remapTable.append(keptPosition[representative])
+
+	return keptIndices, remapTable
+
+def _removeIfExists(path):
+	if (exists(path) == True):
+		remove(path)
+
+def _replaceFile(source, destination):
+	# rename does not overwrite an existing file on Windows.
+	_removeIfExists(destination)
+	rename(source, destination)
+
+def exportAtlas(imageArray, rects, filename, colorToAlpha = None, divs = None, dedupe = False, tolerance = 0,
+		maxSize = 4096, powerOfTwo = True, progressMethod = None, cancelEvent = None):
+	progress = ExportProgress(progressMethod, cancelEvent)
+	progress.setStage(0.0, 0.1)
+	remapTable = None
+	if (dedupe == True):
+		keptIndices, remapTable = findDuplicateTiles(imageArray, rects, tolerance)
+		keptRects = []
+		for index in keptIndices:
+			keptRects.append(rects[index])
+		rects = keptRects
+
+	# Explicit divisions keep the classic grid, otherwise tiles are bin packed into the smallest atlas found.
+	progress.setStage(0.1, 0.2)
+	if (divs is None or len(divs) != 2):
+		divs = None
+		atlasSize, placements = packedLayout(rects, maxSize, powerOfTwo)
+	else:
+		atlasSize, placements = gridLayout(rects, divs)
+
+	progress.setStage(0.2, 0.5)
+	atlas = composeAtlas(imageArray, rects, placements, atlasSize, colorToAlpha, progress.update)
+
+	# Both files are written aside and only renamed once complete, so a cancelled or failed export leaves no half
+	# written atlas behind.
+	temporaryPng = filename + '.png.tmp'
+	temporaryOpf = filename + '.opf.tmp'
+	try:
+		progress.setStage(0.5, 0.95)
+		saveImageArray(temporaryPng, atlas, progress.update)
+		progress.setStage(0.95, 1.0)
+		exporter = SplittedImageMap(filename + '.png', len(rects), divs, atlasSize, placements, remapTable)
+		exporter.exportToOpf(temporaryOpf)
+		progress.update(0, 1)
+		_replaceFile(temporaryPng, filename + '.png')
+		_replaceFile(temporaryOpf, filename + '.opf')
+	finally:
+		_removeIfExists(temporaryPng)
+		_removeIfExists(temporaryOpf)
+
+	progress.update(1, 1)
+	return len(rects)
@@ -1,9 +1,21 @@
-from editorutils import strToDoubleIntTuple, boolToStr, strToBool
+from conversionutils import strToDoubleIntTuple, boolToStr, strToBool
+from singleton import Singleton
 
 from ConfigParser import ConfigParser
-from os.path import isfile
+from StringIO import StringIO
+from collections import OrderedDict
+from json import dumps, loads
+from os import stat
+from os.path import isfile, abspath
+
+# Version 1 is the ini file with one section per selection. Version 2 is made of json lines: a header object, one
+# [x, y, width, height] list per selection and an optional {"remap": [...]} object.
+OPF_VERSION = 2
+
+class SpriteSelection(object):
+	# Sheets may hold tens of thousands of selections, slots keep each one down to its fields.
+	__slots__ = ('__x', '__y', '__xSize', '__ySize', '__xParts', '__yParts')
 
-class SpriteSelection:
 	def __init__(self, x, y, xSize, ySize, xParts = 1, yParts = 1):
 		self.__x = x
 		self.__y = y
@@ -13,11 +25,10 @@ class SpriteSelection:
 		self.__yParts = yParts
 
 	def compare(self, otherSelection):
-		if (self.__x == otherSelection.getX() and self.__xSize == otherSelection.getSizeX() and
-				self.__y == otherSelection.getY() and self.__ySize == otherSelection.getSizeY()):
-			return True
-		else:
-			return False
+		return self.getKey() == otherSelection.getKey()
+
+	def getKey(self):
+		return (self.__x, self.__y, self.__xSize, self.__ySize)
 
 	def getX(self):
 		return self.__x
@@ -41,22 +52,48 @@ class ResourceInformation:
 
 	def __init__(self, path, keepOriginal = True):
 		self.__path = path
-		self.__selectionDict = {}
+		# Selections are kept in insertion order, which is the order of the atlas tiles, and indexed by their
+		# rect so duplicates are found without looking at every selection.
+		self.__selectionDict = OrderedDict()
+		self.__keyToId = {}
 		self.__selectionId = 0
 		self.__keepOriginal = keepOriginal
+		self.__remapTable = None
 
 	def setKeekOriginal(self, value):
 		assert(type(value) is bool)
 		self.__keepOriginal = value
 
 	def addSelection(self, selection):
-		self.__selectionDict[self.__selectionId] = selection
+		identifier = self.__selectionId
+		self.__selectionDict[identifier] = selection
+		key = selection.getKey()
+		if (key not in self.__keyToId):
+			self.__keyToId[key] = identifier
 		self.__selectionId += 1
-		return self.__selectionId - 1
+		return identifier
+
+	# Adds every selection not stored yet, duplicates inside the list included, and returns the (identifier,
+	# selection) pairs added.
+	def addSelectionList(self, selectionList):
+		added = []
+		for selection in selectionList:
+			if (selection.getKey() not in self.__keyToId):
+				added.append((self.addSelection(selection), selection))
+
+		return added
 
 	def removeSelectionById(self, identifier):
 		if (identifier in self.__selectionDict):
-			del self.__selectionDict[identifier]
+			key = self.__selectionDict.pop(identifier).getKey()
+			if (self.__keyToId.get(key) == identifier):
+				del self.__keyToId[key]
+			# Entries of the remap table point to selection positions that have just changed.
+			self.__remapTable = None
+
+	def removeSelectionList(self, identifiers):
+		for identifier in identifiers:
+			self.removeSelectionById(identifier)
 
 	def getSelectionById(self, identifier):
 		if (identifier in self.__selectionDict):
@@ -68,14 +105,12 @@ class ResourceInformation:
 		return len(self.__selectionDict)
 
 	def clear(self):
-		self.__selectionDict = {}
+		self.__selectionDict = OrderedDict()
+		self.__keyToId = {}
+		self.__remapTable = None
 
 	def hasSame(self, otherSelection):
-		for savedSelection in self.__selectionDict.values():
-			if (savedSelection.compare(otherSelection) == True):
-				return True
-
-		return False
+		return otherSelection.getKey() in self.__keyToId
 
 	def getPath(self):
 		return self.__path
@@ -89,10 +124,44 @@ class ResourceInformation:
 	def getKeepOriginal(self):
 		return self.__keepOriginal
 
+	# Maps every tile of the split sheet to the position of the selection it was merged into.
+	def setRemapTable(self, remapTable):
+		self.__remapTable = remapTable
+
+	def getRemapTable(self):
+		return self.__remapTable
+
 class SplittedImageExporter:
 	@staticmethod
-	def save(resourceInfo):
-		filename = resourceInfo.getPath()[:-4] + '.opf'
+	def __saveJsonLines(resourceInfo, filename):
+		header = {
+			'version' : OPF_VERSION,
+			'path' : resourceInfo.getPath(),
+			'keepOriginal' : resourceInfo.getKeepOriginal(),
+			'amount' : resourceInfo.getNumberOfSelections(),
+		}
+		lines = [dumps(header, sort_keys = True)]
+		for selection in resourceInfo.getSelectionList():
+			lines.append('[%d, %d, %d, %d]' % selection.getKey())
+
+		remapTable = resourceInfo.getRemapTable()
+		if (remapTable is not None):
+			lines.append(dumps({ 'remap' : list(remapTable) }))
+
+		f = open(filename, 'w')
+		f.write('\n'.join(lines) + '\n')
+		f.close()
+
+	@staticmethod
+	def save(resourceInfo, filename = None, version = OPF_VERSION):
+		if (filename is None):
+			filename = resourceInfo.getPath()[:-4] + '.opf'
+
+		OpfParseCache.Instance().invalidate(filename)
+		if (version >= 2):
+			SplittedImageExporter.__saveJsonLines(resourceInfo, filename)
+			return filename
+
 		parser = ConfigParser()
 		parser.optionxform = str
 
@@ -109,13 +178,109 @@ class SplittedImageExporter:
 			parser.set(sectionName, 'Size', str((selection.getSizeX(), selection.getSizeY())))
 			i += 1
 
+		remapTable = resourceInfo.getRemapTable()
+		if (remapTable is not None):
+			parser.add_section('Remap')
+			parser.set('Remap', 'Amount', str(len(remapTable)))
+			parser.set('Remap', 'Table', '#'.join(map(str, remapTable)))
+
 		f = open(filename, 'w')
 		parser.write(f)
 		f.close()
 
 		return filename
 
+class OpfData:
+	# Parsed content of an .opf file, shared by every load of that file and never modified.
+	def __init__(self, path, keepOriginal, rects, remapTable):
+		self.__path = path
+		self.__keepOriginal = keepOriginal
+		self.__rects = rects
+		self.__remapTable = remapTable
+
+	def createResourceInformation(self):
+		resourceInfo = ResourceInformation(self.__path, self.__keepOriginal)
+		for x, y, width, height in self.__rects:
+			resourceInfo.addSelection(SpriteSelection(x, y, width, height))
+		if (self.__remapTable is not None):
+			resourceInfo.setRemapTable(list(self.__remapTable))
+
+		return resourceInfo
+
+@Singleton
+class OpfParseCache:
+	# Files are only parsed again once their modification time or size changed.
+	def __init__(self):
+		self.__entries = {}
+
+	def get(self, filename, parseMethod):
+		filename = abspath(filename)
+		fileInfo = stat(filename)
+		stamp = (fileInfo.st_mtime, fileInfo.st_size)
+		entry = self.__entries.get(filename)
+		if (entry is None or entry[0] != stamp):
+			entry = (stamp, parseMethod(filename))
+			self.__entries[filename] = entry
+
+		return entry[1]
+
+	def invalidate(self, filename):
+		filename = abspath(filename)
+		if (filename in self.__entries):
+			del self.__entries[filename]
+
+	def clear(self):
+		self.__entries = {}
+
 class SplittedImageImporter:
+	@staticmethod
+	def __parseJsonLines(content):
+		lines = content.splitlines()
+		header = loads(lines[0])
+		assert header['version'] <= OPF_VERSION, 'Opf version ' + str(header['version']) + ' is not supported.'
+		numberOfImages = header['amount']
+		# A single json document is far quicker to decode than one per line.
+		rects = tuple(tuple(rect) for rect in loads('[' + ','.join(lines[1:numberOfImages + 1]) + ']'))
+		assert len(rects) == numberOfImages
+
+		remapTable = None
+		for line in lines[numberOfImages + 1:]:
+			if (line.strip() != ''):
+				remapTable = tuple(loads(line)['remap'])
+
+		return OpfData(header['path'], header['keepOriginal'], rects, remapTable)
+
+	@staticmethod
+	def __parseIni(content):
+		parser = ConfigParser()
+		parser.readfp(StringIO(content))
+		numberOfImages = int(parser.get('General', 'Amount'))
+		keepOriginal = strToBool(parser.get('General', 'KeepOriginal'))
+		rects = []
+		for i in range(numberOfImages):
+			sectionName = 'SelectionInfo' + str(i)
+			x, y = strToDoubleIntTuple(parser.get(sectionName, 'Position'))
+			sizeX, sizeY = strToDoubleIntTuple(parser.get(sectionName, 'Size'))
+			rects.append((x, y, sizeX, sizeY))
+
+		remapTable = None
+		if (parser.has_section('Remap') == True):
+			remapTable = tuple(int(value) for value in parser.get('Remap', 'Table').split('#'))
+			assert len(remapTable) == int(parser.get('Remap', 'Amount'))
+
+		return OpfData(parser.get('General', 'Path'), keepOriginal, tuple(rects), remapTable)
+
+	@staticmethod
+	def parse(filename):
+		f = open(filename, 'r')
+		content = f.read()
+		f.close()
+
+		if (content.lstrip()[:1] == '{'):
+			return SplittedImageImporter.__parseJsonLines(content)
+		else:
+			return SplittedImageImporter.__parseIni(content)
+
 	@staticmethod
 	def load(path):
 		if (path[-4:] != '.opf'):
@@ -126,17 +291,42 @@ class SplittedImageImporter:
 			filename = path
 			assert(isfile(filename))
 
-		parser = ConfigParser()
-		parser.read(filename)
-		numberOfImages = int(parser.get('General', 'Amount'))
-		keepOriginal = strToBool(parser.get('General', 'KeepOriginal'))
-		resourceInfo = ResourceInformation(parser.get('General', 'Path'), keepOriginal)
-		for i in range(numberOfImages):
-			sectionName = 'SelectionInfo' + str(i)
-			x, y = strToDoubleIntTuple(parser.get(sectionName, 'Position'))
-			sizeX, sizeY = strToDoubleIntTuple(parser.get(sectionName, 'Size'))
-			selection = SpriteSelection(x, y, sizeX, sizeY)
-			resourceInfo.addSelection(selection)
+		opfData = OpfParseCache.Instance().get(filename, SplittedImageImporter.parse)
+		return opfData.createResourceInformation()
 
-		return resourceInfo
 
+class SplittedImageMap:
+	def __init__(self, path, numberOfImages, divs, size, placements = None, remapTable = None):
+		self.__path = path
+		self.__remapTable = remapTable
+		self.__numberOfImages = numberOfImages
+		self.__divs = divs
+		self.__size = size
+		if (placements is None):
+			assert divs is not None, 'Either divisions or placements must be given.'
+			self.__placements = self.__computeGridPlacements()
+		else:
+			assert len(placements) == numberOfImages, 'Every image must have its placement.'
+			self.__placements = placements
+
+	def __computeGridPlacements(self):
+		cellWidth = self.__size[0] / self.__divs[0]
+		cellHeight = self.__size[1] / self.__divs[1]
+		placements = []
+		for k in range(self.__numberOfImages):
+			x = (k % self.__divs[0]) * cellWidth
+			y = self.__size[1] - ((k / self.__divs[0]) + 1) * cellHeight
+			placements.append((x, y, cellWidth, cellHeight))
+
+		return placements
+
+	def getPlacements(self):
+		return self.__placements
+
+	def exportToOpf(self, filename):
+		resourceInfo = ResourceInformation(self.__path, False)
+		for x, y, width, height in self.__placements:
+			resourceInfo.addSelection(SpriteSelection(x, y, width, height))
+		resourceInfo.setRemapTable(self.__remapTable)
+
+		return SplittedImageExporter.save(resourceInfo, filename)
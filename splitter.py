@@ -9,19 +9,24 @@ from kivy.uix.label import Label
 from kivy.config import Config
 from kivy.uix.scrollview import ScrollView
 from kivy.uix.image import Image
-from kivy.core.image import Image as CoreImage
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.filechooser import FileChooserIconView
 from kivy.uix.popup import Popup
 from kivy.uix.checkbox import CheckBox
+from kivy.uix.progressbar import ProgressBar
 from kivy.core.window import Window
 from kivy.graphics.texture import Texture
 
 from os.path import  join, exists
 from os import getcwd, sep as pathSeparator
 
-from editorutils import Dialog, AlertPopUp, FileSelectionPopup, EmptyScrollEffect, CancelableButton
-from splittedimagemap import SplittedImageMap
+from editorutils import Dialog, AlertPopUp, FileSelectionPopup, EmptyScrollEffect, CancelableButton, BitArray
+from imagebuffer import loadImageArray
+from pixelcache import PixelCache
+from recycleview import RecycleGridView
+from splitengine import splitImageArray, splitImageArrayRelative
+from sheetanalysis import detectGridPitch, detectBackgroundColor
+from exportworker import AtlasExportWorker
 
 
 class LeftMenu:
@@ -32,7 +37,7 @@ class LeftMenu:
 			height = int(self.__heightInput.text)
 			startX = int(self.__initialXInput.text)
 			startY = int(self.__initialYInput.text)
-			assert (width > 0 and height > 0)
+			assert (width > 0 and height > 0 and startX >= 0 and startY >= 0)
 
 		except:
 			return
@@ -62,11 +67,31 @@ class LeftMenu:
 		self.__exportPopup.dismiss()
 		self.__dialog.dismiss()
 
-
 		if(self.__displayReference.saveSelectedImages(join(self.__exportFileChooser.path, self.__finalName),
-				colorToAlpha, self.__divs) == False):
+				self.__finishExport, self.__updateExportProgress, colorToAlpha, self.__divs, self.__dedupe,
+				self.__tolerance, self.__maxSize, self.__powerOfTwo) == False):
 			self.__alert.setText('Error creating the message')
 			self.__alert.open()
+			return
+
+		self.__exportProgressBar.value = 0
+		self.__exportProgressPopup.open()
+
+	def __updateExportProgress(self, value):
+		self.__exportProgressBar.value = value * self.__exportProgressBar.max
+
+	def __cancelRunningExport(self, *args):
+		self.__displayReference.cancelExport()
+
+	def __finishExport(self, worker):
+		self.__exportProgressPopup.dismiss()
+		# A cancelled export leaves the tiles and their selection as they were so it can be retried.
+		if (worker.isCancelled() == True):
+			return
+
+		if (worker.getError() is not None):
+			self.__alert.setText('Error exporting the tiles:\n' + worker.getError())
+			self.__alert.open()
 
 		self.__cancelExport()
 		self.__displayReference.clearImage()
@@ -75,6 +100,10 @@ class LeftMenu:
 
 		self.__finalName = ''
 		self.__divs = None
+		self.__dedupe = False
+		self.__tolerance = 0
+		self.__maxSize = 4096
+		self.__powerOfTwo = True
 
 		baseName = self.__exportBaseNameInput.text
 		if (baseName == ''):
@@ -96,7 +125,25 @@ class LeftMenu:
 				'Invalid custom division, either both\n'\
 				'or neither must be zero.\n'\
 				'If both are zero the program will\n'\
-				'automatically set their values.')
+				'automatically pack the tiles.')
+			self.__alert.open()
+			return
+
+		try:
+			tolerance = int (self.__exportTolerance.text)
+			assert (tolerance >= 0)
+
+		except:
+			self.__alert.setText('Invalid tolerance, it must\nbe zero or a positive number.')
+			self.__alert.open()
+			return
+
+		try:
+			maxSize = int (self.__exportMaxSize.text)
+			assert (maxSize > 0)
+
+		except:
+			self.__alert.setText('Invalid maximum atlas size.')
 			self.__alert.open()
 			return
 
@@ -115,6 +162,11 @@ class LeftMenu:
 		if (xdivs != 0 and ydivs != 0):
 			self.__divs = (xdivs, ydivs)
 
+		self.__dedupe = self.__exportDedupeCheckbox.active
+		self.__tolerance = tolerance
+		self.__maxSize = maxSize
+		self.__powerOfTwo = self.__exportPowerOfTwoCheckbox.active
+
 		if (baseName[-4:] in ['.png', '.opf']):
 			baseName = baseName[:-4]
 
@@ -167,7 +219,7 @@ class LeftMenu:
 		self.__hexColor[3] = value[3]
 
 		for c in value:
-			newColor.append(float(ord(c))/255.0)
+			newColor.append(float(c)/255.0)
 
 		self.__whiteImage.color = newColor
 
@@ -190,9 +242,21 @@ class LeftMenu:
 		else:
 			self.__exportBaseNameInput.text = entry[0]
 
+	def __prefillSplitInputs(self):
+		baseArray = self.__displayReference.getBaseArray()
+		xPitch, yPitch = detectGridPitch(baseArray, detectBackgroundColor(baseArray))
+		if (xPitch is not None):
+			self.__widthInput.text = str(xPitch[0])
+			self.__initialXInput.text = str(xPitch[1])
+
+		if (yPitch is not None):
+			self.__heightInput.text = str(yPitch[0])
+			self.__initialYInput.text = str(yPitch[1])
+
 	def __doOpenNewImage(self, *args):
 		src = join(self.__newImageChooser.getFileChooser().path, self.__newImageChooser.getTextInput().text)
 		self.__displayReference.setBaseImage(src)
+		self.__prefillSplitInputs()
 		self.__newImageDialog.dismiss()
 		self.__newImageChooser.dismiss()
 
@@ -257,6 +321,22 @@ class LeftMenu:
 		self.__exportRightPartBox.add_widget(Label(text = 'Y divisions: ', size_hint = (1.0, 0.1)))
 		self.__exportYdivisions = TextInput(multiline = False, text = '0', size_hint = (1.0, 0.1))
 		self.__exportRightPartBox.add_widget(self.__exportYdivisions)
+		exportDedupeBox = BoxLayout(orientation = 'horizontal', size_hint = (1.0, 0.1))
+		self.__exportDedupeCheckbox = CheckBox(active = False, size_hint = (0.3, 1.0))
+		exportDedupeBox.add_widget(self.__exportDedupeCheckbox)
+		exportDedupeBox.add_widget(Label(text = 'Merge duplicates', size_hint = (0.7, 1.0)))
+		self.__exportRightPartBox.add_widget(exportDedupeBox)
+		self.__exportRightPartBox.add_widget(Label(text = 'Tolerance: ', size_hint = (1.0, 0.1)))
+		self.__exportTolerance = TextInput(multiline = False, text = '0', size_hint = (1.0, 0.1))
+		self.__exportRightPartBox.add_widget(self.__exportTolerance)
+		self.__exportRightPartBox.add_widget(Label(text = 'Max atlas size: ', size_hint = (1.0, 0.1)))
+		self.__exportMaxSize = TextInput(multiline = False, text = '4096', size_hint = (1.0, 0.1))
+		self.__exportRightPartBox.add_widget(self.__exportMaxSize)
+		exportPowerOfTwoBox = BoxLayout(orientation = 'horizontal', size_hint = (1.0, 0.1))
+		self.__exportPowerOfTwoCheckbox = CheckBox(active = True, size_hint = (0.3, 1.0))
+		exportPowerOfTwoBox.add_widget(self.__exportPowerOfTwoCheckbox)
+		exportPowerOfTwoBox.add_widget(Label(text = 'Power of two', size_hint = (0.7, 1.0)))
+		self.__exportRightPartBox.add_widget(exportPowerOfTwoBox)
 
 		self.__exportColorToAlphaBox = BoxLayout(orientation = 'vertical', size_hint = (1.0, 0.2))
 		self.__exportColorToAlphaImage = self.__createWhiteImage()
@@ -389,6 +469,15 @@ class LeftMenu:
 		self.__alert = AlertPopUp('Error', '', 'Ok')
 		self.__dialog = Dialog(self.__export, 'Warning', '', 'Ok', 'Cancel')
 
+	def __createExportProgressPopup(self):
+		progressBox = BoxLayout(orientation = 'vertical', size_hint = (1.0, 1.0))
+		self.__exportProgressBar = ProgressBar(max = 100, value = 0, size_hint = (1.0, 0.6))
+		progressBox.add_widget(self.__exportProgressBar)
+		progressBox.add_widget(CancelableButton(text = 'Cancel', on_release = self.__cancelRunningExport,
+			size_hint = (1.0, 0.4)))
+		self.__exportProgressPopup = Popup(title = 'Exporting', auto_dismiss = False, content = progressBox,
+			size_hint = (0.4, 0.25))
+
 	def __init__(self, base, display):
 		self.__displayReference = display
 		self.__baseReference = base
@@ -399,6 +488,7 @@ class LeftMenu:
 		self.__createExportLayout()
 		self.__createExportPopup()
 		self.__createWarnings()
+		self.__createExportProgressPopup()
 
 		self.__showSplitLayout()
 
@@ -412,18 +502,72 @@ class Display:
 
 	def __handleTouchOnSplittedImage(self, img, touch):
 		if (self.__changeAlphaColorMethodReference is not None and img.collide_point(*touch.pos) == True):
+			index = self.__tilesListView.getIndexOfView(self.__imageToListItem[img])
+			if (index is None):
+				return
+
 			point = img.to_local(touch.pos[0], touch.pos[1], True)
-			adjY = img.texture_size[1] - int(point[1]) - 1
-			pixelAddress = ((adjY * img.texture_size[0]) + int(point[0]) - 1) * 4
+			# Tiles are regions of the base image, picking from it keeps a single cached buffer for all of them.
+			x, y, w, h = self.__imagesRects[index]
+			pointX = min(max(int(point[0]), 0), w - 1)
+			pointY = min(max(int(point[1]), 0), h - 1)
 			self.__changeAlphaColorMethodReference(
-				[img.texture.pixels[pixelAddress], img.texture.pixels[pixelAddress + 1],
-				img.texture.pixels[pixelAddress + 2], img.texture.pixels[pixelAddress + 3]]
+				list(PixelCache.Instance().getPixel(self.__baseImage, x + pointX, y + pointY))
 			)
 
+	def __handleTileCheckbox(self, checkbox, value):
+		index = self.__tilesListView.getIndexOfView(self.__checkBoxToListItem[checkbox])
+		if (index is not None):
+			self.__selection.set(index, value)
+
+	def __createTileView(self):
+		return Image(size_hint = (None, None))
+
+	def __bindTileView(self, img, index):
+		x, y, w, h = self.__imagesRects[index]
+		img.texture = self.__baseImage.texture.get_region(x, y, w, h)
+		img.size = (w, h)
+
+	def __createTileListView(self):
+		x, y = self.__listCellSize
+		item = BoxLayout(orientation = 'horizontal', size_hint = (None, None), size = (x * 2, y))
+		checkbox = CheckBox(active = True, size_hint = (None, None), size = (x, y))
+		checkbox.bind(active = self.__handleTileCheckbox)
+		imgLayout = BoxLayout(orientation = 'vertical', size_hint = (None, None), size = (x, y))
+		img = Image(on_touch_up = self.__handleTouchOnSplittedImage, size_hint = (None, None))
+		imgLayout.add_widget(img)
+		item.add_widget(checkbox)
+		item.add_widget(imgLayout)
+
+		self.__listItemParts[item] = (checkbox, imgLayout, img)
+		self.__checkBoxToListItem[checkbox] = item
+		self.__imageToListItem[img] = item
+		return item
+
+	def __bindTileListView(self, item, index):
+		checkbox, imgLayout, img = self.__listItemParts[item]
+		x, y = self.__listCellSize
+		item.size = (x * 2, y)
+		checkbox.size = (x, y)
+		imgLayout.size = (x, y)
+		self.__bindTileView(img, index)
+		checkbox.active = self.__selection.get(index)
+
+	def __showGrid(self):
+		if (self.__grid.parent is not self.__scrollView):
+			self.__scrollView.clear_widgets()
+			self.__scrollView.add_widget(self.__grid)
 
 	def __init__(self, base,  maxWidthProportion = 0.75, maxHeightProportion = 1.0):
-		self.__imagesList = []
-		self.__checkBoxList = []
+		self.__imagesRects = []
+		self.__selection = BitArray(0)
+		self.__listCellSize = (1, 1)
+		self.__listItemParts = {}
+		self.__checkBoxToListItem = {}
+		self.__imageToListItem = {}
+		self.__baseArray = None
+		self.__exportWorker = None
+		self.__exportFinishedMethod = None
 		self.__maxWidthProportion = maxWidthProportion
 		self.__maxHeightProportion = maxHeightProportion
 		self.__maxWidthToShow = 400
@@ -438,21 +582,30 @@ class Display:
 		self.__scrollView.add_widget(self.__grid)
 		base.add_widget(self.__scrollView)
 
+		# Only the tiles seen through the scroll view get widgets, so sheets with thousands of tiles stay responsive.
+		self.__tilesView = RecycleGridView(self.__scrollView, self.__createTileView, self.__bindTileView)
+		self.__tilesListView = RecycleGridView(self.__scrollView, self.__createTileListView,
+			self.__bindTileListView)
+
 		self.__state = DisplayStates.showingNoImage
 
 		self.updateLayoutSizes()
 
 	def clearImage(self):
 		self.__state = DisplayStates.showingNoImage
+		self.__showGrid()
 		self.__grid.clear_widgets()
 		self.__baseImage = None
+		self.__baseArray = None
 		self.__grid.cols = 1
 		self.__grid.rows = 1
 		self.__grid.size = (1, 1)
 
 	def setBaseImage(self, imageSrc):
+		self.__showGrid()
 		self.__grid.clear_widgets()
 		self.__baseImage = Image(source = imageSrc)
+		self.__baseArray = loadImageArray(imageSrc)
 		self.__grid.cols = 1
 		self.__grid.rows = 1
 		self.__grid.size = self.__baseImage.texture_size
@@ -461,8 +614,11 @@ class Display:
 
 	def showSingleBaseImage(self):
 		self.__state = DisplayStates.showingBaseImage
-		self.__imagesList = []
-		self.__checkBoxList = []
+		self.__imagesRects = []
+		self.__selection = BitArray(0)
+		self.__tilesView.setItems(0, 1, (1, 1))
+		self.__tilesListView.setItems(0, 1, (1, 1))
+		self.__showGrid()
 		self.__grid.clear_widgets()
 		self.__baseImage.size = self.__baseImage.texture_size
 		self.__grid.cols = 1
@@ -472,216 +628,84 @@ class Display:
 
 	def showSplittedImages(self, width, height ):
 		self.__state = DisplayStates.showingSplitResult
-		self.__grid.clear_widgets()
-		numberOfImages = len(self.__imagesList)
-		if (numberOfImages != 0):
-			dist = 1
-			while (dist * dist < numberOfImages):
-				dist += 1
-
-			self.__grid.cols = dist
-			self.__grid.rows = dist
-			self.__grid.spacing = 10
+		numberOfImages = len(self.__imagesRects)
+		dist = 1
+		while (dist * dist < numberOfImages):
+			dist += 1
 
-			for img in self.__imagesList:
-				self.__grid.add_widget(img)
-
-			self.__grid.size = (dist * (width + 10) - 10, dist * (height + 10))
+		self.__tilesView.setItems(numberOfImages, dist, (width, height), 10)
+		self.__tilesView.show()
 
 	def showSplittedImagesList(self, changeAlphaColorByTouchReference):
 		self.__state = DisplayStates.showingSplitList
-		self.__grid.clear_widgets()
-		self.__grid.spacing = 0
-		numberOfImages = len(self.__imagesList)
+		self.__changeAlphaColorMethodReference = changeAlphaColorByTouchReference
+		numberOfImages = len(self.__imagesRects)
 		if (numberOfImages != 0):
-			self.__grid.cols = 2
-			self.__grid.rows = numberOfImages
-
-			gridHeight = 0
-			for img in self.__imagesList:
-				x = Window.size[0] * self.__maxWidthProportion/2
-				if (img.size[1] > self.__maxHeightToShow):
-					y = self.__maxHeightToShow
-				else:
-					y = img.size[1]
-
-				imgLayout = BoxLayout(orientation = 'vertical', size = (x, y))
-				self.__changeAlphaColorMethodReference = changeAlphaColorByTouchReference
-
-				checkbox = CheckBox(active = True, size_hint = (None, None), size = (x, y))
-				imgLayout.add_widget(img)
-				self.__checkBoxList.append(checkbox)
-				self.__grid.add_widget(checkbox)
-				self.__grid.add_widget(imgLayout)
-				gridHeight += y
-
+			x = Window.size[0] * self.__maxWidthProportion/2
+			y = min(self.__imagesRects[0][3], self.__maxHeightToShow)
+		else:
+			x, y = (1, 1)
 
-			self.__grid.size = (Window.size[0] * self.__maxWidthProportion, gridHeight)
+		self.__listCellSize = (x, y)
+		self.__tilesListView.setItems(numberOfImages, 1, (x * 2, y))
+		self.__tilesListView.show()
 
 	def updateDisplayRelative(self, partitionOnX, partitionOnY):
 		if (self.__state != DisplayStates.showingBaseImage and self.__state != DisplayStates.showingSplitResult):
 			return
 
-		width = self.__baseImage.texture_size[0] / partitionOnX
-		height = self.__baseImage.texture_size[1] / partitionOnY
+		if (partitionOnX > self.__baseImage.texture_size[0] or partitionOnY > self.__baseImage.texture_size[1]):
+			return
 
-		self.updateDisplay(width, height, 0, 0)
+		self.__showSplitGrid(splitImageArrayRelative(self.__baseArray, partitionOnX, partitionOnY))
 
 	def updateDisplay(self, width, height, startX, startY):
 		if (self.__state != DisplayStates.showingBaseImage and self.__state != DisplayStates.showingSplitResult):
 			return
 
-		self.__changeAlphaColorMethodReference = None
-		xList = range(startX, self.__baseImage.texture_size[0] + 1, width)
-		yList = range(startY, self.__baseImage.texture_size[1] + 1, height)
-		yList.reverse()
-
-		self.__imagesList = []
-
-		for y in yList:
-			for x in xList:
-				if (x + width > self.__baseImage.texture_size[0] or y + height > self.__baseImage.texture_size[1]):
-					continue
-
-				newTexture = self.__baseImage.texture.get_region(x, y, width, height)
-				formerColor = []
-				isValid = False
-				i= 0
-				for pixel in newTexture.pixels:
-					if (len(formerColor) != 4):
-						formerColor.append(pixel)
-					else:
-						if (formerColor[i] != pixel):
-							isValid = True
-							break
-						i = (i + 1) % 4
-
-				if (isValid == True):
-					self.__imagesList.append(
-						Image(texture = newTexture, on_touch_up = self.__handleTouchOnSplittedImage,
-						size = (width, height), size_hint = (None, None))
-					)
+		self.__showSplitGrid(splitImageArray(self.__baseArray, width, height, startX, startY))
 
+	def __showSplitGrid(self, splitGrid):
+		self.__changeAlphaColorMethodReference = None
+		# Uniform tiles were already discarded by the split engine, every kept one starts selected.
+		self.__imagesRects = splitGrid.getValidRects().tolist()
+		self.__selection = BitArray(len(self.__imagesRects), True)
 
+		width, height = splitGrid.getTileSize()
 		self.showSplittedImages(width, height)
 
-	def __setBufferRegion(self, buf, x, y, width, height, image, alphaToReplace):
-
-		index = (y * width) + x
-		i = 0
-		j = 0
-		rgbaList = []
-		for p in image.texture.pixels:
-			if (len(rgbaList) == 4):
-				buf[index + i] = rgbaList[0]
-				buf[index + i + 1] = rgbaList[1]
-				buf[index + i + 2] = rgbaList[2]
-				buf[index + i + 3] = rgbaList[3]
-				i += 4
-
-			if (i == (image.texture_size[x] * 4)):
-				j += 1
-				index = ((y+j) * width) + x
-
-			rgbaList.append(p)
-
 	def countSelectedImages(self):
-		i = 0
-		for check in self.__checkBoxList:
-			if check.active == True:
-				i += 1
-		return i
+		return self.__selection.count()
 
-	def saveSelectedImages(self, filename, colorToAlpha = None, divs = None):
-		if (self.__state != DisplayStates.showingSplitList or len(self.__checkBoxList) == 0):
+	def saveSelectedImages(self, filename, finishedMethod, progressMethod = None, colorToAlpha = None, divs = None,
+			dedupe = False, tolerance = 0, maxSize = 4096, powerOfTwo = True):
+		if (self.__state != DisplayStates.showingSplitList or len(self.__imagesRects) == 0 or
+				self.__exportWorker is not None):
 			return False
 
-		imagesSelected = []
-		i = 0
-		for check in self.__checkBoxList:
-			if check.active == True:
-				imagesSelected.append(self.__imagesList[i])
+		rectsSelected = []
+		for index in self.__selection.getSetIndexes():
+			rectsSelected.append(self.__imagesRects[index])
 
-			i += 1
-
-		if (len(imagesSelected) == 0):
-			return False
-
-		if (divs is None or len(divs) != 2):
-			x, y = 1, 1
-			xTurn = True
-			while x * y < len(imagesSelected):
-				if (xTurn == True):
-					x += 1
-				else:
-					y += 1
-				xTurn = not xTurn
-
-			divs = (x, y)
-
-		newSize = (imagesSelected[0].texture_size[0] * divs[0], imagesSelected[1].texture_size[1] * divs[1])
-		newTexture = Texture.create(size = newSize)
-		newBuffer = ''
-		k = 0
-		for i in range(divs[1]):
-			imagesToUse = []
-			for j in range(divs[0]):
-				if (k < len(imagesSelected)):
-					imagesToUse.append(CacheImage(imagesSelected[k]))
-				else:
-					imagesToUse.append(None)
-				k += 1
-
-			for line in range(imagesSelected[0].texture_size[1]):
-				for img in imagesToUse:
-					newBuffer += self.__readLineFromImage(img, line, imagesSelected[0].texture_size[0], colorToAlpha)
-
-
-		newTexture.blit_buffer(newBuffer, colorfmt='rgba', bufferfmt='ubyte')
-		newTexture.flip_vertical()
-		newCoreImage = CoreImage(newTexture)
-		newCoreImage.save(filename + '.png')
-
-
-		try:
-			exporter = SplittedImageMap(filename + '.png', len(imagesSelected), divs, newSize)
-			exporter.exportToOpf(filename + '.opf')
-		except Exception, e:
-			print str(e)
+		if (len(rectsSelected) == 0):
 			return False
 
+		# Tiles are copied straight from the array read when the image was opened, nothing is read back from the
+		# gpu, so the whole export runs away from the kivy thread.
+		self.__exportFinishedMethod = finishedMethod
+		self.__exportWorker = AtlasExportWorker(self.__baseArray, rectsSelected, filename, self.__finishExport,
+			progressMethod, colorToAlpha, divs, dedupe, tolerance, maxSize, powerOfTwo)
+		self.__exportWorker.start()
 
 		return True
 
-	def __readLineFromImage(self, img, line, xSize, colorToAlpha):
-		buf = ''
-		if (img is None):
-			i = 0
-			while i < xSize * 4:
-				buf += chr(0xFF)
-				i += 1
+	def __finishExport(self, worker):
+		self.__exportWorker = None
+		self.__exportFinishedMethod(worker)
 
-		else:
-			address = line * xSize * 4
-			i = 0
-			pixels = img.getPixels()
-			rgba = []
-			while i < xSize * 4:
-				rgba.append(pixels[address + i])
-				i += 1
-
-				if (len(rgba) == 4):
-					if (colorToAlpha is not None and rgba[0] == colorToAlpha[0] and rgba[1] == colorToAlpha[1] and
-							rgba[2] == colorToAlpha[2]):
-						rgba[3] = chr(0x00);
-					buf += chr(ord(rgba[0]))
-					buf += chr(ord(rgba[1]))
-					buf += chr(ord(rgba[2]))
-					buf += chr(ord(rgba[3]))
-					rgba = []
-
-
-		return buf
+	def cancelExport(self):
+		if (self.__exportWorker is not None):
+			self.__exportWorker.cancel()
 
 	def updateLayoutSizes(self):
 		wx, wy = Window.size
@@ -694,12 +718,8 @@ class Display:
 	def getState(self):
 		return self.__state
 
-class CacheImage:
-	def __init__(self, baseImage):
-		self.__pixels = baseImage.texture.pixels
-
-	def getPixels(self):
-		return self.__pixels
+	def getBaseArray(self):
+		return self.__baseArray
 
 class TileSplitter(App):
 
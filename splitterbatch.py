@@ -0,0 +1,178 @@
+#!/usr/bin/python
+from os import environ
+
+# Kivy would otherwise try to parse the batch options as its own.
+environ['KIVY_NO_ARGS'] = '1'
+
+from argparse import ArgumentParser
+from glob import glob
+from multiprocessing import Pool, cpu_count
+from os.path import isdir, join, basename, dirname, splitext
+from time import time
+from sys import exit
+
+from imagebuffer import loadImageArray
+from splitengine import splitImageArray, splitImageArrayRelative, exportAtlas
+
+class SplitJob:
+	def __init__(self, source, outputBase, absoluteSplit, relativeSplit, colorToAlpha, divs, dedupe, tolerance,
+			maxSize, powerOfTwo):
+		self.source = source
+		self.outputBase = outputBase
+		self.absoluteSplit = absoluteSplit
+		self.relativeSplit = relativeSplit
+		self.colorToAlpha = colorToAlpha
+		self.divs = divs
+		self.dedupe = dedupe
+		self.tolerance = tolerance
+		self.maxSize = maxSize
+		self.powerOfTwo = powerOfTwo
+
+def processSplitJob(job):
+	startTime = time()
+	try:
+		imageArray = loadImageArray(job.source)
+		if (job.absoluteSplit is not None):
+			splitGrid = splitImageArray(imageArray, *job.absoluteSplit)
+		else:
+			partitionOnX, partitionOnY = job.relativeSplit
+			splitGrid = splitImageArrayRelative(imageArray, partitionOnX, partitionOnY)
+
+		rects = splitGrid.getValidRects().tolist()
+		if (rects == []):
+			return (job.source, 0, time() - startTime, 'no tile left after the split')
+
+		numberOfTiles = exportAtlas(imageArray, rects, job.outputBase, job.colorToAlpha, job.divs, job.dedupe,
+			job.tolerance, job.maxSize, job.powerOfTwo)
+
+	except Exception, e:
+		return (job.source, 0, time() - startTime, str(e))
+
+	return (job.source, numberOfTiles, time() - startTime, None)
+
+def collectSheets(entries):
+	sheets = []
+	for entry in entries:
+		if (isdir(entry) == True):
+			found = glob(join(entry, '*.png'))
+		else:
+			found = glob(entry)
+
+		for path in sorted(found):
+			if (path[-4:] == '.png' and path not in sheets):
+				sheets.append(path)
+
+	return sheets
+
+def parseHexColor(value):
+	value = value.lstrip('#')
+	if (len(value) != 6):
+		raise ValueError('color must be given as RRGGBB')
+	return [int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16), 0xFF]
+
+def createArgumentParser():
+	parser = ArgumentParser(description = 'Splits sprite sheets into .png/.opf atlases without a display.')
+	parser.add_argument('sheets', nargs = '+', help = 'png files, directories or glob patterns to split')
+
+	absoluteGroup = parser.add_argument_group('absolute split')
+	absoluteGroup.add_argument('--width', type = int, help = 'width of each tile')
+	absoluteGroup.add_argument('--height', type = int, help = 'height of each tile')
+	absoluteGroup.add_argument('--initial-x', type = int, default = 0, help = 'x where the split starts')
+	absoluteGroup.add_argument('--initial-y', type = int, default = 0, help = 'y where the split starts')
+
+	relativeGroup = parser.add_argument_group('relative split')
+	relativeGroup.add_argument('--partitions-x', type = int, help = 'number of partitions on x')
+	relativeGroup.add_argument('--partitions-y', type = int, help = 'number of partitions on y')
+
+	exportGroup = parser.add_argument_group('export')
+	exportGroup.add_argument('--output-dir', help = 'where the atlases are written, defaults to each sheet directory')
+	exportGroup.add_argument('--suffix', default = '_atlas', help = 'appended to each sheet name (default: _atlas)')
+	exportGroup.add_argument('--divisions', type = int, nargs = 2, metavar = ('X', 'Y'),
+		help = 'grid atlas divisions, tiles are bin packed when omitted')
+	exportGroup.add_argument('--max-size', type = int, default = 4096,
+		help = 'largest side of a packed atlas (default: 4096)')
+	exportGroup.add_argument('--no-power-of-two', dest = 'power_of_two', action = 'store_false',
+		help = 'let packed atlases have sides that are not powers of two')
+	exportGroup.add_argument('--color-to-alpha', type = parseHexColor, metavar = 'RRGGBB',
+		help = 'color replaced by alpha 0 on the atlas')
+	exportGroup.add_argument('--dedupe', action = 'store_true', help = 'export a single copy of identical tiles')
+	exportGroup.add_argument('--tolerance', type = int, default = 0,
+		help = 'largest channel difference for tiles to be merged by --dedupe (default: 0, exact match)')
+
+	parser.add_argument('--workers', type = int, default = cpu_count(),
+		help = 'number of worker processes (default: number of cores)')
+
+	return parser
+
+def main():
+	parser = createArgumentParser()
+	args = parser.parse_args()
+
+	absoluteSplit = None
+	relativeSplit = None
+	if (args.width is not None or args.height is not None):
+		if (args.width is None or args.height is None or args.width <= 0 or args.height <= 0 or
+				args.initial_x < 0 or args.initial_y < 0):
+			parser.error('absolute split needs positive --width and --height and non negative initial values')
+		absoluteSplit = (args.width, args.height, args.initial_x, args.initial_y)
+
+	if (args.partitions_x is not None or args.partitions_y is not None):
+		if (args.partitions_x is None or args.partitions_y is None or args.partitions_x <= 0 or
+				args.partitions_y <= 0):
+			parser.error('relative split needs positive --partitions-x and --partitions-y')
+		relativeSplit = (args.partitions_x, args.partitions_y)
+
+	if ((absoluteSplit is None) == (relativeSplit is None)):
+		parser.error('exactly one of the absolute or relative split must be given')
+
+	if (args.max_size <= 0):
+		parser.error('max size must be positive')
+
+	if (args.tolerance < 0):
+		parser.error('tolerance must not be negative')
+
+	if (args.divisions is not None and (args.divisions[0] <= 0 or args.divisions[1] <= 0)):
+		parser.error('divisions must be positive')
+
+	sheets = collectSheets(args.sheets)
+
+	jobs = []
+	for source in sheets:
+		name = splitext(basename(source))[0]
+		if (args.suffix != '' and name.endswith(args.suffix) == True):
+			# Atlas written by a former run.
+			continue
+
+		name += args.suffix
+		if (args.output_dir is None):
+			outputBase = join(dirname(source), name)
+		else:
+			outputBase = join(args.output_dir, name)
+		jobs.append(SplitJob(source, outputBase, absoluteSplit, relativeSplit, args.color_to_alpha, args.divisions,
+			args.dedupe, args.tolerance, args.max_size, args.power_of_two))
+
+	if (jobs == []):
+		parser.error('no png file found')
+
+	numberOfWorkers = max(1, min(args.workers, len(jobs)))
+	startTime = time()
+	failures = 0
+	pool = Pool(numberOfWorkers)
+	try:
+		for source, numberOfTiles, elapsed, error in pool.imap_unordered(processSplitJob, jobs):
+			if (error is None):
+				print '%8.3fs  %5d tiles  %s' % (elapsed, numberOfTiles, source)
+			else:
+				failures += 1
+				print '%8.3fs  failed       %s: %s' % (elapsed, source, error)
+	finally:
+		pool.close()
+		pool.join()
+
+	print '%d sheet(s) in %.3fs using %d worker(s), %d failure(s).' % (len(jobs), time() - startTime,
+		numberOfWorkers, failures)
+
+	return 1 if failures != 0 else 0
+
+if __name__ == '__main__':
+	exit(main())
@@ -0,0 +1,172 @@
+from singleton import Singleton
+
+from kivy.graphics.texture import Texture
+
+from numpy import zeros, ascontiguousarray, uint8
+
+from atlaspacker import MaxRectsBin
+
+class TextureAtlasPage:
+	# One shared texture and a copy of its pixels, kept to fill the texture again when the gl context is lost.
+	def _reloadTexture(self, texture):
+		texture.blit_buffer(self.__array.tobytes(), colorfmt = 'rgba', bufferfmt = 'ubyte')
+
+	def __init__(self, width, height, padding):
+		self.__array = zeros((height, width, 4), dtype = uint8)
+		self.__texture = Texture.create(size = (width, height), colorfmt = 'rgba')
+		self.__texture.add_reload_observer(self._reloadTexture)
+		self._reloadTexture(self.__texture)
+		self.__padding = padding
+		self.__bin = MaxRectsBin(width - padding, height - padding, padding)
+		self.__numberOfRegions = 0
+
+	def insert(self, imageArray):
+		height, width = imageArray.shape[:2]
+		position = self.__bin.insert(width, height)
+		if (position is None):
+			return None
+
+		# Edge pixels are repeated over the padding, so filtering at the border of a region never reads its
+		# neighbours.
+		border = self.__padding // 2
+		blockX, blockY = position
+		blockWidth = width + 2 * border
+		blockHeight = height + 2 * border
+		block = self.__array[blockY:blockY + blockHeight, blockX:blockX + blockWidth]
+		block[border:border + height, border:border + width] = imageArray
+		block[:border, border:border + width] = imageArray[:1]
+		block[border + height:, border:border + width] = imageArray[-1:]
+		block[:, :border] = block[:, border:border + 1]
+		block[:, border + width:] = block[:, border + width - 1:border + width]
+
+		self.__texture.blit_buffer(ascontiguousarray(block).tobytes(), pos = (blockX, blockY),
+			size = (blockWidth, blockHeight), colorfmt = 'rgba', bufferfmt = 'ubyte')
+		self.__numberOfRegions += 1
+		return (blockX + border, blockY + border)
+
+	def release(self, x, y, width, height):
+		self.__numberOfRegions -= 1
+		if (self.__numberOfRegions == 0):
+			# Nothing left on the page, its space is whole again instead of split into the freed rects.
+			self.__bin = MaxRectsBin(self.__array.shape[1] - self.__padding, self.__array.shape[0] - self.__padding,
+				self.__padding)
+		else:
+			border = self.__padding // 2
+			self.__bin.free(x - border, y - border, width, height)
+
+	def isEmpty(self):
+		return self.__numberOfRegions == 0
+
+	def getTexture(self):
+		return self.__texture
+
+	def getArray(self):
+		return self.__array
+
+class AtlasRegion:
+	def __init__(self, page, x, y, width, height):
+		self.__page = page
+		self.__rect = (x, y, width, height)
+		self.__texture = page.getTexture().get_region(x, y, width, height)
+
+	def getPage(self):
+		return self.__page
+
+	def getRect(self):
+		return self.__rect
+
+	def getSize(self):
+		return self.__rect[2:]
+
+	# Texture of the region, shared by everyone holding the region.
+	def getTexture(self):
+		return self.__texture
+
+	# Read only view of the pixels, following the imagebuffer convention.
+	def getArray(self):
+		x, y, width, height = self.__rect
+		return self.__page.getArray()[y:y + height, x:x + width]
+
+class TextureAtlas:
+	# Packs images into a few large textures so that drawing many of them binds the same texture over and over.
+	# Images too large for a page get a page of their own.
+
+	def __init__(self, pageSize = 2048, padding = 2):
+		self.__pageSize = pageSize
+		self.__padding = padding
+		self.__pages = []
+
+	def allocate(self, imageArray):
+		height, width = imageArray.shape[:2]
+		if (width + self.__padding > self.__pageSize or height + self.__padding > self.__pageSize):
+			# Never shared, the page goes away with its region.
+			page = TextureAtlasPage(width + self.__padding, height + self.__padding, self.__padding)
+			position = page.insert(imageArray)
+		else:
+			position = None
+			for page in self.__pages:
+				position = page.insert(imageArray)
+				if (position is not None):
+					break
+
+			if (position is None):
+				page = TextureAtlasPage(self.__pageSize, self.__pageSize, self.__padding)
+				self.__pages.append(page)
+				position = page.insert(imageArray)
+
+		return AtlasRegion(page, position[0], position[1], width, height)
+
+	def release(self, region):
+		page = region.getPage()
+		page.release(*region.getRect())
+		# The first page stays for the next allocations, any other empty one goes away with its memory.
+		if (page.isEmpty() == True and page in self.__pages[1:]):
+			self.__pages.remove(page)
+
+	def getNumberOfPages(self):
+		return len(self.__pages)
+
+@Singleton
+class ThumbnailAtlas(TextureAtlas):
+	def __init__(self):
+		TextureAtlas.__init__(self, 1024)
+
+@Singleton
+class SpriteAtlas(TextureAtlas):
+	# Every placed instance of a sprite shares one region, found by a (source, coordinates, size) key and freed with
+	# its last instance.
+
+	def __init__(self):
+		TextureAtlas.__init__(self, 2048)
+		self.__keyToRegion = {}
+		self.__regionToKey = {}
+		self.__references = {}
+
+	# Shared region of the sprite, or None when it has to be added.
+	def acquireSprite(self, key):
+		region = self.__keyToRegion.get(key)
+		if (region is not None):
+			self.__references[region] += 1
+		return region
+
+	def addSprite(self, key, imageArray):
+		region = self.allocate(imageArray)
+		self.__keyToRegion[key] = region
+		self.__regionToKey[region] = key
+		self.__references[region] = 1
+		return region
+
+	def releaseSprite(self, region):
+		self.__references[region] -= 1
+		if (self.__references[region] == 0):
+			del self.__references[region]
+			key = self.__regionToKey.pop(region)
+			if (self.__keyToRegion.get(key) is region):
+				del self.__keyToRegion[key]
+			self.release(region)
+
+	# The file changed, sprites placed from now on get the new pixels while the former instances keep theirs.
+	def invalidateSource(self, source):
+		for key in self.__keyToRegion.keys():
+			if (key[0] == source):
+				del self.__keyToRegion[key]
@@ -0,0 +1,240 @@
+from singleton import Singleton
+
+from kivy.clock import Clock
+
+from hashlib import sha1
+from json import dumps, loads
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from os import environ, listdir, makedirs, rename, remove, stat, utime
+from os.path import join, isdir, isfile, expanduser
+from threading import Lock
+from Queue import Queue, Empty
+
+from imagebuffer import loadImageArray, shrinkImageArray, saveImageArray
+from textureatlas import ThumbnailAtlas
+
+class ThumbnailJob:
+	# Every thumbnail wanted from one image file, so the file is decoded at most once for all of them.
+	def __init__(self, path):
+		self.path = path
+		self.requests = []
+
+@Singleton
+class ThumbnailCache:
+	# Thumbnails are made on a thread pool and stored on disk, in a per user cache directory, under a hash of the
+	# image content, the region and the thumbnail size, so they survive renames and are never stale. Content hashes
+	# are kept there too by modification time and size, and the least recently used thumbnails are removed past
+	# maxCacheSize bytes. Finished thumbnails are packed into the thumbnail atlas on the kivy thread, a limited
+	# number per frame.
+
+	def __init__(self, thumbnailSize = (64, 64), cacheDirectory = None, numberOfWorkers = None,
+			maxCacheSize = 64 << 20):
+		if (cacheDirectory is None):
+			cacheDirectory = join(environ.get('XDG_CACHE_HOME', join(expanduser('~'), '.cache')), 'orxEditor',
+				'thumbnails')
+		if (numberOfWorkers is None):
+			numberOfWorkers = max(1, cpu_count() - 1)
+
+		self.__thumbnailSize = thumbnailSize
+		self.__cacheDirectory = cacheDirectory
+		self.__maxCacheSize = maxCacheSize
+		self.__pool = ThreadPool(numberOfWorkers)
+		self.__finished = Queue()
+		self.__pendingJobs = {}
+		self.__numberOfPending = 0
+		self.__texturesPerFrame = 128
+		self.__hashLock = Lock()
+		self.__hashesPath = join(cacheDirectory, 'hashes.json')
+		self.__contentHashes = self.__loadContentHashes()
+		self.__hashesChanged = False
+
+	def __loadContentHashes(self):
+		contentHashes = {}
+		try:
+			f = open(self.__hashesPath, 'r')
+			data = loads(f.read())
+			f.close()
+			for path, (mtime, size, contentHash) in data.items():
+				contentHashes[path] = ((mtime, size), contentHash)
+		except (IOError, ValueError, TypeError):
+			# Missing or unreadable, hashes are computed again.
+			pass
+		return contentHashes
+
+	def __makeCacheDirectory(self):
+		if (isdir(self.__cacheDirectory) == False):
+			try:
+				makedirs(self.__cacheDirectory)
+			except OSError:
+				# Another worker may have created it meanwhile.
+				pass
+
+	def __saveContentHashes(self):
+		with self.__hashLock:
+			data = {}
+			for path, ((mtime, size), contentHash) in self.__contentHashes.items():
+				data[path] = (mtime, size, contentHash)
+			self.__hashesChanged = False
+
+		try:
+			self.__makeCacheDirectory()
+			temporaryPath = self.__hashesPath + '.' + str(id(data)) + '.tmp'
+			f = open(temporaryPath, 'w')
+			f.write(dumps(data))
+			f.close()
+			rename(temporaryPath, self.__hashesPath)
+		except (IOError, OSError), e:
+			print 'Unable to save the thumbnail hashes: ' + str(e)
+
+	# Removes the least recently used thumbnails until the directory holds at most maxCacheSize bytes of them.
+	def __trimCache(self):
+		try:
+			names = listdir(self.__cacheDirectory)
+		except OSError:
+			return
+
+		thumbnails = []
+		totalSize = 0
+		for name in names:
+			if (name[-4:] != '.png'):
+				continue
+			try:
+				fileInfo = stat(join(self.__cacheDirectory, name))
+			except OSError:
+				continue
+			thumbnails.append((fileInfo.st_mtime, fileInfo.st_size, name))
+			totalSize += fileInfo.st_size
+
+		thumbnails.sort()
+		for mtime, size, name in thumbnails:
+			if (totalSize <= self.__maxCacheSize):
+				break
+			try:
+				remove(join(self.__cacheDirectory, name))
+			except OSError:
+				pass
+			totalSize -= size
+
+	def __finishBatch(self):
+		if (self.__hashesChanged == True):
+			self.__saveContentHashes()
+		self.__trimCache()
+
+	def __getContentHash(self, path):
+		fileInfo = stat(path)
+		stamp = (fileInfo.st_mtime, fileInfo.st_size)
+		with self.__hashLock:
+			if (path in self.__contentHashes and self.__contentHashes[path][0] == stamp):
+				return self.__contentHashes[path][1]
+
+		digest = sha1()
+		f = open(path, 'rb')
+		while True:
+			data = f.read(1 << 20)
+			if (data == b''):
+				break
+			digest.update(data)
+		f.close()
+
+		contentHash = digest.hexdigest()
+		with self.__hashLock:
+			self.__contentHashes[path] = (stamp, contentHash)
+			self.__hashesChanged = True
+		return contentHash
+
+	def __getCachePath(self, contentHash, region):
+		key = '%s %s %s' % (contentHash, region, self.__thumbnailSize)
+		return join(self.__cacheDirectory, sha1(key.encode('utf-8')).hexdigest() + '.png')
+
+	def __storeThumbnail(self, cachePath, thumbnail):
+		self.__makeCacheDirectory()
+
+		# Written aside and renamed so a reader never sees a partial file.
+		temporaryPath = cachePath + '.' + str(id(thumbnail)) + '.tmp'
+		saveImageArray(temporaryPath, thumbnail)
+		try:
+			rename(temporaryPath, cachePath)
+		except OSError:
+			remove(temporaryPath)
+
+	def __runJob(self, job):
+		try:
+			contentHash = self.__getContentHash(job.path)
+		except Exception, e:
+			print 'Unable to read ' + job.path + ': ' + str(e)
+			self.__finished.put((job, None))
+			return
+
+		imageArray = None
+		for region, finishedMethod in job.requests:
+			cachePath = self.__getCachePath(contentHash, region)
+			thumbnail = None
+			try:
+				if (isfile(cachePath) == True):
+					try:
+						thumbnail = loadImageArray(cachePath)
+						# Marks it as recently used for the trimming.
+						utime(cachePath, None)
+					except Exception:
+						# Removed by the trimming meanwhile, made again below.
+						thumbnail = None
+				if (thumbnail is None):
+					if (imageArray is None):
+						imageArray = loadImageArray(job.path)
+					if (region is None):
+						thumbnail = shrinkImageArray(imageArray, *self.__thumbnailSize)
+					else:
+						x, y, width, height = region
+						thumbnail = shrinkImageArray(imageArray[y:y + height, x:x + width], *self.__thumbnailSize)
+					self.__storeThumbnail(cachePath, thumbnail)
+			except Exception, e:
+				print 'Unable to create the thumbnail of ' + job.path + ': ' + str(e)
+
+			self.__finished.put((finishedMethod, thumbnail))
+
+		self.__finished.put((job, None))
+
+	def __deliverThumbnails(self, *args):
+		for i in range(self.__texturesPerFrame):
+			try:
+				finishedMethod, thumbnail = self.__finished.get_nowait()
+			except Empty:
+				break
+
+			if (isinstance(finishedMethod, ThumbnailJob) == True):
+				self.__numberOfPending -= 1
+				if (self.__numberOfPending == 0):
+					# Saving the hashes and trimming touch the disk, they are left to the workers.
+					self.__pool.apply_async(self.__finishBatch)
+			elif (thumbnail is not None):
+				finishedMethod(ThumbnailAtlas.Instance().allocate(thumbnail))
+
+		if (self.__numberOfPending == 0):
+			return False
+
+	def __flushOnNextFrame(self, *args):
+		self.flush()
+
+	# Asks for the thumbnail of the region (x, y, width, height), or of the whole image when region is None, of the
+	# image at path. finishedMethod is called on the kivy thread with its AtlasRegion, which it must release from
+	# the ThumbnailAtlas once done with it, or never if it fails. Requests
+	# are sent to the workers by flush, or on the next frame otherwise, so those for one file share its decoding.
+	def request(self, path, region, finishedMethod):
+		if (self.__pendingJobs == {}):
+			Clock.schedule_once(self.__flushOnNextFrame, 0)
+		if (path not in self.__pendingJobs):
+			self.__pendingJobs[path] = ThumbnailJob(path)
+		self.__pendingJobs[path].requests.append((region, finishedMethod))
+
+	def flush(self):
+		if (self.__pendingJobs == {}):
+			return
+
+		if (self.__numberOfPending == 0):
+			Clock.schedule_interval(self.__deliverThumbnails, 0)
+
+		for job in self.__pendingJobs.values():
+			self.__numberOfPending += 1
+			self.__pool.apply_async(self.__runJob, (job,))
+		self.__pendingJobs = {}
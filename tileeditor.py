@@ -28,6 +28,10 @@ class TileEditor(App, KeyboardAccess):
 
 	# Overloaded method
 	def _processKeyDown(self, keyboard, keycode, text, modifiers):
+		# Keys typed in the palette search box are not shortcuts.
+		if (ObjectsMenu.Instance().isSearching() == True):
+			return
+
 		if ((len(keycode[1]) == 1 and keycode[1] in 'qwertasdfg\\z\'`xcv') or
 				keycode[1] in ['shift', 'ctrl', 'delete']):
 			self.__sceneHandler.processKeyDown(keyboard, keycode, text, modifiers)
@@ -1,10 +1,9 @@
 from singleton import Singleton
 
-from kivy.uix.image import Image
-
 from editorutils import vector2ToVector3String, strToDoubleFloatTuple, boolToStr, convertKivyCoordToOrxCoord, distance
-from editorutils import isClockWise, createSpriteImage, strToDoubleIntTuple, strToBool
+from editorutils import isClockWise, strToDoubleIntTuple, strToBool, LazySpriteImage
 from editorobjects import BaseObject
+from assetcache import AssetCache
 from communicationobjects import SceneToFilesManager
 from ConfigParser import ConfigParser
 from collisioninfo import CollisionGuardian, CollisionInformation, CollisionPartInformation
@@ -160,7 +159,10 @@ class FilesManager:
 
 		try:
 			for key in tempBaseImages.keys():
-				tempBaseImages[key] = Image(source = key)
+				texture = AssetCache.Instance().acquire(key)
+				tempBaseImages[key] = tuple(texture.size)
+				# Only the size is needed here, the decoded image stays cached for the objects placed below.
+				AssetCache.Instance().release(texture)
 		except Exception, e:
 			raise Exception('Error loading files needed to load the scene: ' + str(e))
 
@@ -172,11 +174,12 @@ class FilesManager:
 				if (fullPath not in tempBaseObjects):
 					coords = self.__getSpriteCoords(parser, name)
 					if (coords == (None, None)):
-						tempBaseObjects[(fullPath, coords)] = BaseObject(tempBaseImages[fullPath], identifier)
+						imageToUse = LazySpriteImage(fullPath, tempBaseImages[fullPath])
+						tempBaseObjects[(fullPath, coords)] = BaseObject(imageToUse, identifier)
 					else:
 						width, height = strToDoubleIntTuple(parser.get(name, 'Size'))
 						x, y = coords
-						imageToUse = createSpriteImage(tempBaseImages[fullPath], x, y, width, height)
+						imageToUse = LazySpriteImage(fullPath, (width, height), (x, y, width, height))
 						textureSize = strToDoubleIntTuple(parser.get(name, 'SpriteSize'))
 						tempBaseObjects[(fullPath, coords)] = BaseObject(imageToUse, identifier, fullPath, (x, y),
 							textureSize)
@@ -267,6 +270,11 @@ class FilesManager:
 			
 		except Exception, e:
 			raise Exception('Error loading the objecs to the list:' + str(e))
+
+		finally:
+			# Placed objects keep their own copy of the pixels.
+			for baseObject in tempBaseObjects.values():
+				baseObject.release()
 		
 		SceneToFilesManager.Instance().setSceneObjectId(int(parser.get(self.__objectListName, 'LastId')))
 							